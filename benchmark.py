@@ -0,0 +1,905 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+# No display needed: the viewer is driven directly, nothing is ever shown on screen
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import Qt, QPointF
+from PIL import Image as PILImage
+from image_loader import load_scaled_image, load_source_image
+from directory_scanner import DirectoryScanner
+from image_viewer import MediaViewer
+from playlist import Playlist
+from session import SessionStore
+from tile_pyramid import open_pyramid
+from tiled_view import TiledImageView
+from memory_budget import memory_budget
+from keyframe_index import open_keyframe_index, scan_packets
+from thumbnail_index import ThumbnailIndex
+from warm_index import warm_indexes
+from render import bgr_format, display_image, native_format, render_bgr_frame, render_pil_image, render_stats, wrap_array
+
+# Common camera / screenshot resolutions, roughly 2, 12, 24 and 48 MP
+IMAGE_SIZES = [(1920, 1080), (4000, 3000), (6000, 4000), (8000, 6000)]
+IMAGE_FORMATS = ['jpg', 'png']
+LABEL_SIZE = (600, 400)
+FRAME_SIZES = [(1280, 720), (1920, 1080), (3840, 2160)]
+# PIL modes seen in the wild (16-bit PNGs, palette GIFs, CMYK JPEGs...) for the convert suite
+PIL_MODES = ['RGB', 'RGBA', 'L', 'LA', 'P', 'PA', '1', 'I;16', 'CMYK', 'YCbCr']
+# (extension, fourcc, size); GIFs are written by PIL
+VIDEO_CLIPS = [('mp4', 'mp4v', (1920, 1080)), ('webm', 'VP80', (1280, 720)), ('gif', None, (480, 270))]
+CLIP_SECONDS = 2
+CLIP_FPS = 30
+SCRUB_CLIP = ('mp4', 'mp4v', (1280, 720), 60)  # Long enough for a useful seek bar
+# Empty files with these extensions make up the scan datasets; the .txt ones are skipped by the scanner
+ENTRY_EXTENSIONS = ['.jpg', '.png', '.mp4', '.txt']
+VIEWER_SIZE = (1200, 600)
+WARM_FILES = 256  # Copies of the 1080p JPEG the warm suite indexes
+# Generated playlists: entries spread over directories of this size, added in batches as the scanner sends them
+PLAYLIST_DIRECTORY_SIZE = 1000
+PLAYLIST_BATCH = 2000
+PLAYLIST_TARGET_BYTES = 40  # Per entry
+# Launch to window on screen, in a fresh process, opening a directory from the command line
+STARTUP_TARGET_MS = 300
+# Run in a fresh interpreter, so nothing the benchmark already imported is cached: prints when the
+# window was on screen, when the first image was, and which heavy modules were loaded before it
+STARTUP_SCRIPT = '''
+import json, sys, time
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv[:1])
+from image_viewer import MediaViewer
+viewer = MediaViewer(paths=sys.argv[1:])
+viewer.show()
+app.processEvents()
+shown = time.time()
+loaded = [name for name in ('cv2', 'numpy', 'PIL') if name in sys.modules]
+label = viewer.active_pane.label
+while (label.pixmap() is None or label.pixmap().isNull()) and time.time() - shown < 30:
+    app.processEvents()
+    time.sleep(0.001)
+first_image = time.time()
+# Images only: flipping through a few and indexing them must not load the video stack
+for _ in range(3):
+    viewer.show_image(viewer.active_pane.current_index + 1)
+viewer.image_prefetcher.executor.shutdown(wait=True)
+viewer.keyframe_executor.shutdown(wait=True)
+print(json.dumps({'shown': shown, 'first_image': first_image, 'loaded_before_shown': loaded,
+                  'cv2_loaded_for_images': 'cv2' in sys.modules}))
+viewer.close()
+'''
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def make_test_image(file_path, width, height):
+    # Smooth gradients plus some noise, so the encoders see something photo-like
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels = pixels + np.random.randint(0, 16, pixels.shape)
+    PILImage.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(file_path)
+
+
+def make_images(directory):
+    file_paths = []
+    for width, height in IMAGE_SIZES:
+        for image_format in IMAGE_FORMATS:
+            file_path = os.path.join(directory, f"{width}x{height}.{image_format}")
+            if not os.path.exists(file_path):
+                make_test_image(file_path, width, height)
+            file_paths.append(file_path)
+    return file_paths
+
+
+def clip_frame(index, width, height):
+    # A gradient that scrolls, so consecutive frames differ like real footage
+    x = (np.arange(width) + index * 8) % width
+    row = (x * 255 // width).astype(np.uint8)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:, :, 0] = row
+    frame[:, :, 1] = (np.arange(height) * 255 // height).astype(np.uint8)[:, None]
+    frame[:, :, 2] = index * 4 % 256
+    return frame
+
+
+def make_clip(file_path, fourcc, width, height, seconds=CLIP_SECONDS):
+    frame_count = seconds * CLIP_FPS
+    if fourcc is None:
+        frames = [PILImage.fromarray(clip_frame(i, width, height)) for i in range(0, frame_count, 3)]
+        frames[0].save(file_path, save_all=True, append_images=frames[1:], duration=1000 * 3 // CLIP_FPS, loop=0)
+        return
+    writer = cv2.VideoWriter(file_path, cv2.VideoWriter_fourcc(*fourcc), CLIP_FPS, (width, height))
+    for i in range(frame_count):
+        writer.write(clip_frame(i, width, height))
+    writer.release()
+
+
+def make_clips(directory):
+    file_paths = []
+    for extension, fourcc, (width, height) in VIDEO_CLIPS:
+        file_path = os.path.join(directory, f"clip_{width}x{height}.{extension}")
+        if not os.path.exists(file_path):
+            make_clip(file_path, fourcc, width, height)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def make_entries(directory, count):
+    # A flat directory of `count` empty files; only names matter to the scanner
+    os.makedirs(directory, exist_ok=True)
+    with os.scandir(directory) as entries:
+        if sum(1 for _ in entries) == count:
+            return directory
+    for i in range(count):
+        open(os.path.join(directory, f"{i:07d}{ENTRY_EXTENSIONS[i % len(ENTRY_EXTENSIONS)]}"), 'w').close()
+    return directory
+
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def bench_decode(file_paths, repeat):
+    # show_image latency without caches: full decode vs. reduced-resolution decode
+    results = []
+    for file_path in file_paths:
+        with PILImage.open(file_path) as image:
+            width, height = image.size
+        full = time_call(lambda: load_scaled_image(file_path, *LABEL_SIZE, reduced=False), repeat)
+        reduced = time_call(lambda: load_scaled_image(file_path, *LABEL_SIZE, reduced=True), repeat)
+        # RGB decodes are cached and resized as they are; only the display-sized result is converted
+        render_stats.reset()
+        source = load_source_image(file_path)
+        conversions = render_stats.snapshot().get('mode', {}).get('copies', 0)
+        assert source.mode != 'RGB' or conversions == 0, f"{file_path}: full-size decode converted"
+        results.append({
+            'file': os.path.basename(file_path),
+            'format': os.path.splitext(file_path)[1][1:],
+            'megapixels': round(width * height / 1e6, 1),
+            'full_ms': round(full * 1000, 2),
+            'reduced_ms': round(reduced * 1000, 2),
+            'speedup': round(full / reduced, 2),
+            'source_mode': source.mode,
+        })
+    return results
+
+
+def legacy_render(frame, width, height):
+    # The old update_video chain: full-size BGR->RGB, full-size upload, then a scale of that copy
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    full = QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.shape[1] * 3, QImage.Format_RGB888).copy()
+    return full.scaled(width, height, Qt.KeepAspectRatio)
+
+
+def bench_render(repeat, frames=60):
+    # Per-frame cost and copy counts of the video render path: decoded BGR frame -> display-sized QImage
+    results = []
+    for width, height in FRAME_SIZES:
+        frame = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        render_stats.reset()
+        seconds = time_call(lambda: [render_bgr_frame(frame, *LABEL_SIZE) for _ in range(frames)], repeat)
+        counts = render_stats.snapshot()
+        per_frame = frames * repeat
+        legacy = time_call(lambda: [legacy_render(frame, *LABEL_SIZE) for _ in range(frames)], repeat)
+        results.append({
+            'frame': f"{width}x{height}",
+            'ms_per_frame': round(seconds / frames * 1000, 3),
+            'legacy_ms_per_frame': round(legacy / frames * 1000, 3),
+            'stages': {stage: {key: value / per_frame for key, value in stage_counts.items()}
+                       for stage, stage_counts in counts.items()},
+        })
+    return results
+
+
+def make_mode_image(mode, width, height):
+    pixels = np.random.randint(0, 256, (height, width, 4), dtype=np.uint8)
+    image = PILImage.fromarray(pixels, 'RGBA')
+    if mode == 'I;16':
+        return PILImage.fromarray(pixels[..., 0].astype(np.uint16) * 257)
+    return image if mode == 'RGBA' else image.convert(mode)
+
+
+def count_conversion(convert, source):
+    # Per call: render_stats counts, whether the QImage shares the buffer it was given rather than
+    # a copy, and the bytes Python allocated beyond that buffer (tracemalloc sees numpy's buffers)
+    render_stats.reset()
+    tracemalloc.start()
+    qt_image = convert(source)
+    extra = tracemalloc.get_traced_memory()[1] - qt_image.buffer.nbytes
+    tracemalloc.stop()
+    counts = render_stats.snapshot()
+    return qt_image, {
+        'allocations': sum(c['allocations'] for c in counts.values()),
+        'copies': sum(c['copies'] for c in counts.values()),
+        'zero_copy': int(qt_image.constBits()) == qt_image.buffer.ctypes.data,
+        'extra_bytes': max(extra, 0),
+    }
+
+
+def bench_convert(repeat, calls=50):
+    # PIL images of every common mode and OpenCV arrays of every layout -> QImage: one export
+    # copy for PIL (none for arrays), a format that matches the pixels, and what setPixmap costs.
+    # PIL images are converted to their display mode first, as load_source_image() does once per decode.
+    results = []
+    width, height = LABEL_SIZE
+    sources = [('pil ' + mode, render_pil_image, display_image(make_mode_image(mode, width, height)))
+               for mode in PIL_MODES]
+    frame = np.random.randint(0, 256, (height * 2, width * 2, 4), dtype=np.uint8)
+    for name, array in [('cv bgra', frame[:height, :width].copy()), ('cv gray', frame[:height, :width, 0].copy()),
+                        ('cv crop', np.ascontiguousarray(frame[..., :3])[height // 2:height // 2 + height, :width])]:
+        sources.append((name, lambda array: wrap_array(array, bgr_format(array) or QImage.Format_BGR888), array))
+    for name, convert, source in sources:
+        qt_image, counts = count_conversion(convert, source)
+        # The QImage must be over the exported buffer itself, and that buffer the only frame-sized allocation
+        assert counts['zero_copy'], f"{name}: QImage doesn't share its buffer"
+        assert counts['extra_bytes'] <= qt_image.buffer.nbytes // 10, f"{name}: {counts['extra_bytes']} extra bytes"
+        seconds = time_call(lambda: [convert(source) for _ in range(calls)], repeat)
+        upload = time_call(lambda: [QPixmap.fromImage(qt_image) for _ in range(calls)], repeat)
+        results.append(dict(counts, source=name, format=int(qt_image.format()), native=native_format(qt_image),
+                            convert_ms=round(seconds / calls * 1000, 3), upload_ms=round(upload / calls * 1000, 3)))
+    return results
+
+
+def resident_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def peak_memory(func):
+    # Peak resident set while func runs, in MB, sampled on a thread so that PIL, OpenCV and Qt
+    # buffers (which Python's allocator never sees) are counted too. Linux only.
+    if not os.path.exists('/proc/self/statm'):
+        return None
+    peak = [resident_bytes()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.002):
+            peak[0] = max(peak[0], resident_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        func()
+    finally:
+        done.set()
+        sampler.join()
+    peak[0] = max(peak[0], resident_bytes())
+    return round(peak[0] / (1024 * 1024), 1)
+
+
+def bench_scan(directory, repeat):
+    # The scanner's run() called directly, so its signals are delivered synchronously
+    scanner = DirectoryScanner([directory])
+    first_batch = []
+    found = []
+    scanner.batch_found.connect(lambda images, videos: first_batch.append(time.perf_counter()))
+    scanner.scan_finished.connect(lambda seen, matched, elapsed: found.append((seen, matched)))
+    timings = []
+    for _ in range(repeat):
+        first_batch.clear()
+        start = time.perf_counter()
+        scanner.run()
+        timings.append((time.perf_counter() - start, first_batch[0] - start if first_batch else None))
+    seconds = statistics.median(t for t, _ in timings)
+    seen, matched = found[-1]
+    return {
+        'entries': seen,
+        'matched': matched,
+        'seconds': round(seconds, 3),
+        'first_batch_ms': round(statistics.median(f for _, f in timings if f is not None) * 1000, 2),
+        'entries_per_second': round(seen / max(seconds, 1e-6)),
+        'peak_rss_mb': peak_memory(scanner.run),
+    }
+
+
+def make_warm_files(directory, source, count=WARM_FILES):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        file_path = os.path.join(directory, f"{i:05d}.jpg")
+        if not os.path.exists(file_path):
+            shutil.copyfile(source, file_path)
+    return directory
+
+
+def bench_warm(directory, index_dir):
+    # Files per second for 1, 2, 4... worker processes, each run into an empty index
+    results = []
+    workers = 1
+    while True:
+        shutil.rmtree(index_dir, ignore_errors=True)
+        index = ThumbnailIndex(directory, index_dir)
+        try:
+            indexed, failed, _, seconds = warm_indexes([index], workers=workers)
+        finally:
+            index.close()
+        results.append({
+            'workers': workers,
+            'files': indexed + failed,
+            'seconds': round(seconds, 3),
+            'files_per_second': round((indexed + failed) / max(seconds, 1e-6), 1),
+        })
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count())
+    for r in results:
+        r['speedup'] = round(r['files_per_second'] / max(results[0]['files_per_second'], 1e-6), 2)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    return results
+
+
+def bench_startup(directory, repeat, target_ms=STARTUP_TARGET_MS):
+    # Cold start from the command line: launch to the window on screen, and to the first image in it.
+    # Each run gets an empty home directory, so there is no session to restore and nothing is indexed yet.
+    shown = []
+    first_image = []
+    for _ in range(repeat):
+        home = tempfile.mkdtemp(prefix='startup-home-')
+        start = time.time()
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, directory], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=dict(os.environ, HOME=home))
+        shutil.rmtree(home, ignore_errors=True)
+        record = json.loads(result.stdout.strip().splitlines()[-1])
+        shown.append(record['shown'] - start)
+        first_image.append(record['first_image'] - start)
+    shown_ms = round(statistics.median(shown) * 1000, 1)
+    return {
+        'directory': directory,
+        'shown_ms_median': shown_ms,
+        'first_image_ms_median': round(statistics.median(first_image) * 1000, 1),
+        'loaded_before_shown': record['loaded_before_shown'],
+        'cv2_loaded_for_images': record['cv2_loaded_for_images'],
+        'target_ms': target_ms,
+        'target_met': shown_ms <= target_ms,
+    }
+
+
+def make_playlist_paths(count, directory_size=PLAYLIST_DIRECTORY_SIZE):
+    # Camera-style names in per-album directories, each directory in listing (not sorted) order
+    rng = np.random.default_rng(0)
+    paths = []
+    for d in range(0, count, directory_size):
+        directory = f"/home/user/Pictures/{2000 + d // (50 * directory_size)}/album {d // directory_size:04d}/"
+        size = min(directory_size, count - d)
+        for i in rng.permutation(size):
+            paths.append(f"{directory}IMG_{i:04d}.{'png' if i % 10 == 0 else 'jpg'}")
+    return paths
+
+
+def bench_playlist(count, repeat, target_bytes=PLAYLIST_TARGET_BYTES):
+    # The Playlist store against the sorted list of path strings it replaced: memory per entry, adding
+    # scanner-sized batches, random access, lookups and picking entries by extension
+    paths = make_playlist_paths(count)
+    batches = [paths[i:i + PLAYLIST_BATCH] for i in range(0, count, PLAYLIST_BATCH)]
+
+    def build():
+        playlist = Playlist()
+        for batch in batches:
+            playlist.add(batch)
+        return playlist
+
+    def build_list():
+        files = []
+        for batch in batches:
+            files.extend(batch)
+            files.sort()
+        return files
+
+    build_seconds = time_call(build, repeat)
+    list_seconds = time_call(build_list, repeat)
+    tracemalloc.start()
+    playlist = build()
+    playlist_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The list of the scanner's own strings, as the viewer kept them
+    files = build_list()
+    list_bytes = sys.getsizeof(files) + sum(map(sys.getsizeof, files))
+
+    rng = np.random.default_rng(1)
+    indexes = rng.integers(0, count, 10000).tolist()
+    sample = [paths[i] for i in indexes]
+    getitem_us = time_call(lambda: [playlist[i] for i in indexes], repeat) / len(indexes) * 1e6
+    index_us = time_call(lambda: [playlist.index(p) for p in sample], repeat) / len(sample) * 1e6
+    filter_ms = time_call(lambda: playlist.indexes_with_extension(['.png']), repeat) * 1000
+    counts = playlist.extension_counts()
+    bytes_per_entry = playlist_bytes / count
+    return {
+        'entries': count,
+        'directories': len(playlist.directories),
+        'bytes_per_entry': round(bytes_per_entry, 1),
+        'list_bytes_per_entry': round(list_bytes / count, 1),
+        'target_bytes': target_bytes,
+        'target_met': bytes_per_entry <= target_bytes,
+        'build_seconds': round(build_seconds, 3),
+        'list_build_seconds': round(list_seconds, 3),
+        'getitem_us': round(getitem_us, 2),
+        'index_us': round(index_us, 2),
+        'filter_ms': round(filter_ms, 2),
+        'extension_counts': counts,
+    }
+
+
+def bench_session(count, session_dir, repeat):
+    # Saving and restoring a session with a playlist of this size: the GUI thread's share of a save, the
+    # writer thread's, the file size, restoring the playlist, and checking the directories' mtimes
+    paths = make_playlist_paths(count)
+    playlist = Playlist(paths)
+    listings = {}
+    for path in paths:
+        listings.setdefault(os.path.dirname(path), {})[path] = len(listings)
+    listings = [(directory, 0, 0, files) for directory, files in listings.items()]
+    state = {'panes': [{'index': count // 2}]}
+    store = SessionStore(os.path.join(session_dir, 'session.bin'))
+    try:
+        def save():
+            store.saved = None
+            return store.save(state, [playlist], listings)
+        save_ms = time_call(save, repeat) * 1000
+        write_seconds = time_call(lambda: save().result(), repeat)
+        restored = Playlist()
+        load_ms = time_call(lambda: restored.restore(store.load()[1][0]), repeat) * 1000
+        unchanged_changed = []
+        store.validated.connect(lambda unchanged, changed: unchanged_changed.append((unchanged, changed)))
+        validate_ms = time_call(lambda: store.validate().result(), repeat) * 1000
+        assert restored[count // 2] == playlist[count // 2] and len(restored) == count
+        return {
+            'entries': count,
+            'directories': len(listings),
+            'file_bytes_per_entry': round(os.path.getsize(store.path) / count, 1),
+            'save_ms': round(save_ms, 1),
+            'write_seconds': round(write_seconds, 3),
+            'restore_ms': round(load_ms, 1),
+            'validate_ms': round(validate_ms, 1),
+            'rebuild_seconds': round(time_call(lambda: Playlist(paths), 1), 3),
+        }
+    finally:
+        store.close()
+        shutil.rmtree(session_dir, ignore_errors=True)
+
+
+def bench_zoom(file_path, tile_dir, repeat, steps=100):
+    # Tile pyramid of the biggest test image: building it, opening it again, reading tiles, and
+    # panning across it at 1:1 in a TiledImageView, with the memory that takes
+    def build():
+        shutil.rmtree(tile_dir, ignore_errors=True)
+        open_pyramid(file_path, tile_dir)
+
+    build_seconds = time_call(build, repeat)
+    reopen_seconds = time_call(lambda: open_pyramid(file_path, tile_dir), repeat)
+    pyramid = open_pyramid(file_path, tile_dir)
+    columns, rows = pyramid.tile_counts(0)
+    tiles = [(0, column, row) for row in range(rows) for column in range(columns)][:200]
+    tile_seconds = time_call(lambda: [pyramid.tile(*tile) for tile in tiles], repeat) / len(tiles)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+    view = TiledImageView(executor, executor)
+    view.resize(*VIEWER_SIZE)
+    view.show()
+    view.file_path = file_path
+    view.set_pyramid(file_path, pyramid, pyramid.tile(len(pyramid.levels) - 1, 0, 0))
+    view.zoom(1 / view.scale, QPointF(0, 0))
+    view.center = QPointF(0, 0)
+    paints = []
+
+    def pan():
+        # Each step repaints (drawing what's there, queueing what's missing), then takes in the tiles
+        for _ in range(steps):
+            view.center += QPointF(pyramid.width / steps, pyramid.height / steps)
+            view.clamp_center()
+            start = time.perf_counter()
+            view.repaint()
+            paints.append(time.perf_counter() - start)
+            concurrent.futures.wait(list(view.pending.values()))
+            QApplication.processEvents()
+
+    peak = peak_memory(pan)
+    view.close()
+    executor.shutdown()
+    paints.sort()
+    return {
+        'file': os.path.basename(file_path),
+        'size': [pyramid.width, pyramid.height],
+        'levels': len(pyramid.levels),
+        'build_s': round(build_seconds, 2),
+        'reopen_ms': round(reopen_seconds * 1000, 2),
+        'tile_ms': round(tile_seconds * 1000, 3),
+        'pan_paint_ms_median': round(statistics.median(paints) * 1000, 2),
+        'pan_paint_ms_p95': round(paints[int(len(paints) * 0.95)] * 1000, 2),
+        'tiles_cached': len(view.tiles),
+        'tile_cache_mb': round(view.tiles.current_bytes / (1024 * 1024), 1),
+        'pan_peak_rss_mb': peak,
+    }
+
+
+class BenchViewer(MediaViewer):
+    # Playlists are filled by the benchmark instead of the directory dialog
+    def load_directories(self):
+        pass
+
+
+def wait_for_prefetch(viewer):
+    concurrent.futures.wait(list(viewer.image_prefetcher.jobs.values()))
+
+
+def bench_show_image(viewer, file_paths, repeat):
+    # show_image latency with a cold cache, after the prefetcher had time to prepare it, and cached
+    viewer.active_pane.files.reset(file_paths)
+    results = []
+    for index, file_path in enumerate(file_paths):
+        def cold():
+            viewer.image_prefetcher.clear()
+            start = time.perf_counter()
+            viewer.show_image(index)
+            seconds = time.perf_counter() - start
+            wait_for_prefetch(viewer)
+            return seconds
+
+        def prefetched():
+            viewer.image_prefetcher.clear()
+            viewer.show_image(index - 1)
+            wait_for_prefetch(viewer)
+            start = time.perf_counter()
+            viewer.next_image()
+            seconds = time.perf_counter() - start
+            wait_for_prefetch(viewer)
+            return seconds
+
+        cold_seconds = statistics.median(cold() for _ in range(repeat))
+        prefetched_seconds = statistics.median(prefetched() for _ in range(repeat))
+        viewer.show_image(index)
+        cached_seconds = time_call(lambda: viewer.show_image(index), repeat)
+        wait_for_prefetch(viewer)
+        results.append({
+            'file': os.path.basename(file_path),
+            'cold_ms': round(cold_seconds * 1000, 2),
+            'prefetched_ms': round(prefetched_seconds * 1000, 2),
+            'cached_ms': round(cached_seconds * 1000, 2),
+            'peak_rss_mb': peak_memory(cold),
+        })
+    viewer.image_prefetcher.clear()
+    return results
+
+
+def bench_memory(viewer, file_paths, limit_mb=128, cycles=3):
+    # Slideshow through every test image a few times (full decodes, so the source cache fills) under
+    # a small memory limit: budgeted bytes must stay under it, and RSS must stop growing after a cycle
+    viewer.memory_spinbox.setValue(limit_mb)
+    viewer.fast_decode_checkbox.setChecked(False)
+    viewer.active_pane.files.reset(file_paths)
+    viewer.show_image(0)
+    peak_used = 0
+    rss = []
+    for _ in range(cycles):
+        for _ in file_paths:
+            viewer.next_image()
+            wait_for_prefetch(viewer)
+            peak_used = max(peak_used, memory_budget.total())
+        rss.append(resident_bytes())
+    stats = memory_budget.stats()
+    viewer.fast_decode_checkbox.setChecked(True)
+    viewer.image_prefetcher.clear()
+    return {
+        'limit_mb': limit_mb,
+        'peak_used_mb': round(peak_used / (1024 * 1024), 1),
+        'rss_mb_per_cycle': [round(r / (1024 * 1024), 1) for r in rss],
+        'rss_growth_mb': round((rss[-1] - rss[0]) / (1024 * 1024), 1),
+        'evicted_mb': stats['evicted_mb'],
+    }
+
+
+def play_video(viewer, seconds):
+    # Drives update_video by hand (instead of the presentation tick) and times the calls that presented a frame
+    viewer.video_timer.stop()
+    decoder = viewer.video_decoder
+    timings = []
+    deadline = time.monotonic() + seconds
+    while viewer.video_decoder is decoder and decoder is not None and time.monotonic() < deadline:
+        shown = viewer.label_images.get(viewer.video_label)
+        start = time.perf_counter()
+        viewer.update_video()
+        elapsed = time.perf_counter() - start
+        if viewer.label_images.get(viewer.video_label) is not shown:
+            timings.append(elapsed)
+        time.sleep(0.001)
+    if viewer.video_decoder is not None:
+        viewer.video_decoder.stop()
+        viewer.video_decoder = None
+    return decoder, timings
+
+
+def bench_video(viewer, file_paths):
+    results = []
+    for file_path in file_paths:
+        viewer.video_files.reset([file_path])
+        viewer.show_video(0)
+        decoder, timings = play_video(viewer, CLIP_SECONDS + 1)
+        if decoder is None or not timings:
+            print(f"Error: No frames presented for {file_path}")
+            continue
+        timings.sort()
+        result = {
+            'file': os.path.basename(file_path),
+            'frames': len(timings),
+            'update_ms_median': round(statistics.median(timings) * 1000, 3),
+            'update_ms_p95': round(timings[int(len(timings) * 0.95)] * 1000, 3),
+            'fps': round(decoder.fps, 2),
+            'achieved_fps': round(decoder.achieved_fps(), 2),
+            'dropped': decoder.dropped,
+            'skipped': decoder.skipped,
+            'underruns': decoder.underruns,
+        }
+        viewer.show_video(0)
+        result['peak_rss_mb'] = peak_memory(lambda: play_video(viewer, CLIP_SECONDS + 1))
+        results.append(result)
+    return results
+
+
+def bench_scrub(directory, index_dir, repeat, seeks=50):
+    # Seek bar on a one-minute clip: reading the timestamps, building and reopening the keyframe index,
+    # and what a drag costs (closest stored preview, scaled to the label) against an exact seek
+    extension, fourcc, (width, height), seconds = SCRUB_CLIP
+    file_path = os.path.join(directory, f"scrub_{width}x{height}.{extension}")
+    if not os.path.exists(file_path):
+        make_clip(file_path, fourcc, width, height, seconds)
+
+    def build():
+        shutil.rmtree(index_dir, ignore_errors=True)
+        open_keyframe_index(file_path, index_dir)
+
+    scan_seconds = time_call(lambda: scan_packets(file_path), repeat)
+    build_seconds = time_call(build, repeat)
+    reopen_seconds = time_call(lambda: open_keyframe_index(file_path, index_dir), repeat)
+    index = open_keyframe_index(file_path, index_dir)
+    frames = np.random.default_rng(0).integers(0, index.frame_count, seeks)
+
+    def preview(frame_number):
+        qt_image = index.preview(frame_number)[1]
+        qt_image.scaled(LABEL_SIZE[0], LABEL_SIZE[1], Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    def exact(cap, frame_number):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_number))
+        cap.read()
+
+    cap = cv2.VideoCapture(file_path)
+    preview_timings = []
+    exact_timings = []
+    for frame_number in frames:
+        preview_timings.append(time_call(lambda: preview(frame_number), 1))
+        exact_timings.append(time_call(lambda: exact(cap, frame_number), 1))
+    cap.release()
+    shutil.rmtree(index_dir, ignore_errors=True)
+    return {
+        'file': os.path.basename(file_path),
+        'frames': index.frame_count,
+        'keyframes': len(index.keyframes),
+        'previews': len(index.preview_frames),
+        'index_kb': round((index.times.nbytes + index.keyframes.nbytes + index.preview_data.nbytes) / 1024, 1),
+        'scan_ms': round(scan_seconds * 1000, 2),
+        'build_seconds': round(build_seconds, 3),
+        'reopen_ms': round(reopen_seconds * 1000, 2),
+        'preview_ms_median': round(statistics.median(preview_timings) * 1000, 3),
+        'exact_seek_ms_median': round(statistics.median(exact_timings) * 1000, 3),
+        'exact_seek_ms_p95': round(sorted(exact_timings)[int(seeks * 0.95)] * 1000, 3),
+    }
+
+
+def bench_switch(viewer, file_paths, rounds=3, play_seconds=0.5):
+    # Next video to its first frame on screen: opened cold, and pre-rolled while the previous one played
+    viewer.video_files.reset(file_paths)
+    viewer.video_order = None
+    result = {'switches': rounds * len(file_paths)}
+    for prerolled in (False, True):
+        timings = []
+        viewer.show_video(0)
+        for _ in range(rounds * len(file_paths)):
+            play_video(viewer, play_seconds)
+            if not prerolled:
+                viewer.video_preroller.cancel()
+            shown = viewer.label_images.get(viewer.video_label)
+            start = time.perf_counter()
+            viewer.next_video()
+            while viewer.video_decoder is not None and viewer.label_images.get(viewer.video_label) is shown:
+                viewer.update_video()
+                time.sleep(0.0005)
+            timings.append(time.perf_counter() - start)
+        name = 'prerolled' if prerolled else 'cold'
+        result[f'{name}_ms_median'] = round(statistics.median(timings) * 1000, 3)
+        result[f'{name}_ms_p95'] = round(sorted(timings)[int(len(timings) * 0.95)] * 1000, 3)
+    if viewer.video_decoder is not None:
+        viewer.video_decoder.stop()
+        viewer.video_decoder = None
+    viewer.video_preroller.cancel()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, path=''):
+    # Prints timings that moved by more than 20% against an earlier --output file
+    if isinstance(results, dict) and isinstance(baseline, dict):
+        for key, value in results.items():
+            if key in baseline:
+                compare(value, baseline[key], f"{path}.{key}" if path else key)
+    elif isinstance(results, list) and isinstance(baseline, list):
+        for index, (value, old) in enumerate(zip(results, baseline)):
+            name = value.get('file') or value.get('frame') or value.get('entries') if isinstance(value, dict) else index
+            compare(value, old, f"{path}[{name}]")
+    elif path.endswith(('_ms', 'seconds', '_ms_median', '_ms_p95', '_ms_per_frame')) and baseline:
+        change = results / baseline - 1
+        if abs(change) > 0.2:
+            print(f"{'slower' if change > 0 else 'faster'} {path}: {baseline} -> {results} ({change:+.0%})")
+
+
+def print_table(results):
+    print(f"{'file':<16}{'format':>8}{'MP':>8}{'full ms':>12}{'reduced ms':>12}{'speedup':>10}")
+    for r in results:
+        print(f"{r['file']:<16}{r['format']:>8}{r['megapixels']:>8}{r['full_ms']:>12}{r['reduced_ms']:>12}{r['speedup']:>9}x")
+
+
+SUITES = ['startup', 'decode', 'render', 'convert', 'zoom', 'scan', 'playlist', 'session', 'warm', 'scrub', 'show',
+          'video']
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the viewer's hot paths headlessly on generated media")
+    parser.add_argument('--data-dir', help="Directory for the generated test media (default: a temp dir)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=SUITES)
+    parser.add_argument('--entries', type=int, nargs='+', default=[10000, 100000],
+                        help="Sizes of the generated directories for the scan suite")
+    parser.add_argument('--playlist-entries', type=int, nargs='+', default=[100000, 1000000],
+                        help="Sizes of the generated playlists for the playlist suite")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against the JSON written by an earlier run")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), 'image_viewer_bench')
+    os.makedirs(data_dir, exist_ok=True)
+    app = QApplication([])
+    output = {'revision': git_revision(), 'repeat': args.repeat}
+
+    if 'startup' in args.suites:
+        directory = make_warm_files(os.path.join(data_dir, 'warm'), make_images(data_dir)[0])
+        r = bench_startup(directory, args.repeat)
+        print(f"startup: window shown {r['shown_ms_median']} ms (target {r['target_ms']} ms: "
+              f"{'met' if r['target_met'] else 'MISSED'}), first image {r['first_image_ms_median']} ms, "
+              f"loaded before shown: {', '.join(r['loaded_before_shown']) or 'none of cv2, numpy, PIL'}, "
+              f"cv2 loaded for images: {'YES' if r['cv2_loaded_for_images'] else 'no'}")
+        output['startup'] = r
+
+    if 'decode' in args.suites:
+        results = bench_decode(make_images(data_dir), args.repeat)
+        print_table(results)
+        output['decode'] = results
+
+    if 'render' in args.suites:
+        render_results = bench_render(args.repeat)
+        for r in render_results:
+            stages = ", ".join(f"{stage}: {c['allocations']:g} alloc / {c['copies']:g} copy"
+                               for stage, c in r['stages'].items())
+            print(f"render {r['frame']:>10}: {r['ms_per_frame']} ms/frame, was {r['legacy_ms_per_frame']} ms ({stages})")
+        output['render'] = render_results
+
+    if 'convert' in args.suites:
+        output['convert'] = bench_convert(args.repeat)
+        for r in output['convert']:
+            print(f"convert {r['source']:<10}: {r['convert_ms']} ms + upload {r['upload_ms']} ms, "
+                  f"{r['allocations']} alloc / {r['copies']} copy, zero-copy {r['zero_copy']}, "
+                  f"{r['extra_bytes']} extra bytes")
+
+    if 'zoom' in args.suites:
+        r = bench_zoom(make_images(data_dir)[-1], os.path.join(data_dir, 'tiles'), args.repeat)
+        print(f"zoom {r['file']}: build {r['build_s']}s, reopen {r['reopen_ms']} ms, {r['tile_ms']} ms/tile, "
+              f"pan paint {r['pan_paint_ms_median']} ms median / {r['pan_paint_ms_p95']} ms p95, "
+              f"{r['tiles_cached']} tiles ({r['tile_cache_mb']} MB) cached, peak RSS {r['pan_peak_rss_mb']} MB")
+        output['zoom'] = r
+
+    if 'scan' in args.suites:
+        output['scan'] = []
+        for count in args.entries:
+            r = bench_scan(make_entries(os.path.join(data_dir, f"entries_{count}"), count), args.repeat)
+            print(f"scan {r['entries']:>8} entries: {r['seconds']}s ({r['entries_per_second']} entries/s), "
+                  f"first batch {r['first_batch_ms']} ms, peak RSS {r['peak_rss_mb']} MB")
+            output['scan'].append(r)
+
+    if 'playlist' in args.suites:
+        output['playlist'] = []
+        for count in args.playlist_entries:
+            r = bench_playlist(count, args.repeat)
+            print(f"playlist {r['entries']:>8} entries: {r['bytes_per_entry']} B/entry (target {r['target_bytes']}: "
+                  f"{'met' if r['target_met'] else 'MISSED'}), list of str {r['list_bytes_per_entry']} B/entry; "
+                  f"build {r['build_seconds']}s, list {r['list_build_seconds']}s; getitem {r['getitem_us']} us, "
+                  f"index {r['index_us']} us, filter by extension {r['filter_ms']} ms")
+            output['playlist'].append(r)
+
+    if 'session' in args.suites:
+        output['session'] = []
+        for count in args.playlist_entries:
+            r = bench_session(count, os.path.join(data_dir, 'session'), args.repeat)
+            print(f"session {r['entries']:>8} entries: save {r['save_ms']} ms on the GUI thread + write "
+                  f"{r['write_seconds']}s ({r['file_bytes_per_entry']} B/entry on disk); restore {r['restore_ms']} ms, "
+                  f"check {r['directories']} directories {r['validate_ms']} ms; scanning into a playlist "
+                  f"instead {r['rebuild_seconds']}s")
+            output['session'].append(r)
+
+    if 'warm' in args.suites:
+        directory = make_warm_files(os.path.join(data_dir, 'warm'), make_images(data_dir)[0])
+        output['warm'] = bench_warm(directory, os.path.join(data_dir, 'warm_index'))
+        for r in output['warm']:
+            print(f"warm {r['workers']:>3} workers: {r['files']} files in {r['seconds']}s "
+                  f"({r['files_per_second']} files/s, {r['speedup']}x)")
+
+    if 'scrub' in args.suites:
+        r = bench_scrub(data_dir, os.path.join(data_dir, 'keyframes'), args.repeat)
+        print(f"scrub {r['file']}: {r['frames']} frames, {r['keyframes']} keyframes, {r['previews']} previews "
+              f"({r['index_kb']} KB); timestamps {r['scan_ms']} ms, build {r['build_seconds']}s, "
+              f"reopen {r['reopen_ms']} ms; drag preview {r['preview_ms_median']} ms, "
+              f"exact seek {r['exact_seek_ms_median']} ms median / {r['exact_seek_ms_p95']} ms p95")
+        output['scrub'] = r
+
+    if 'show' in args.suites or 'video' in args.suites:
+        viewer = BenchViewer()
+        viewer.resize(*VIEWER_SIZE)
+        viewer.show()
+        app.processEvents()
+        output['label_size'] = [viewer.active_pane.label.width(), viewer.active_pane.label.height()]
+
+        if 'show' in args.suites:
+            output['show_image'] = bench_show_image(viewer, make_images(data_dir), args.repeat)
+            for r in output['show_image']:
+                print(f"show_image {r['file']:<16}: cold {r['cold_ms']} ms, prefetched {r['prefetched_ms']} ms, "
+                      f"cached {r['cached_ms']} ms, peak RSS {r['peak_rss_mb']} MB")
+
+            output['memory'] = bench_memory(viewer, make_images(data_dir))
+            r = output['memory']
+            print(f"memory limit {r['limit_mb']} MB: peak {r['peak_used_mb']} MB used, RSS per cycle "
+                  f"{r['rss_mb_per_cycle']} MB ({r['rss_growth_mb']:+} MB), evicted {r['evicted_mb']}")
+
+        if 'video' in args.suites:
+            output['update_video'] = bench_video(viewer, make_clips(data_dir))
+            for r in output['update_video']:
+                print(f"update_video {r['file']:<20}: {r['update_ms_median']} ms median, {r['update_ms_p95']} ms p95, "
+                      f"{r['achieved_fps']}/{r['fps']} fps, dropped {r['dropped']}, skipped {r['skipped']}, "
+                      f"underruns {r['underruns']}, peak RSS {r['peak_rss_mb']} MB")
+        if 'video' in args.suites:
+            r = bench_switch(viewer, make_clips(data_dir))
+            print(f"switch_video {r['switches']} switches: cold {r['cold_ms_median']} ms median / {r['cold_ms_p95']} ms p95, "
+                  f"pre-rolled {r['prerolled_ms_median']} ms median / {r['prerolled_ms_p95']} ms p95")
+            output['switch_video'] = r
+        viewer.close()
+
+    # ru_maxrss is in kB on Linux; this includes generating the test media
+    output['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(f"max RSS: {output['max_rss_mb']} MB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(output, json.load(f))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
@@ -0,0 +1,144 @@
+import os
+import struct
+import time
+from PyQt5.QtCore import QThread, pyqtSignal
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.gif', '.webp', '.apng')
+# Played frame by frame through PIL instead of OpenCV
+ANIMATION_EXTENSIONS = ('.gif', '.webp', '.apng')
+# Just as often a still image, which goes to the image panes; only animated ones are videos
+STILL_OR_ANIMATED_EXTENSIONS = ('.webp', '.apng')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def is_animated(file_path):
+    # From the header alone, without decoding: WebP flags animation in its VP8X chunk, APNG has an acTL
+    # chunk ahead of the image data. False if the file can't be read.
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(21)
+            if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+                return header[12:16] == b'VP8X' and len(header) == 21 and bool(header[20] & 0x02)
+            if header[:8] != PNG_SIGNATURE:
+                return False
+            f.seek(len(PNG_SIGNATURE))
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return False
+                length, kind = struct.unpack('>I4s', chunk)
+                if kind == b'acTL':
+                    return True
+                if kind in (b'IDAT', b'IEND'):
+                    return False
+                f.seek(length + 4, os.SEEK_CUR)  # Data and CRC
+    except OSError:
+        return False
+
+
+def is_video(file_path):
+    # For a media file: whether it goes to the video playlist rather than an image pane
+    name = file_path.lower()
+    if name.endswith(STILL_OR_ANIMATED_EXTENSIONS):
+        return is_animated(file_path)
+    return name.endswith(VIDEO_EXTENSIONS)
+
+
+def directory_mtime(directory):
+    # st_mtime_ns of a directory, which changes whenever an entry is added, removed or renamed; None if it is gone
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+class DirectoryScanner(QThread):
+    # (image paths, video paths), each batch sorted
+    batch_found = pyqtSignal(list, list)
+    # (entries seen, matching files, entries per second)
+    progress = pyqtSignal(int, int, float)
+    # (entries seen, matching files, seconds)
+    scan_finished = pyqtSignal(int, int, float)
+    # (directory, {media file path: inode}, mtime_ns) for each directory fully listed since the last batch:
+    # the roots, plus subdirectories when recursive. Lets a watcher diff later listings against the scan,
+    # and a saved session tell which directories changed since. The mtime is taken before the listing.
+    directories_found = pyqtSignal(list)
+
+    def __init__(self, directories, recursive=False, batch_size=2000, batch_interval=0.1, parent=None):
+        super().__init__(parent)
+        self.directories = list(directories)
+        self.recursive = recursive
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self):
+        start = time.monotonic()
+        last_flush = start
+        seen = 0
+        matched = 0
+        images = []
+        videos = []
+        listed = []
+        pending = list(reversed(self.directories))
+
+        while pending and not self.stopped:
+            directory = pending.pop()
+            contents = {}
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+                entries = os.scandir(directory)
+            except OSError as e:
+                print(f"Error: Unable to scan {directory}: {e}")
+                continue
+
+            with entries:
+                for entry in entries:
+                    if self.stopped:
+                        break
+                    seen += 1
+                    name = entry.name.lower()
+                    if name.endswith(IMAGE_EXTENSIONS):
+                        images.append(entry.path)
+                    elif name.endswith(VIDEO_EXTENSIONS):
+                        (videos if is_video(entry.path) else images).append(entry.path)
+                    elif self.recursive:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                        except OSError:
+                            pass
+                        continue
+                    else:
+                        continue
+                    contents[entry.path] = entry.inode()  # From the listing itself, no stat() call
+
+                    # Flush the very first match right away so something shows up immediately,
+                    # then in batches to keep the number of signals (and sorts on the GUI side) low
+                    now = time.monotonic()
+                    if matched == 0 or len(images) + len(videos) >= self.batch_size or now - last_flush >= self.batch_interval:
+                        matched += len(images) + len(videos)
+                        self.flush(images, videos, listed)
+                        images, videos, listed = [], [], []
+                        last_flush = now
+                        self.progress.emit(seen, matched, seen / max(now - start, 1e-6))
+                else:
+                    listed.append((directory, contents, mtime_ns))
+
+        matched += len(images) + len(videos)
+        self.flush(images, videos, listed)
+        elapsed = time.monotonic() - start
+        self.progress.emit(seen, matched, seen / max(elapsed, 1e-6))
+        self.scan_finished.emit(seen, matched, elapsed)
+
+    def flush(self, images, videos, listed):
+        if listed:
+            self.directories_found.emit(listed)
+        if images or videos:
+            images.sort()
+            videos.sort()
+            self.batch_found.emit(images, videos)
@@ -0,0 +1,130 @@
+import os
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal
+from directory_scanner import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, directory_mtime, is_video
+
+
+def list_directory(directory):
+    # Media files (path -> inode) and subdirectories of one directory, without stat() calls:
+    # scandir gets the inode from the directory listing itself. None if the directory is gone.
+    files = {}
+    subdirectories = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name.lower()
+                if name.endswith(IMAGE_EXTENSIONS) or name.endswith(VIDEO_EXTENSIONS):
+                    files[entry.path] = entry.inode()
+                else:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                    except OSError:
+                        pass
+    except OSError:
+        return None, []
+    return files, subdirectories
+
+
+class DirectoryWatcher(QObject):
+    # Relists a watched directory (only that one) shortly after it changes and reports the difference
+    # to its previous listing, starting from the scanner's. Nothing is rescanned from the roots, and the
+    # GUI thread only applies the few paths that changed.
+    # (directory, added images, added videos, removed files, replaced files, subdirectories), all sorted
+    directory_changed = pyqtSignal(str, list, list, list, list, list)
+    # From the worker pool: (directory, the listing it was diffed against, the new listing or None if listing
+    # failed, its mtime_ns, the changes as directory_changed reports them or None)
+    listed = pyqtSignal(str, object, object, object, object)
+
+    def __init__(self, executor, debounce=250, parent=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.watcher = QFileSystemWatcher()
+        self.watcher.directoryChanged.connect(self.schedule)
+        self.listings = {}  # directory -> {path: inode} as last reported
+        self.mtimes = {}  # directory -> its mtime_ns from just before that listing
+        self.changed = set()
+        self.listing = set()  # Directories being relisted right now
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce)  # Copying many files fires once per file; list once for all of them
+        self.timer.timeout.connect(self.list_changed)
+        self.listed.connect(self.apply_listing)
+        self.warned = False
+
+    def watch(self, listings):
+        # listings: (directory, {path: inode}, mtime_ns) triples, as found by the scanner
+        listings = [listing for listing in listings if listing[0] not in self.listings]
+        if not listings:
+            return
+        failed = set(self.watcher.addPaths([directory for directory, _, _ in listings]))
+        if failed and not self.warned:
+            # Usually the inotify watch limit (fs.inotify.max_user_watches)
+            print(f"Warning: Unable to watch {len(failed)} directories, e.g. {next(iter(failed))}")
+            self.warned = True
+        for directory, files, mtime_ns in listings:
+            if directory not in failed:
+                self.listings[directory] = files
+                self.mtimes[directory] = mtime_ns
+
+    def unwatch(self, directory):
+        if self.listings.pop(directory, None) is not None:
+            self.mtimes.pop(directory, None)
+            self.watcher.removePath(directory)
+
+    def is_watched(self, directory):
+        return directory in self.listings
+
+    def clear(self):
+        self.timer.stop()
+        self.changed.clear()
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        self.listings.clear()
+        self.mtimes.clear()
+
+    def schedule(self, directory):
+        self.changed.add(directory)
+        self.timer.start()
+
+    def list_changed(self):
+        # One listing per directory at a time; a change during a listing is picked up after it
+        busy = set()
+        for directory in self.changed:
+            if directory in self.listing:
+                busy.add(directory)
+            elif directory in self.listings:
+                self.listing.add(directory)
+                self.executor.submit(self.list_and_report, directory, self.listings[directory])
+        self.changed = busy
+        if busy:
+            self.timer.start()
+
+    def list_and_report(self, directory, previous):
+        # Runs on the worker pool and only reads; the listing is stored by apply_listing() on the GUI thread
+        files = mtime_ns = changes = None
+        try:
+            mtime_ns = directory_mtime(directory)
+            files, subdirectories = list_directory(directory)
+            gone = files is None
+            if gone:
+                files = {}
+            added = sorted(path for path in files if path not in previous)
+            removed = sorted(path for path in previous if path not in files)
+            replaced = sorted(path for path, inode in files.items() if path in previous and previous[path] != inode)
+            if added or removed or replaced or subdirectories or gone:
+                images = [path for path in added if not is_video(path)]
+                videos = [path for path in added if is_video(path)]
+                changes = (images, videos, removed, replaced, subdirectories)
+        except Exception as e:
+            print(f"Error: Unable to relist {directory}: {e}")
+            files = None
+        self.listed.emit(directory, previous, files, mtime_ns, changes)
+
+    def apply_listing(self, directory, previous, files, mtime_ns, changes):
+        self.listing.discard(directory)
+        if files is None or self.listings.get(directory) is not previous:
+            return  # Failed, or unwatched (or watched again) meanwhile
+        self.listings[directory] = files
+        self.mtimes[directory] = mtime_ns
+        if changes is not None:
+            self.directory_changed.emit(directory, *changes)
@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import OrderedDict
+from PyQt5.QtGui import QImage
+
+
+def image_size_in_bytes(image):
+    if isinstance(image, QImage):
+        return image.sizeInBytes()
+    # PIL image: one byte per band per pixel is close enough for the common 8-bit modes
+    return image.width * image.height * len(image.getbands())
+
+
+def file_cache_key(file_path):
+    # mtime and size both change when a file is rewritten, so stale entries are never hit
+    stat = os.stat(file_path)
+    return file_path, stat.st_mtime_ns, stat.st_size
+
+
+class LRUCache:
+    def __init__(self, max_bytes, size_of=image_size_in_bytes):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Shared between the GUI thread and prefetch workers
+        self.budget = None  # MemoryBudget this cache is registered with, told about every put
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        # Like get(), but leaves the recency order and the hit statistics alone
+        with self.lock:
+            entry = self.entries.get(key)
+        return None if entry is None else entry[0]
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.current_bytes += size
+            self._evict()
+        if self.budget is not None:
+            self.budget.enforce()
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.current_bytes -= size
+
+    def evict_bytes(self, nbytes):
+        # Drops least recently used entries until nbytes are freed (or the cache is empty)
+        freed = 0
+        with self.lock:
+            while freed < nbytes and self.entries:
+                _, (_, size) = self.entries.popitem(last=False)
+                self.current_bytes -= size
+                freed += size
+        return freed
+
+    def discard(self, predicate):
+        # Drops every entry whose key matches, e.g. all sizes of a file that changed on disk
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.current_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,171 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from image_cache import LRUCache, file_cache_key
+from metrics import metrics
+from render import display_image, fit_size, render_pil_image
+from tile_pyramid import load_reduced_image, open_large_image
+
+# Bigger than any camera makes; beyond this a full decode just to fit the window is too slow and too big
+LARGE_IMAGE_PIXELS = 100_000_000
+
+
+def load_source_image(file_path, width=None, height=None):
+    with metrics.timed('image.decode'):
+        image = open_large_image(file_path)
+        full_size = image.size
+        image_format = image.format
+
+        # With a target size, let the decoder skip the pixels that can't be shown.
+        # For JPEG this is DCT scaling (1/2, 1/4 or 1/8), always at least as big as requested.
+        # Other formats ignore draft() and decode at full resolution.
+        if width is not None and height is not None:
+            image.draft(image.mode, fit_size(image.width, image.height, width, height))
+            if image.width * image.height > LARGE_IMAGE_PIXELS:
+                # No reduced decode for this format (PNG, TIFF...): shrink it strip by strip instead
+                image.close()
+                image = load_reduced_image(file_path, width, height)
+
+        image.load()  # Decode now, so the cached image doesn't keep the file open
+        image = display_image(image)
+    image.info['full_size'] = full_size
+    image.info['format'] = image_format  # Conversions drop image.format but keep info
+    return image
+
+
+def covers_size(image, width, height):
+    # A cached decode can be reused if it is full resolution or big enough for the target
+    if image.size == image.info.get('full_size', image.size):
+        return True
+    new_width, new_height = fit_size(image.width, image.height, width, height)
+    return new_width <= image.width and new_height <= image.height
+
+
+def scale_image(image, width, height, reducing_gap=None):
+    from PIL import Image as PILImage
+    new_width, new_height = fit_size(image.width, image.height, width, height)
+    with metrics.timed('image.scale'):
+        image = image.resize((new_width, new_height), PILImage.Resampling.LANCZOS, reducing_gap=reducing_gap)
+    # This runs on worker threads, which is fine for QImage (unlike QPixmap)
+    return render_pil_image(image)
+
+
+def load_scaled_image(file_path, width, height, source_cache=None, display_cache=None, reduced=True):
+    # reduced=False forces a full-resolution decode, e.g. when zooming in past the fitted size
+    source_key = file_cache_key(file_path)
+    display_key = source_key + (width, height, reduced)
+
+    if display_cache is not None:
+        qt_image = display_cache.get(display_key)
+        if qt_image is not None:
+            return qt_image
+
+    image = source_cache.get(source_key) if source_cache is not None else None
+    if image is None or not covers_size(image, width, height) or (not reduced and image.size != image.info['full_size']):
+        if reduced:
+            image = load_source_image(file_path, width, height)
+        else:
+            image = load_source_image(file_path)
+        if source_cache is not None:
+            source_cache.put(source_key, image)
+
+    # reducing_gap first shrinks with a cheap box filter, then finishes with LANCZOS
+    qt_image = scale_image(image, width, height, reducing_gap=3.0 if reduced else None)
+    if display_cache is not None:
+        display_cache.put(display_key, qt_image)
+    return qt_image
+
+
+class ImagePrefetcher:
+    def __init__(self, depth=2, max_workers=None, cache_bytes=256 * 1024 * 1024, reduced_decode=True):
+        self.depth = depth
+        self.reduced_decode = reduced_decode
+        # Full-resolution decodes are much bigger than display-sized ones, so they get most of the budget
+        self.source_cache = LRUCache(cache_bytes * 3 // 4)
+        self.display_cache = LRUCache(cache_bytes // 4)
+        if max_workers is None:
+            max_workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-prefetch")
+        self.jobs = {}  # (file_path, width, height) -> Future
+        self.job_groups = {}  # (file_path, width, height) -> who prefetched it, e.g. an image pane
+
+    def get(self, file_path, width, height):
+        # Take a prepared image if one is queued or ready, otherwise decode inline
+        future = self.jobs.pop((file_path, width, height), None)
+        self.job_groups.pop((file_path, width, height), None)
+        if future is not None and not future.cancel():
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Prefetch failed for {file_path}: {e}")
+        return self.load(file_path, width, height)
+
+    def load(self, file_path, width, height):
+        return load_scaled_image(file_path, width, height, self.source_cache, self.display_cache,
+                                 reduced=self.reduced_decode)
+
+    def source_image(self, file_path):
+        # The decode a shown image was scaled from, if it is still cached; doesn't count as a hit
+        try:
+            return self.source_cache.peek(file_cache_key(file_path))
+        except OSError:
+            return None
+
+    def set_cache_bytes(self, cache_bytes):
+        self.source_cache.set_max_bytes(cache_bytes * 3 // 4)
+        self.display_cache.set_max_bytes(cache_bytes // 4)
+
+    def cache_stats(self):
+        return {
+            name: {'hits': cache.hits, 'misses': cache.misses, 'hit_rate': round(cache.hit_rate(), 3),
+                   'entries': len(cache), 'bytes': cache.current_bytes}
+            for name, cache in (('source', self.source_cache), ('display', self.display_cache))
+        }
+
+    def pending(self):
+        # Jobs still queued or decoding; finished ones only wait in jobs to be picked up
+        return sum(not future.done() for future in list(self.jobs.values()))
+
+    def request(self, file_path, width, height):
+        # Start decoding an image that is about to be shown, so several can be decoded in parallel
+        key = (file_path, width, height)
+        if key not in self.jobs:
+            self.jobs[key] = self.executor.submit(self.load, *key)
+
+    def prefetch(self, file_paths, width, height, group=None):
+        wanted = [(file_path, width, height) for file_path in file_paths]
+
+        # Drop this group's jobs that are no longer in its lookahead window (user jumped or resized).
+        # Jobs that already started can't be interrupted; their result is just discarded.
+        for key in list(self.jobs):
+            if self.job_groups.get(key) is group and key not in wanted:
+                self.jobs.pop(key).cancel()
+                self.job_groups.pop(key, None)
+
+        for key in wanted:
+            if key not in self.jobs:
+                self.jobs[key] = self.executor.submit(self.load, *key)
+                self.job_groups[key] = group
+
+    def invalidate(self, file_paths):
+        # Forget everything decoded from these files; cache keys start with the path
+        file_paths = set(file_paths)
+        self.source_cache.discard(lambda key: key[0] in file_paths)
+        self.display_cache.discard(lambda key: key[0] in file_paths)
+        for key in [key for key in self.jobs if key[0] in file_paths]:
+            self.jobs.pop(key).cancel()
+            self.job_groups.pop(key, None)
+
+    def cancel(self):
+        for future in self.jobs.values():
+            future.cancel()
+        self.jobs.clear()
+        self.job_groups.clear()
+
+    def clear(self):
+        self.cancel()
+        self.source_cache.clear()
+        self.display_cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
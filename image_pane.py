@@ -0,0 +1,81 @@
+import os
+from PyQt5.QtWidgets import QFrame, QLabel, QVBoxLayout, QSizePolicy
+from PyQt5.QtCore import Qt, pyqtSignal
+from playlist import Playlist
+
+
+class ImagePane(QFrame):
+    # One image label with its own directories and playlist. Decoding and caching are shared
+    # between all panes by the viewer; a pane only knows where it is in its playlist.
+    activated = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("image_pane")
+        self.directories = []
+        self.files = Playlist()
+        self.current_index = 0
+        self.direction = 1  # 1 when stepping forward, -1 when stepping back
+        self.order = None  # ShuffleOrder while randomized
+        self.position = 0  # Position of the current image in order
+        self.zoom_view = None  # TiledImageView while zoomed in, shown instead of the label
+
+        self.title_label = QLabel()
+        self.title_label.hide()
+        self.label = QLabel()
+        # Pixmaps are already rendered at the label size, so Qt must not scale them again on paint
+        self.label.setAlignment(Qt.AlignCenter)
+        self.label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(2, 2, 2, 2)
+        layout.addWidget(self.title_label)
+        layout.addWidget(self.label)
+
+    def mousePressEvent(self, event):
+        self.activated.emit(self)
+        super().mousePressEvent(event)
+
+    def set_active(self, active):
+        self.setStyleSheet("#image_pane { border: 2px solid palette(highlight); }" if active else "")
+
+    def set_title_visible(self, visible):
+        self.title_label.setVisible(visible)
+        self.update_title()
+
+    def update_title(self):
+        if self.title_label.isVisible():
+            names = ", ".join(os.path.basename(os.path.normpath(d)) for d in self.directories) or "(empty)"
+            position = f"{self.current_index + 1}/{len(self.files)}" if self.files else "0/0"
+            self.title_label.setText(f"{names}  {position}")
+
+    def set_zoom_view(self, view):
+        # Swaps the label for a zoom view, or back when view is None
+        if self.zoom_view is not None:
+            self.zoom_view.close_view()
+            self.layout().removeWidget(self.zoom_view)
+            self.zoom_view.deleteLater()
+        self.zoom_view = view
+        if view is not None:
+            self.layout().addWidget(view)
+        self.label.setVisible(view is None)
+
+    def current_file(self):
+        return self.files[self.current_index] if self.files else None
+
+    def index_after(self, offset):
+        # Index of the image `offset` steps away from the current one in playback order
+        if self.order is None:
+            return (self.current_index + offset) % len(self.files)
+        return self.order.index_at(self.position + offset)
+
+    def step(self, step):
+        # Moves one step in playback order and returns the index to show
+        self.direction = step
+        index = self.index_after(step)
+        if self.order is not None:
+            self.position = (self.position + step) % len(self.order)
+        return index
+
+    def sync_position(self, index):
+        if self.order is not None and self.order.index_at(self.position) != index:
+            self.position = self.order.position_of(index)  # Jumped here, e.g. from the grid
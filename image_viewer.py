@@ -1,16 +1,32 @@
 import sys
+import argparse
+import math
 import os
-import cv2
-import numpy as np
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QFileDialog, QVBoxLayout, QWidget, QLabel, QHBoxLayout, QSplitter, QCheckBox, QSpinBox
-from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import QTimer, Qt
-from PIL import Image as PILImage
-from PIL import ImageSequence
+import time
+from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QFileDialog, QVBoxLayout, QWidget, QLabel, QHBoxLayout, QSplitter, QCheckBox, QSpinBox, QSizePolicy, QGridLayout
+from PyQt5.QtGui import QPixmap, QKeySequence
+from PyQt5.QtCore import QTimer, Qt, QEvent
 import random
+from concurrent.futures import ThreadPoolExecutor
+from image_loader import ImagePrefetcher, covers_size
+from image_pane import ImagePane
+from directory_scanner import DirectoryScanner, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, is_video
+from directory_watcher import DirectoryWatcher
+from playlist import Playlist, ShuffleOrder, PLAYLIST_EXTENSIONS, read_playlist
+from thumbnail_index import THUMBNAIL_SIZE, ThumbnailIndex
+from warm_index import IndexWarmer
+from thumbnail_grid import ThumbnailGrid, ThumbnailGridModel
+from tiled_view import TiledImageView
+from video_decoder import AnimationDecoder, VideoPreroller, open_decoder
+from video_scrubber import VideoScrubber
+from render import render_stats, render_bgr_frame, fit_size, native_format
+from metrics import metrics, MetricsExporter
+from memory_budget import memory_budget, VISIBLE, PREFETCHED, CACHED
+from session import SessionStore, DEFAULT_SESSION_PATH, check_state
 
 class MediaViewer(QMainWindow):
-    def __init__(self):
+    def __init__(self, recursive=False, shuffle_seed=None, metrics_path=None, metrics_interval=5000, image_panes=1,
+                 memory_limit=1024, rss_limit=0, paths=None, session_path=None, session_interval=30000):
         super().__init__()
         self.setWindowTitle("Media Viewer")
         self.setGeometry(100, 100, 1200, 600)
@@ -40,16 +56,74 @@ class MediaViewer(QMainWindow):
         self.interval_spinbox.setValue(1000)  # Default to 1 second
         self.interval_spinbox.setSuffix(" ms")
         self.interval_spinbox.valueChanged.connect(self.update_interval)
+        self.prefetch_spinbox = QSpinBox()
+        self.prefetch_spinbox.setRange(0, 16)  # Number of images decoded ahead of the current one
+        self.prefetch_spinbox.setValue(2)
+        self.prefetch_spinbox.setPrefix("Prefetch: ")
+        self.prefetch_spinbox.valueChanged.connect(self.update_prefetch_depth)
+        self.cache_spinbox = QSpinBox()
+        self.cache_spinbox.setRange(16, 8192)  # Memory budget for decoded and scaled images
+        self.cache_spinbox.setValue(256)
+        self.cache_spinbox.setPrefix("Cache: ")
+        self.cache_spinbox.setSuffix(" MB")
+        self.cache_spinbox.valueChanged.connect(self.update_cache_size)
+        self.memory_spinbox = QSpinBox()
+        self.memory_spinbox.setRange(64, 65536)  # Ceiling for all decoded images, frame buffers, tiles and thumbnails
+        self.memory_spinbox.setValue(memory_limit)
+        self.memory_spinbox.setPrefix("Memory limit: ")
+        self.memory_spinbox.setSuffix(" MB")
+        self.memory_spinbox.valueChanged.connect(self.update_memory_limit)
+        self.rss_spinbox = QSpinBox()
+        self.rss_spinbox.setRange(0, 65536)  # Ceiling for the whole process; caches are emptied to stay under it
+        self.rss_spinbox.setValue(rss_limit)
+        self.rss_spinbox.setPrefix("RSS limit: ")
+        self.rss_spinbox.setSuffix(" MB")
+        self.rss_spinbox.setSpecialValueText("RSS limit: off")
+        self.rss_spinbox.valueChanged.connect(self.update_memory_limit)
+        self.fast_decode_checkbox = QCheckBox("Fast Decode")  # Decode only the resolution the label can show
+        self.fast_decode_checkbox.setChecked(True)
+        self.fast_decode_checkbox.stateChanged.connect(self.toggle_fast_decode)
+        self.zoom_checkbox = QCheckBox("Zoom / Pan")  # Tiled view of the selected pane's image, for very large ones
+        self.zoom_checkbox.stateChanged.connect(self.toggle_zoom)
+        self.grid_view_checkbox = QCheckBox("Grid View")
+        self.grid_view_checkbox.stateChanged.connect(self.toggle_grid_view)
+        self.warm_button = QPushButton("Warm Thumbnails")  # Index every scanned directory on all cores
+        self.warm_button.clicked.connect(self.toggle_warm)
+        self.panes_spinbox = QSpinBox()
+        self.panes_spinbox.setRange(1, 16)  # Image panes, each showing its own directories
+        self.panes_spinbox.setValue(image_panes)
+        self.panes_spinbox.setPrefix("Panes: ")
+        self.panes_spinbox.valueChanged.connect(self.update_pane_count)
+        self.lockstep_checkbox = QCheckBox("Lockstep")  # Previous/Next move every pane, not just the selected one
 
-        self.image_layout.addWidget(self.prev_image_button)
-        self.image_layout.addWidget(self.next_image_button)
-        self.image_layout.addWidget(self.randomize_images_checkbox)
-        self.image_layout.addWidget(self.slideshow_button)
-        self.image_layout.addWidget(self.interval_spinbox)
+        # Navigation takes two rows and the settings go in toolbars along the top, so the panes and the
+        # video keep their height
+        self.image_controls_layout = QGridLayout()
+        self.image_controls_layout.addWidget(self.prev_image_button, 0, 0)
+        self.image_controls_layout.addWidget(self.next_image_button, 0, 1)
+        self.image_controls_layout.addWidget(self.randomize_images_checkbox, 0, 2)
+        self.image_controls_layout.addWidget(self.slideshow_button, 1, 0)
+        self.image_controls_layout.addWidget(self.interval_spinbox, 1, 1)
+        self.image_layout.addLayout(self.image_controls_layout)
 
-        self.image_label = QLabel()
-        self.image_label.setScaledContents(True)  # Ensure the image scales with the label
-        self.image_layout.addWidget(self.image_label)
+        # A launch without paths restores the last session; more directories are opened from here
+        self.file_toolbar = self.addToolBar("File")
+        self.open_action = self.file_toolbar.addAction("Open…", self.load_directories)
+        self.open_action.setShortcut(QKeySequence.Open)
+        self.image_toolbar = self.addToolBar("Image Settings")
+        for widget in (self.prefetch_spinbox, self.cache_spinbox, self.memory_spinbox, self.rss_spinbox,
+                       self.fast_decode_checkbox, self.zoom_checkbox, self.grid_view_checkbox, self.warm_button,
+                       self.panes_spinbox, self.lockstep_checkbox):
+            self.image_toolbar.addWidget(widget)
+
+        # Image panes in a grid (2x3 for six); all of them share the prefetcher's worker pool and cache
+        self.panes_widget = QWidget()
+        self.panes_layout = QGridLayout(self.panes_widget)
+        self.panes_layout.setContentsMargins(0, 0, 0, 0)
+        self.panes_widget.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.image_layout.addWidget(self.panes_widget, 1)
+        self.image_panes = []
+        self.active_pane = None
 
         # Video widget and layout
         self.video_widget = QWidget()
@@ -64,20 +138,45 @@ class MediaViewer(QMainWindow):
         self.slideshow_video_button = QPushButton("Start Slideshow")
         self.slideshow_video_button.clicked.connect(self.toggle_video_slideshow)
         self.interval_video_spinbox = QSpinBox()
-        self.interval_video_spinbox.setRange(100, 10000)  # Interval range from 100ms to 10s
-        self.interval_video_spinbox.setValue(1000)  # Default to 1 second
+        self.interval_video_spinbox.setRange(0, 10000)  # Pause between videos in a slideshow, up to 10s
+        self.interval_video_spinbox.setValue(0)
+        self.interval_video_spinbox.setPrefix("Pause: ")
         self.interval_video_spinbox.setSuffix(" ms")
         self.interval_video_spinbox.valueChanged.connect(self.update_video_interval)
+        self.video_buffer_spinbox = QSpinBox()
+        self.video_buffer_spinbox.setRange(1, 120)  # Frames decoded ahead by the decoder thread
+        self.video_buffer_spinbox.setValue(8)
+        self.video_buffer_spinbox.setPrefix("Frame buffer: ")
+        self.video_buffer_spinbox.valueChanged.connect(self.update_video_buffer)
+        self.drop_frames_checkbox = QCheckBox("Drop Frames When Buffer Is Full")
+        self.drop_frames_checkbox.stateChanged.connect(self.update_video_buffer)
+        self.metrics_checkbox = QCheckBox("Show Metrics")
+        self.metrics_checkbox.stateChanged.connect(self.toggle_metrics_overlay)
+
+        self.video_controls_layout = QGridLayout()
+        self.video_controls_layout.addWidget(self.prev_video_button, 0, 0)
+        self.video_controls_layout.addWidget(self.next_video_button, 0, 1)
+        self.video_controls_layout.addWidget(self.randomize_videos_checkbox, 0, 2)
+        self.video_controls_layout.addWidget(self.slideshow_video_button, 1, 0)
+        self.video_controls_layout.addWidget(self.interval_video_spinbox, 1, 1)
+        self.video_layout.addLayout(self.video_controls_layout)
 
-        self.video_layout.addWidget(self.prev_video_button)
-        self.video_layout.addWidget(self.next_video_button)
-        self.video_layout.addWidget(self.randomize_videos_checkbox)
-        self.video_layout.addWidget(self.slideshow_video_button)
-        self.video_layout.addWidget(self.interval_video_spinbox)
+        self.video_toolbar = self.addToolBar("Video Settings")
+        for widget in (self.video_buffer_spinbox, self.drop_frames_checkbox, self.metrics_checkbox):
+            self.video_toolbar.addWidget(widget)
 
         self.video_label = QLabel()
-        self.video_label.setScaledContents(True)  # Ensure the video scales with the label
-        self.video_layout.addWidget(self.video_label)
+        self.video_label.setAlignment(Qt.AlignCenter)
+        self.video_label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.video_layout.addWidget(self.video_label, 1)
+
+        # Seek bar; keyframe indexes are built one at a time, apart from the worker pool
+        self.keyframe_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keyframe-index")
+        self.video_scrubber = VideoScrubber(self.keyframe_executor)
+        self.video_scrubber.scrub_started.connect(self.begin_scrub)
+        self.video_scrubber.preview_ready.connect(self.show_scrub_preview)
+        self.video_scrubber.seek_requested.connect(self.seek_video)
+        self.video_layout.addWidget(self.video_scrubber)
 
         # Add widgets to splitter
         self.splitter.addWidget(self.image_widget)
@@ -86,23 +185,122 @@ class MediaViewer(QMainWindow):
         # Set equal sizes
         self.splitter.setSizes([self.width() // 2, self.width() // 2])
 
-        self.image_files = []
-        self.video_files = []
-        self.current_image_index = 0
+        self.video_files = Playlist()
         self.current_video_index = 0
         self.is_randomized_images = False
         self.is_randomized_videos = False
+        # Randomized playback walks a seeded permutation of the (sorted) playlists instead of shuffling them
+        self.shuffle_seed = shuffle_seed
+        self.video_order = None  # ShuffleOrder while "Randomize Videos" is on; panes keep their own
+        self.video_position = 0  # Position of the current video in video_order
         self.slideshow_active = False
         self.video_slideshow_active = False
         self.slideshow_interval = 1000
-        self.video_slideshow_interval = 1000
+        self.video_slideshow_interval = 0
 
         self.image_timer = QTimer()
         self.image_timer.timeout.connect(self.update_image)
+        # Presentation tick; which frame is shown is decided by the decoder's clock, not by this interval
         self.video_timer = QTimer()
+        self.video_timer.setTimerType(Qt.PreciseTimer)
         self.video_timer.timeout.connect(self.update_video)
 
-        self.load_directories()
+        # Resizes (window or splitter) are debounced: a fast preview while dragging, one full re-render after
+        self.resize_timer = QTimer()
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.finish_resize)
+        self.label_images = {}  # label -> last QImage rendered for it, the source for previews
+        self.last_video_source = None  # Last decoded frame of a finished video
+        self.video_label.installEventFilter(self)
+
+        self.recursive_scan = recursive
+        self.scanners = {}  # running DirectoryScanner -> (pane, whether its videos are wanted)
+        self.scan_progress = {}  # DirectoryScanner -> (entries seen, matching files, entries/s)
+        self.thumbnail_indexes = {}  # scanned root -> ThumbnailIndex
+        self.scan_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.scan_status_label)
+        self.video_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.video_status_label)
+        self.warm_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.warm_status_label)
+        self.warmer = None
+        self.video_decoder = None
+        self.video_switch_start = None  # When show_video() was called, until the video's first frame is shown
+
+        # Stage timings, drops, cache hit rates and queue depths: drawn over the video, and/or
+        # appended to metrics_path (JSON lines, or CSV for a .csv path) every metrics_interval ms
+        self.metrics_overlay = QLabel(self.video_label)
+        self.metrics_overlay.setStyleSheet(
+            "background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; padding: 4px;")
+        self.metrics_overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.metrics_overlay.hide()
+        self.metrics_timer = QTimer()
+        self.metrics_timer.setInterval(500)
+        self.metrics_timer.timeout.connect(self.update_metrics_overlay)
+        self.metrics_exporter = MetricsExporter(metrics_path) if metrics_path else None
+        self.metrics_export_timer = QTimer()
+        self.metrics_export_timer.timeout.connect(self.export_metrics)
+        if self.metrics_exporter is not None:
+            self.metrics_export_timer.start(metrics_interval)
+
+        self.image_prefetcher = ImagePrefetcher(depth=self.prefetch_spinbox.value(),
+                                                cache_bytes=self.cache_spinbox.value() * 1024 * 1024)
+        # The next video in the playlist is opened on the worker pool while the current one plays
+        self.video_preroller = VideoPreroller(self.image_prefetcher.executor)
+
+        # Everything that holds decoded pixels counts against one budget. Over it, cached entries are
+        # evicted before prefetched ones; what is on screen and the playing video's buffer never are.
+        self.memory_holders = [
+            memory_budget.register('visible', VISIBLE, self.visible_bytes),
+            memory_budget.register('frame_buffer', VISIBLE, self.video_buffer_bytes),
+            memory_budget.register_cache('prefetched', PREFETCHED, self.image_prefetcher.display_cache),
+            memory_budget.register_cache('decoded', CACHED, self.image_prefetcher.source_cache),
+        ]
+        # Holders that don't report their puts, and the RSS, are checked on a timer
+        self.memory_timer = QTimer()
+        self.memory_timer.setInterval(1000)
+        self.memory_timer.timeout.connect(memory_budget.enforce)
+        self.update_memory_limit()
+        self.memory_timer.start()
+        # Tile pyramids are built one at a time, apart from the prefetch pool that reads their tiles
+        self.pyramid_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tile-pyramid")
+
+        # Scanned directories stay watched; a change relists just that directory and patches the playlists
+        self.watcher = DirectoryWatcher(self.image_prefetcher.executor)
+        self.watcher.directory_changed.connect(self.apply_directory_change)
+        self.watched_panes = {}  # watched directory -> pane whose playlist it feeds
+
+        self.set_pane_count(image_panes)
+
+        # Contact sheet of the selected pane's files; thumbnails come from the index, decoded on the prefetch pool
+        self.grid_model = ThumbnailGridModel(self.active_pane.files, self.image_prefetcher.executor,
+                                             index_for=self.thumbnail_index_for)
+        self.grid_view = ThumbnailGrid(self.grid_model)
+        self.grid_view.clicked.connect(self.open_grid_item)
+        self.grid_view.hide()
+        self.memory_holders.append(memory_budget.register('thumbnails', CACHED, lambda: self.grid_model.pixmap_bytes,
+                                                          self.grid_model.evict_bytes))
+        self.image_layout.addWidget(self.grid_view, 1)
+
+        # Playlists, positions and settings are saved to session_path on exit and every session_interval ms
+        self.session = None
+        self.restored_panes = []  # Pane of each saved pane number, None where that pane is scanned again
+        self.session_timer = QTimer()
+        self.session_timer.timeout.connect(self.save_session)
+        if session_path is not None:
+            self.session = SessionStore(session_path)
+            self.session.validated.connect(self.apply_session_listings)
+            self.session_timer.start(session_interval)
+
+        # Nothing is scanned before the window is up: the paths (or, without any, the last session or the
+        # directory dialog) are opened on the first turn of the event loop
+        if paths:
+            QTimer.singleShot(0, lambda: self.open_paths(paths))
+        elif self.session is not None:
+            QTimer.singleShot(0, self.restore_session)
+        else:
+            QTimer.singleShot(0, self.load_directories)
 
     def load_directories(self):
         file_dialog = QFileDialog(self)
@@ -111,190 +309,813 @@ class MediaViewer(QMainWindow):
         file_dialog.setViewMode(QFileDialog.List)
         file_dialog.setWindowTitle("Select Directories (Hold Ctrl for multiple)")
         if file_dialog.exec_():
-            dirs = file_dialog.selectedFiles()
-            for directory in dirs:
-                for file_name in os.listdir(directory):
-                    file_path = os.path.join(directory, file_name)
-                    if file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
-                        self.image_files.append(file_path)
-                    elif file_path.lower().endswith(('.mp4', '.webm', '.gif')):
-                        self.video_files.append(file_path)
-
-        self.image_files.sort()
-        self.video_files.sort()
-
-        print(f"Loaded image files: {self.image_files}")
-        print(f"Loaded video files: {self.video_files}")
-
-        if self.image_files:
-            self.show_image(0)
+            self.scan_directories(file_dialog.selectedFiles())
+
+    def session_state(self):
+        # Everything but the playlists themselves, which are saved as they are stored
+        scanning = {pane for pane, _ in self.scanners.values()}
+        decoder = self.video_decoder
+        return {
+            'recursive': self.recursive_scan,
+            'active_pane': self.image_panes.index(self.active_pane),
+            'panes': [{
+                'directories': pane.directories,
+                'index': pane.current_index,
+                'position': pane.position,
+                'direction': pane.direction,
+                'seed': pane.order.seed if pane.order is not None else None,
+                'complete': pane not in scanning,
+            } for pane in self.image_panes],
+            'video': {
+                'index': self.current_video_index,
+                'position': self.video_position,
+                'seed': self.video_order.seed if self.video_order is not None else None,
+                'frame': decoder.presented_frame if decoder is not None else 0,
+            },
+            'settings': self.settings_state(),
+        }
+
+    def settings_state(self):
+        return {
+            'panes': self.panes_spinbox.value(),
+            'lockstep': self.lockstep_checkbox.isChecked(),
+            'randomize_images': self.is_randomized_images,
+            'randomize_videos': self.is_randomized_videos,
+            'slideshow': self.slideshow_active,
+            'slideshow_interval': self.interval_spinbox.value(),
+            'video_slideshow': self.video_slideshow_active,
+            'video_slideshow_interval': self.interval_video_spinbox.value(),
+        }
+
+    def apply_settings(self, settings):
+        # The controls only; slideshows are started once there is something to show
+        self.panes_spinbox.setValue(settings['panes'])
+        self.lockstep_checkbox.setChecked(settings['lockstep'])
+        self.interval_spinbox.setValue(settings['slideshow_interval'])
+        self.interval_video_spinbox.setValue(settings['video_slideshow_interval'])
+        self.randomize_images_checkbox.setChecked(settings['randomize_images'])
+        self.randomize_videos_checkbox.setChecked(settings['randomize_videos'])
+
+    def save_session(self):
+        # Nothing opened yet (e.g. the dialog was cancelled) keeps the last session as it is
+        if self.session is None or not (self.video_files or any(pane.directories or pane.files
+                                                                for pane in self.image_panes)):
+            return
+        listings = [(directory, self.image_panes.index(self.watched_panes[directory]), self.watcher.mtimes.get(directory),
+                     files) for directory, files in list(self.watcher.listings.items())
+                    if self.watched_panes.get(directory) in self.image_panes]
+        self.session.save(self.session_state(), [pane.files for pane in self.image_panes] + [self.video_files],
+                          listings)
+
+    def restore_session(self):
+        # Puts the last session back without scanning: playlists, orders, positions and settings. The saved
+        # directories are checked against their mtimes in the background; only those that changed are listed
+        # again, through the watcher, and panes whose scan hadn't finished are scanned again.
+        start = time.perf_counter()
+        restored = self.session.load()
+        if restored is None:
+            self.load_directories()
+            return
+        state, playlists = restored
+        previous, recursive = self.settings_state(), self.recursive_scan
+        try:
+            check_state(state, playlists)
+            settings = state['settings']
+            if settings['panes'] > self.panes_spinbox.maximum():
+                raise ValueError(f"{settings['panes']} panes")
+            # Settings first: while the playlists are empty, the checkboxes only set the mode, and the
+            # saved orders are put back below
+            self.apply_settings(settings)
+            self.recursive_scan = state['recursive']
+            for pane, chunks in zip(self.image_panes, playlists):
+                pane.files.restore(chunks)
+            self.video_files.restore(playlists[-1])
+        except (ValueError, KeyError, TypeError) as e:
+            # The dialog's session starts from the settings as they were, not the rejected ones
+            print(f"Error: Unable to restore the session: {e}")
+            for pane in self.image_panes:
+                pane.files.reset()
+            self.video_files.reset()
+            self.apply_settings(previous)
+            self.recursive_scan = recursive
+            self.session.pending_listings = None
+            self.load_directories()
+            return
+
+        self.restored_panes = []
+        rescan = []
+        for pane, pane_state in zip(self.image_panes, state['panes']):
+            pane.directories = list(pane_state['directories'])
+            for directory in pane.directories:
+                if directory not in self.thumbnail_indexes:
+                    self.thumbnail_indexes[directory] = ThumbnailIndex(directory)
+            if not pane_state['complete']:
+                # Scanned again from the start; its videos go too, or they would be added twice
+                for directory in pane.directories:
+                    self.video_files.remove(self.video_files.paths_under(directory))
+                pane.files.reset()
+                rescan.append(pane)
+            self.restored_panes.append(None if pane in rescan else pane)
+            pane.current_index = min(pane_state['index'], max(len(pane.files) - 1, 0))
+            pane.direction = pane_state['direction']
+            if pane_state['seed'] is not None and pane.files:
+                pane.order = ShuffleOrder(len(pane.files), pane_state['seed'])
+                pane.position = pane_state['position'] % len(pane.order)
+            pane.update_title()
+        self.set_active_pane(self.image_panes[min(state['active_pane'], len(self.image_panes) - 1)])
+        video = state['video']
+        self.current_video_index = min(video['index'], max(len(self.video_files) - 1, 0))
+        if video['seed'] is not None and self.video_files:
+            self.video_order = ShuffleOrder(len(self.video_files), video['seed'])
+            self.video_position = video['position'] % len(self.video_order)
+
+        # A file deleted since is left off screen; relisting its directory moves the pane on to its neighbour
+        self.show_images([(pane, pane.current_index) for pane in self.image_panes
+                          if pane.files and os.path.exists(pane.current_file())])
         if self.video_files:
-            self.show_video(0)
+            self.show_video(self.current_video_index)
+            if video['frame'] and self.video_decoder is not None:
+                self.video_decoder.seek(video['frame'])
+        if settings['slideshow'] and not self.slideshow_active:
+            self.toggle_slideshow()
+        if settings['video_slideshow'] and not self.video_slideshow_active:
+            self.toggle_video_slideshow()
+        image_count = sum(len(pane.files) for pane in self.image_panes)
+        print(f"Restored {image_count} images, {len(self.video_files)} videos in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
 
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        self.update_image()
-        self.update_video()
+        self.session.validate()
+        for pane in rescan:
+            if pane.directories:
+                self.scan_pane(pane, pane.directories, include_videos=True)
 
-    def show_image(self, index):
-        if not self.image_files:
-            print("No image files available.")
+    def apply_session_listings(self, unchanged, changed):
+        # Saved listings whose directories kept their mtime are watched as they are. The changed ones are
+        # watched with their saved listing and relisted right away, so the watcher's diff patches the playlists.
+        self.session.pending_listings = None
+        listings = []
+        for directory, number, mtime_ns, files in unchanged + changed:
+            pane = self.restored_panes[number] if number < len(self.restored_panes) else None
+            if pane is not None and pane in self.image_panes and directory not in self.watched_panes:
+                self.watched_panes[directory] = pane
+                listings.append((directory, files, mtime_ns))
+        self.watcher.watch(listings)
+        for directory, _, _, _ in changed:
+            if self.watcher.is_watched(directory):
+                self.watcher.schedule(directory)
+            elif directory in self.watched_panes and not os.path.isdir(directory):
+                self.apply_directory_change(directory, [], [], [], [], [])  # Gone, with everything below it
+        print(f"Session: {len(unchanged)} directories unchanged, {len(changed)} changed")
+
+    def open_paths(self, paths):
+        # Directories are scanned like the dialog's; playlists and single files go straight into the
+        # active pane and the video playlist. Directories listed in a playlist are scanned too.
+        dirs, images, videos = [], [], []
+        pending = list(reversed(paths))  # Popped in the order given, which decides the panes directories go to
+        while pending:
+            path = os.path.abspath(os.path.expanduser(pending.pop()))
+            name = path.lower()
+            if os.path.isdir(path):
+                dirs.append(path)
+            elif not os.path.isfile(path):
+                print(f"Error: {path} not found")
+            elif name.endswith(PLAYLIST_EXTENSIONS):
+                try:
+                    # Playlists within playlists aren't followed, so they can't loop
+                    pending.extend(reversed([entry for entry in read_playlist(path)
+                                             if not entry.lower().endswith(PLAYLIST_EXTENSIONS)]))
+                except OSError as e:
+                    print(f"Error: Unable to read playlist {path}: {e}")
+            elif name.endswith(IMAGE_EXTENSIONS) or name.endswith(VIDEO_EXTENSIONS):
+                (videos if is_video(path) else images).append(path)
+            else:
+                print(f"Skipping {path}: not an image, video, playlist or directory")
+        # A file that's already in its playlist, or that a directory's scan will list, isn't added twice
+        dirs = self.new_directories(dirs)
+        images = [path for path in set(images)
+                  if path not in self.active_pane.files and not self.is_listed(path, dirs)]
+        videos = [path for path in set(videos)
+                  if path not in self.video_files and not self.is_listed(path, dirs)]
+        self.add_files(self.active_pane, sorted(images), sorted(videos))
+        self.scan_directories(dirs)
+
+    def new_directories(self, dirs):
+        # Drops repeats, directories bound to a pane already and, when recursive, those below another one
+        bound = [directory for pane in self.image_panes for directory in pane.directories]
+        dirs = [directory for directory in dict.fromkeys(dirs) if directory not in bound]
+        if self.recursive_scan:
+            dirs = [directory for directory in dirs
+                    if not any(directory.startswith(os.path.join(other, '')) for other in bound + dirs)]
+        return dirs
+
+    def is_listed(self, path, dirs):
+        # Whether scanning the directories lists the path: in one of them, or below one when recursive
+        parent = os.path.dirname(path)
+        return any(parent == directory or (self.recursive_scan and parent.startswith(os.path.join(directory, '')))
+                   for directory in dirs)
+
+    def scan_directories(self, dirs):
+        # Directories are dealt out to the panes in turn; with a single pane it gets all of them
+        dirs = self.new_directories(dirs)
+        new_dirs = {pane: [] for pane in self.image_panes}
+        for i, directory in enumerate(dirs):
+            if directory not in self.thumbnail_indexes:
+                self.thumbnail_indexes[directory] = ThumbnailIndex(directory)
+            new_dirs[self.image_panes[i % len(self.image_panes)]].append(directory)
+        for pane, pane_dirs in new_dirs.items():
+            if pane_dirs:
+                pane.directories.extend(pane_dirs)
+                pane.update_title()
+                self.scan_pane(pane, pane_dirs, include_videos=True)
+
+    def scan_pane(self, pane, dirs, include_videos):
+        # Every pane scans on its own background thread and streams sorted batches into its playlist.
+        # Videos from all of them go to the one video playlist.
+        scanner = DirectoryScanner(dirs, recursive=self.recursive_scan)
+        scanner.batch_found.connect(self.add_scanned_files)
+        scanner.progress.connect(self.update_scan_progress)
+        scanner.scan_finished.connect(self.finish_scan)
+        scanner.directories_found.connect(self.watch_directories)
+        self.scanners[scanner] = (pane, include_videos)
+        scanner.start()
+
+    def stop_scanners(self, pane=None):
+        for scanner, (scanner_pane, _) in list(self.scanners.items()):
+            if pane is None or scanner_pane is pane:
+                scanner.stop()
+                scanner.wait()
+                del self.scanners[scanner]
+                self.scan_progress.pop(scanner, None)
+
+    def add_scanned_files(self, images, videos):
+        if self.sender() not in self.scanners:
+            return  # Batch queued by a scanner that has since been stopped
+        pane, include_videos = self.scanners[self.sender()]
+        self.add_files(pane, images, videos if include_videos else [])
+
+    def add_files(self, pane, images, videos):
+        # Sorted images for a pane's playlist and sorted videos for the video playlist
+        if images:
+            was_empty = not pane.files
+            pane.current_index = self.merge_files(pane.files, images, pane.current_index)
+            if self.is_randomized_images:
+                pane.order = self.shuffle_order(pane.order, len(pane.files))
+                pane.position = pane.order.position_of(pane.current_index)
+            if was_empty:
+                self.show_image(0, pane)
+            else:
+                pane.update_title()
+            if self.grid_view.isVisible() and pane is self.active_pane:
+                self.grid_model.refresh()
+        if videos:
+            was_empty = not self.video_files
+            self.current_video_index = self.merge_files(self.video_files, videos, self.current_video_index)
+            if self.is_randomized_videos:
+                self.video_order = self.shuffle_order(self.video_order, len(self.video_files))
+                self.video_position = self.video_order.position_of(self.current_video_index)
+            if was_empty:
+                self.show_video(0)
+
+    def merge_files(self, files, new_files, current_index):
+        # Merges a batch into a playlist in place and returns the new index of the current entry.
+        # Playlists always stay in natural order; a randomized order is rebuilt over the new length by the caller.
+        current_file = files[current_index] if files else None
+        files.add(new_files)
+        if current_file is None:
+            return 0
+        return files.index(current_file)
+
+    def watch_directories(self, listings):
+        # (directory, contents, mtime) triples from a scanner; the watcher diffs later listings against them
+        if self.sender() not in self.scanners:
             return
+        pane = self.scanners[self.sender()][0]
+        for directory, _, _ in listings:
+            self.watched_panes[directory] = pane
+        self.watcher.watch(listings)
 
-        if self.is_randomized_images:
-            self.image_files = random.sample(self.image_files, len(self.image_files))
-            self.current_image_index = 0
+    def apply_directory_change(self, directory, images, videos, removed, replaced, subdirectories):
+        # What changed in one watched directory: patch the playlists in sorted position
+        pane = self.watched_panes.get(directory)
+        if pane is None or pane not in self.image_panes:
+            return
+        if not os.path.isdir(directory):
+            # Removed or renamed away, with everything below it; subdirectories may not report themselves
+            prefix = os.path.join(directory, '')
+            for watched in list(self.watched_panes):
+                if watched == directory or watched.startswith(prefix):
+                    del self.watched_panes[watched]
+                    self.watcher.unwatch(watched)
+            removed = removed + pane.files.paths_under(directory) + self.video_files.paths_under(directory)
 
-        if index < 0:
-            index = len(self.image_files) - 1
-        elif index >= len(self.image_files):
-            index = 0
+        current_file = pane.current_file()
+        pane.current_index = self.update_playlist(pane.files, pane.current_index, images, removed)
+        if self.is_randomized_images and pane.files:
+            pane.order = self.shuffle_order(pane.order, len(pane.files))
+            pane.position = pane.order.position_of(pane.current_index)
+        if not pane.files:
+            pane.label.clear()
+            self.label_images.pop(pane.label, None)
+        elif pane.current_file() != current_file or current_file in replaced:
+            self.show_image(pane.current_index, pane)
+        pane.update_title()
+        if self.grid_view.isVisible() and pane is self.active_pane:
+            self.grid_model.refresh()
+
+        # A removed video keeps playing to its end; the playlist moves on from its neighbour
+        self.current_video_index = self.update_playlist(self.video_files, self.current_video_index, videos, removed)
+        if self.video_order is not None and self.video_files:
+            self.video_order = self.shuffle_order(self.video_order, len(self.video_files))
+            self.video_position = self.video_order.position_of(self.current_video_index)
+
+        # Decoded images, thumbnails and index rows of removed or replaced files are stale
+        stale = removed + replaced
+        if stale:
+            self.image_prefetcher.invalidate(stale)
+            self.grid_model.invalidate(stale)
+            for index in self.thumbnail_indexes.values():
+                index.remove([file_path for file_path in stale if index.contains(file_path)])
 
-        file_path = self.image_files[index]
-        image = PILImage.open(file_path)
-        img_width, img_height = image.size
+        if self.recursive_scan:
+            new_dirs = [d for d in subdirectories if d not in self.watched_panes]
+            if new_dirs:
+                self.scan_pane(pane, new_dirs, include_videos=True)
 
-        # Resize image to fit within the image label
-        widget_width = self.image_label.width()
-        widget_height = self.image_label.height()
-        img_ratio = img_width / img_height
-        widget_ratio = widget_width / widget_height
+    def update_playlist(self, files, current_index, added, removed):
+        # Inserts and removes paths in sorted position (bisection, so O(log n) lookups per path at any
+        # playlist size) and returns the new index of the current entry, or of its successor if it was removed.
+        # Paths already present or already gone are skipped: a scan and the watcher can both report a file.
+        current_file = files[current_index] if files else None
+        removed = [p for p in set(removed) if p in files]
+        added = [p for p in set(added) if p not in files]
+        files.remove(removed)
+        files.add(added)
+        if not (removed or added) or current_file is None:
+            return current_index if files else 0
+        return min(files.bisect(current_file), max(len(files) - 1, 0))
 
-        if img_ratio > widget_ratio:
-            new_width = widget_width
-            new_height = int(new_width / img_ratio)
+    def set_pane_count(self, count):
+        # Rebuilds the pane grid and deals the directories out again; the scan of each pane is redone
+        directories = [directory for pane in self.image_panes for directory in pane.directories]
+        self.stop_scanners()
+        self.watcher.clear()
+        self.watched_panes.clear()
+        for pane in self.image_panes:
+            self.image_prefetcher.prefetch([], 0, 0, group=pane)
+            pane.set_zoom_view(None)
+            pane.label.clear()
+            self.label_images.pop(pane.label, None)
+            self.panes_layout.removeWidget(pane)
+            pane.deleteLater()
+
+        columns = math.ceil(math.sqrt(count))
+        self.image_panes = []
+        for i in range(count):
+            pane = ImagePane()
+            pane.activated.connect(self.set_active_pane)
+            pane.label.installEventFilter(self)
+            pane.set_title_visible(count > 1)
+            self.panes_layout.addWidget(pane, i // columns, i % columns)
+            self.image_panes.append(pane)
+        self.set_active_pane(self.image_panes[0])
+
+        for i, directory in enumerate(directories):
+            self.image_panes[i % count].directories.append(directory)
+        for pane in self.image_panes:
+            pane.update_title()
+            if pane.directories:
+                self.scan_pane(pane, pane.directories, include_videos=False)
+
+    def update_pane_count(self):
+        self.set_pane_count(self.panes_spinbox.value())
+        if self.grid_view.isVisible():
+            self.grid_model.set_file_paths(self.active_pane.files)
+
+    def set_active_pane(self, pane):
+        # Previous/Next (without lockstep), the grid view and Fast Decode act on the selected pane
+        self.active_pane = pane
+        for other in self.image_panes:
+            other.set_active(other is pane and len(self.image_panes) > 1)
+        self.zoom_checkbox.blockSignals(True)
+        self.zoom_checkbox.setChecked(pane.zoom_view is not None)
+        self.zoom_checkbox.blockSignals(False)
+
+    def toggle_grid_view(self, state):
+        grid_active = (state == Qt.Checked)
+        if grid_active:
+            self.grid_model.set_file_paths(self.active_pane.files)
+            self.grid_view.scrollTo(self.grid_model.index(self.active_pane.current_index))
+        else:
+            self.grid_model.cancel()
+        self.grid_view.setVisible(grid_active)
+        self.panes_widget.setVisible(not grid_active)
+
+    def toggle_zoom(self, state):
+        pane = self.active_pane
+        if state == Qt.Checked:
+            pane.set_zoom_view(TiledImageView(self.image_prefetcher.executor, self.pyramid_executor))
+            if pane.files:
+                pane.zoom_view.open(pane.current_file())
         else:
-            new_height = widget_height
-            new_width = int(new_height * img_ratio)
+            pane.set_zoom_view(None)
 
-        image = image.resize((new_width, new_height), PILImage.Resampling.LANCZOS)
-        qt_image = QImage(np.array(image), image.width, image.height, image.width * 3, QImage.Format_RGB888)
-        pixmap = QPixmap.fromImage(qt_image)
+    def open_grid_item(self, model_index):
+        self.grid_view_checkbox.setChecked(False)
+        self.show_image(model_index.row(), self.active_pane)
+
+    def thumbnail_index_for(self, file_path):
+        for index in self.thumbnail_indexes.values():
+            if index.contains(file_path):
+                return index
+        return None
+
+    def index_file(self, file_path, video=False):
+        # Record size, dimensions, format and a thumbnail for later sessions, off the GUI thread. Images
+        # are indexed from the decode they were just shown from. Videos, and images decoded too small
+        # for a thumbnail, have to be read once more; that waits on the keyframe thread rather than
+        # holding up the prefetch pool.
+        index = self.thumbnail_index_for(file_path)
+        if index is None:
+            return
+        image = None if video else self.image_prefetcher.source_image(file_path)
+        if image is not None and covers_size(image, *THUMBNAIL_SIZE):
+            self.image_prefetcher.executor.submit(index.add_image, file_path, image)
+        else:
+            self.keyframe_executor.submit(index.ensure, file_path)
+
+    def toggle_warm(self):
+        # Thumbnails and metadata for everything scanned so far, on a process pool. Files that are
+        # already indexed are skipped, so stopping and starting again carries on where it stopped.
+        if self.warmer is not None:
+            self.warmer.stop()
+            self.warm_button.setEnabled(False)  # Until the running chunks are in
+            return
+        if not self.thumbnail_indexes:
+            return
+        self.warmer = IndexWarmer(self.thumbnail_indexes.values(), recursive=self.recursive_scan)
+        self.warmer.progress.connect(self.update_warm_progress)
+        self.warmer.warm_finished.connect(self.finish_warm)
+        self.warmer.start()
+        self.warm_button.setText("Stop Warming")
 
-        self.image_label.setPixmap(pixmap)
-        self.current_image_index = index
+    def update_warm_progress(self, done, total, failed, rate):
+        self.warm_status_label.setText(f"Warming thumbnails: {done}/{total} ({rate:.0f} files/s), {failed} failed")
+
+    def finish_warm(self, indexed, failed, skipped, seconds):
+        self.warmer.wait()
+        self.warmer = None
+        self.warm_button.setText("Warm Thumbnails")
+        self.warm_button.setEnabled(True)
+        self.warm_status_label.setText(f"Thumbnails: {indexed} indexed, {failed} failed, {skipped} already indexed")
+        print(f"Warmed thumbnails in {seconds:.1f}s: {indexed} indexed, {failed} failed, {skipped} already indexed")
+
+    def update_scan_progress(self, seen, matched, rate):
+        # Totals over the scanners of all panes
+        if self.sender() not in self.scanners:
+            return
+        self.scan_progress[self.sender()] = (seen, matched, rate)
+        seen, matched, rate = (sum(values) for values in zip(*self.scan_progress.values()))
+        self.scan_status_label.setText(f"Scanning: {seen} entries, {matched} media files ({rate:.0f} entries/s)")
+
+    def finish_scan(self, seen, matched, elapsed):
+        scanner = self.sender()
+        if scanner not in self.scanners:
+            return
+        del self.scanners[scanner]
+        self.scan_progress.pop(scanner, None)
+        print(f"Scanned {seen} entries in {elapsed:.2f}s ({seen / max(elapsed, 1e-6):.0f} entries/s)")
+        if not self.scanners:
+            image_count = sum(len(pane.files) for pane in self.image_panes)
+            self.scan_status_label.setText(f"{image_count} images, {len(self.video_files)} videos")
+            counts = {}
+            for files in [pane.files for pane in self.image_panes] + [self.video_files]:
+                for extension, count in files.extension_counts().items():
+                    counts[extension] = counts.get(extension, 0) + count
+            summary = ", ".join(f"{count} {extension or '(none)'}" for extension, count in sorted(counts.items()))
+            print(f"{image_count} images, {len(self.video_files)} videos ({summary})")
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Resize and obj in self.label_images:
+            self.preview_resize(obj)
+            self.resize_timer.start()
+        return super().eventFilter(obj, event)
+
+    def preview_resize(self, label):
+        # Nearest-neighbour scale of what is already on screen; no decoding, no disk access
+        qt_image = self.label_images[label]
+        label.setPixmap(QPixmap.fromImage(qt_image.scaled(label.size(), Qt.KeepAspectRatio, Qt.FastTransformation)))
+
+    def finish_resize(self):
+        # Re-render once at the settled size, without advancing the slideshow or restarting the video
+        self.show_images([(pane, pane.current_index) for pane in self.image_panes
+                          if pane.files and pane.label in self.label_images])
+        if self.video_decoder is not None:
+            self.video_decoder.set_target_size(self.video_label.width(), self.video_label.height())
+        elif self.last_video_source is not None:
+            self.set_label_image(self.video_label, render_bgr_frame(
+                self.last_video_source, self.video_label.width(), self.video_label.height()))
+
+    def show_image(self, index, pane=None):
+        pane = pane or self.active_pane
+        if not pane.files:
+            print("No image files available.")
+            return
+        self.show_images([(pane, index)])
+
+    def show_images(self, targets):
+        # targets: (pane, index) pairs. All of them are queued on the worker pool before the first one
+        # is waited for, so a wall of panes decodes in parallel instead of one after the other.
+        jobs = []
+        for pane, index in targets:
+            if index < 0:
+                index = len(pane.files) - 1
+            elif index >= len(pane.files):
+                index = 0
+            pane.sync_position(index)
+            # Resize image to fit within the pane's label
+            jobs.append((pane, index, pane.files[index], pane.label.width(), pane.label.height()))
+        if len(jobs) > 1:
+            for _, _, file_path, width, height in jobs:
+                self.image_prefetcher.request(file_path, width, height)
+
+        for pane, index, file_path, width, height in jobs:
+            qt_image = self.image_prefetcher.get(file_path, width, height)
+            self.set_label_image(pane.label, qt_image)
+            if pane.zoom_view is not None:
+                pane.zoom_view.open(file_path)
+            pane.current_index = index
+            pane.update_title()
+            self.prefetch_images(pane)
+            self.index_file(file_path)
+        self.show_cache_stats()
+
+    def prefetch_images(self, pane):
+        # Decode the pane's next entries in its current direction (and one behind) on the worker pool.
+        # In randomized mode those are the neighbours in the shuffled order.
+        count = len(pane.files)
+        depth = min(self.image_prefetcher.depth, count - 1)
+        offsets = [pane.direction * step for step in range(1, depth + 1)]
+        if depth > 0:
+            offsets.append(-pane.direction)
+        file_paths = []
+        for offset in offsets:
+            file_path = pane.files[pane.index_after(offset)]
+            if file_path not in file_paths and file_path != pane.current_file():
+                file_paths.append(file_path)
+        self.image_prefetcher.prefetch(file_paths, pane.label.width(), pane.label.height(), group=pane)
 
     def show_video(self, index):
         if not self.video_files:
             print("No video files available.")
             return
 
-        if self.is_randomized_videos:
-            self.video_files = random.sample(self.video_files, len(self.video_files))
-            self.current_video_index = 0
-
         if index < 0:
             index = len(self.video_files) - 1
         elif index >= len(self.video_files):
             index = 0
 
+        if self.video_order is not None and self.video_order.index_at(self.video_position) != index:
+            self.video_position = self.video_order.position_of(index)
+
         file_path = self.video_files[index]
 
-        # Release previous video capture if it exists
-        if hasattr(self, 'cap'):
-            self.cap.release()
-
-        if file_path.lower().endswith('.gif'):
-            self.gif_file = PILImage.open(file_path)
-            self.gif_frames = [frame.copy() for frame in ImageSequence.Iterator(self.gif_file)]
-            self.gif_index = 0
-            self.gif_timer = QTimer()
-            self.gif_timer.timeout.connect(self.update_gif)
-            self.gif_timer.start(int(1000 / self.gif_file.info['duration']))
-            self.video_label.setPixmap(QPixmap.fromImage(QImage(np.array(self.gif_frames[self.gif_index]), self.gif_frames[self.gif_index].width, self.gif_frames[self.gif_index].height, self.gif_frames[self.gif_index].width * 3, QImage.Format_RGB888)))
-        else:
-            self.cap = cv2.VideoCapture(file_path)
-            if not self.cap.isOpened():
+        # Stop the previous decoder thread if it exists
+        if self.video_decoder is not None:
+            self.video_decoder.stop()
+            self.video_decoder = None
+        self.last_video_source = None
+
+        self.video_switch_start = time.perf_counter()
+        decoder = self.video_preroller.take(file_path)
+        prerolled = decoder is not None
+        if not prerolled:
+            decoder = open_decoder(file_path, self.video_label.width(), self.video_label.height(),
+                                   loop=not self.video_slideshow_active, buffer_size=self.video_buffer_spinbox.value(),
+                                   drop_when_full=self.drop_frames_checkbox.isChecked())
+            if not decoder.is_opened():
                 print(f"Error: Unable to open video file {file_path}")
+                decoder.stop()
+                self.video_scrubber.close_video()
                 return
+            decoder.start()
 
-            self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-            if self.fps <= 0:
-                self.fps = 30  # Default to 30 FPS if unable to get FPS
-
-            self.video_timer.start(int(1000 / self.fps))
+        self.video_decoder = decoder
+        self.update_video_buffer()  # Pre-rolled decoders buffer without dropping; now the settings apply
+        self.fps = decoder.fps
+        # Tick at twice the frame rate so a frame is never shown more than half a frame late
+        self.video_timer.start(max(1, int(500 / decoder.tick_rate())))
+        self.video_scrubber.open(file_path, decoder.frame_count, decoder.fps)
 
         self.current_video_index = index
+        self.index_file(file_path, video=True)
+        if prerolled:
+            self.update_video()  # Its first frame is already decoded; show it now, not on the next tick
 
     def update_image(self):
+        # The slideshow advances every pane
         if self.slideshow_active:
-            self.next_image()
+            self.step_images(self.image_panes, 1)
 
     def update_video(self):
-        if hasattr(self, 'cap'):
-            ret, frame = self.cap.read()
-            if ret:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = frame.shape
-                qt_image = QImage(frame.data, w, h, ch * w, QImage.Format_RGB888)
-                pixmap = QPixmap.fromImage(qt_image)
-
-                # Resize video to fit within the video label
-                widget_width = self.video_label.width()
-                widget_height = self.video_label.height()
-                frame_width = pixmap.width()
-                frame_height = pixmap.height()
-                frame_ratio = frame_width / frame_height
-                widget_ratio = widget_width / widget_height
-
-                if frame_ratio > widget_ratio:
-                    new_width = widget_width
-                    new_height = int(new_width / frame_ratio)
-                else:
-                    new_height = widget_height
-                    new_width = int(new_height * frame_ratio)
-
-                pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio)
-                self.video_label.setPixmap(pixmap)
-
-                # Continue slideshow or go to next video if slideshow is active
-                if self.video_slideshow_active:
-                    if not ret:
-                        self.cap.release()
-                        self.next_video()
-            else:
-                self.cap.release()
+        if self.video_decoder is not None and not self.video_scrubber.is_scrubbing():
+            # Decoding, colour conversion and scaling happen on the decoder thread; only present here
+            self.video_decoder.set_target_size(self.video_label.width(), self.video_label.height())
+            qt_image = self.video_decoder.next_frame()
+            if qt_image is not None:
+                # Frames buffered before a resize still have the old size; fit them cheaply until new ones arrive
+                fit_width, fit_height = fit_size(qt_image.width(), qt_image.height(),
+                                                 self.video_label.width(), self.video_label.height())
+                if abs(fit_width - qt_image.width()) > 1 or abs(fit_height - qt_image.height()) > 1:
+                    qt_image = qt_image.scaled(fit_width, fit_height, Qt.KeepAspectRatio, Qt.FastTransformation)
+                self.set_label_image(self.video_label, qt_image)
+                self.video_scrubber.set_position(self.video_decoder.presented_pts)
+                self.show_video_stats()
+                if self.video_switch_start is not None:
+                    # From the switch to the new video's first frame on screen; ~0 when it was pre-rolled
+                    metrics.add('video.switch', time.perf_counter() - self.video_switch_start)
+                    self.video_switch_start = None
+                    self.preroll_next_video()  # Now, so it doesn't compete with this video's first frames
+            elif self.video_decoder.at_end():
+                # Keep the last full-size frame so a resize after the end can re-render it
+                self.last_video_source = getattr(self.video_decoder, 'decode_buffer', None)
+                self.video_decoder.stop()
+                self.video_decoder = None
+                self.video_timer.stop()
                 if self.video_slideshow_active:
-                    self.next_video()
-        elif hasattr(self, 'gif_timer'):
-            self.update_gif()
+                    QTimer.singleShot(self.video_slideshow_interval, self.next_video)
 
-    def update_gif(self):
-        if self.gif_frames:
-            self.gif_index = (self.gif_index + 1) % len(self.gif_frames)
-            frame = self.gif_frames[self.gif_index]
-            qt_image = QImage(np.array(frame), frame.width, frame.height, frame.width * 3, QImage.Format_RGB888)
-            self.video_label.setPixmap(QPixmap.fromImage(qt_image))
+    def preroll_next_video(self):
+        # The video after this one in playback order, opened and decoding while this one plays
+        if len(self.video_files) < 2:
+            return
+        if self.video_order is None:
+            index = (self.current_video_index + 1) % len(self.video_files)
+        else:
+            index = self.video_order.index_at((self.video_position + 1) % len(self.video_order))
+        self.video_preroller.preroll(self.video_files[index], self.video_label.width(),
+                                     self.video_label.height(), self.video_buffer_spinbox.value(),
+                                     loop=not self.video_slideshow_active)
+
+    def begin_scrub(self):
+        # Playback holds still while the handle is dragged; the label shows keyframe previews instead
+        if self.video_decoder is not None:
+            self.video_decoder.clock.pause()
+
+    def show_scrub_preview(self, qt_image):
+        width, height = fit_size(qt_image.width(), qt_image.height(),
+                                 self.video_label.width(), self.video_label.height())
+        self.set_label_image(self.video_label, qt_image.scaled(width, height, Qt.KeepAspectRatio,
+                                                               Qt.SmoothTransformation))
+
+    def seek_video(self, frame_number):
+        # The exact frame; playback carries on from there. A video that already ended is reopened.
+        if self.video_decoder is None:
+            if not self.video_files:
+                return
+            self.show_video(self.current_video_index)
+            if self.video_decoder is None:
+                return
+        self.video_decoder.seek(frame_number)
+
+    def set_label_image(self, label, qt_image):
+        # The only copy on the GUI thread: uploading the display-sized buffer into a pixmap. Native
+        # formats aren't copied at all; the pixmap shares the buffer, which label_images keeps alive.
+        if not native_format(qt_image):
+            render_stats.record('upload', copies=1, nbytes=qt_image.sizeInBytes())
+        with metrics.timed('paint'):
+            label.setPixmap(QPixmap.fromImage(qt_image))
+        self.label_images[label] = qt_image
+
+    def show_video_stats(self):
+        decoder = self.video_decoder
+        self.video_status_label.setText(
+            f"{decoder.achieved_fps():.2f}/{decoder.fps:.2f} fps, dropped: {decoder.dropped}, "
+            f"skipped: {decoder.skipped} | "
+            f"Frame buffer: {decoder.occupancy()}/{decoder.buffer_size} (peak {decoder.peak_occupancy}), "
+            f"underruns: {decoder.underruns}, overwritten: {decoder.overwritten}")
+
+    def collect_metrics(self):
+        decoder = self.video_decoder
+        video = dict.fromkeys(['fps', 'achieved_fps', 'presented', 'dropped', 'skipped', 'underruns',
+                               'overwritten', 'buffer', 'buffer_size'])
+        if decoder is not None:
+            video.update(fps=round(decoder.fps, 2), achieved_fps=round(decoder.achieved_fps(), 2),
+                         presented=decoder.presented, dropped=decoder.dropped, skipped=decoder.skipped,
+                         underruns=decoder.underruns, overwritten=decoder.overwritten,
+                         buffer=decoder.occupancy(), buffer_size=decoder.buffer_size)
+        return {
+            'time': round(time.time(), 3),
+            'image_file': self.active_pane.current_file(),
+            'video_file': decoder.file_path if decoder is not None else None,
+            'stages': metrics.snapshot(),
+            'video': video,
+            'cache': {name: {'hit_rate': s['hit_rate'], 'entries': s['entries']}
+                      for name, s in self.image_prefetcher.cache_stats().items()},
+            'queues': {'prefetch': self.image_prefetcher.pending(), 'thumbnails': len(self.grid_model.pending)},
+            'preroll': {'hits': self.video_preroller.hits, 'misses': self.video_preroller.misses},
+            'memory': memory_budget.stats(),
+        }
+
+    def toggle_metrics_overlay(self, state):
+        if state == Qt.Checked:
+            self.update_metrics_overlay()
+            self.metrics_overlay.show()
+            self.metrics_timer.start()
+        else:
+            self.metrics_timer.stop()
+            self.metrics_overlay.hide()
+
+    def update_metrics_overlay(self):
+        record = self.collect_metrics()
+        lines = [f"{'stage':<14}{'count':>8}{'mean':>9}{'p95':>9}{'max':>9} ms"]
+        for stage, s in record['stages'].items():
+            if s['mean_ms'] is not None:
+                lines.append(f"{stage:<14}{s['count']:>8}{s['mean_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['max_ms']:>9.2f}")
+        video = record['video']
+        if video['fps'] is not None:
+            lines.append(f"fps {video['achieved_fps']:.2f}/{video['fps']:.2f}  dropped {video['dropped']}  "
+                         f"skipped {video['skipped']}  underruns {video['underruns']}")
+            lines.append(f"frame buffer {video['buffer']}/{video['buffer_size']}  overwritten {video['overwritten']}")
+        lines.append("cache hit rate " + "  ".join(f"{name} {c['hit_rate']:.0%}" for name, c in record['cache'].items()))
+        lines.append(f"queued: prefetch {record['queues']['prefetch']}  thumbnails {record['queues']['thumbnails']}")
+        lines.append(f"pre-rolled videos {record['preroll']['hits']}, opened cold {record['preroll']['misses']}")
+        memory = record['memory']
+        lines.append(f"memory {sum(memory['used_mb'].values()):.0f}/{memory['limit_mb']:.0f} MB, "
+                     f"rss {memory['rss_mb']:.0f} MB")
+        lines.append("  " + "  ".join(f"{category} {mb:.0f}" for category, mb in memory['used_mb'].items()))
+        self.metrics_overlay.setText("\n".join(lines))
+        self.metrics_overlay.adjustSize()
+        self.metrics_overlay.raise_()
+
+    def export_metrics(self):
+        self.metrics_exporter.write(self.collect_metrics())
+
+    def update_video_buffer(self):
+        # Takes effect on the playing video right away
+        if self.video_decoder is not None:
+            with self.video_decoder.condition:
+                self.video_decoder.buffer_size = self.video_buffer_spinbox.value()
+                self.video_decoder.drop_when_full = self.drop_frames_checkbox.isChecked()
+                if isinstance(self.video_decoder, AnimationDecoder):
+                    # A slideshow moves on when an animation ends, so it plays once instead of looping
+                    self.video_decoder.loop = not self.video_slideshow_active
+                self.video_decoder.condition.notify_all()
 
     def prev_image(self):
-        self.current_image_index = (self.current_image_index - 1) % len(self.image_files)
-        self.show_image(self.current_image_index)
+        self.step_images(self.navigated_panes(), -1)
 
     def next_image(self):
-        self.current_image_index = (self.current_image_index + 1) % len(self.image_files)
-        self.show_image(self.current_image_index)
+        self.step_images(self.navigated_panes(), 1)
+
+    def navigated_panes(self):
+        return self.image_panes if self.lockstep_checkbox.isChecked() else [self.active_pane]
+
+    def step_images(self, panes, step):
+        self.show_images([(pane, pane.step(step)) for pane in panes if pane.files])
 
     def prev_video(self):
-        self.current_video_index = (self.current_video_index - 1) % len(self.video_files)
-        self.show_video(self.current_video_index)
+        self.step_video(-1)
 
     def next_video(self):
-        self.current_video_index = (self.current_video_index + 1) % len(self.video_files)
-        self.show_video(self.current_video_index)
+        self.step_video(1)
+
+    def step_video(self, step):
+        if not self.video_files:
+            return
+        if self.video_order is None:
+            index = (self.current_video_index + step) % len(self.video_files)
+        else:
+            self.video_position = (self.video_position + step) % len(self.video_order)
+            index = self.video_order.index_at(self.video_position)
+        self.show_video(index)
+
+    def shuffle_order(self, order, length):
+        # Same seed over the new length when the playlist grows, so the order is reproducible
+        if order is not None:
+            return order.resized(length)
+        seed = self.shuffle_seed if self.shuffle_seed is not None else random.getrandbits(32)
+        print(f"Shuffle seed: {seed}")
+        return ShuffleOrder(length, seed)
 
     def toggle_randomize_images(self, state):
+        # Turning it off keeps the current images and continues in sorted order from there
         self.is_randomized_images = (state == Qt.Checked)
-        if self.is_randomized_images:
-            random.shuffle(self.image_files)
-            self.current_image_index = 0
-            self.show_image(self.current_image_index)
+        targets = []
+        for pane in self.image_panes:
+            pane.order = None
+            if self.is_randomized_images and pane.files:
+                pane.order = self.shuffle_order(None, len(pane.files))
+                pane.position = 0
+                targets.append((pane, pane.order.index_at(0)))
+        self.show_images(targets)
 
     def toggle_randomize_videos(self, state):
         self.is_randomized_videos = (state == Qt.Checked)
-        if self.is_randomized_videos:
-            random.shuffle(self.video_files)
-            self.current_video_index = 0
-            self.show_video(self.current_video_index)
+        self.video_order = None
+        if self.is_randomized_videos and self.video_files:
+            self.video_order = self.shuffle_order(None, len(self.video_files))
+            self.video_position = 0
+            self.show_video(self.video_order.index_at(0))
 
     def toggle_slideshow(self):
         if self.slideshow_active:
@@ -308,28 +1129,113 @@ class MediaViewer(QMainWindow):
             self.image_timer.start(self.slideshow_interval)
 
     def toggle_video_slideshow(self):
+        # The slideshow moves on when a video ends; the presentation tick is left alone
         if self.video_slideshow_active:
             self.video_slideshow_active = False
             self.slideshow_video_button.setText("Start Slideshow")
-            self.video_timer.stop()
         else:
             self.video_slideshow_active = True
             self.slideshow_video_button.setText("Stop Slideshow")
             self.update_video_interval()
-            self.video_timer.start(self.video_slideshow_interval)
+            if self.video_decoder is None and self.video_files:
+                self.next_video()
+        self.update_video_buffer()
 
     def update_interval(self):
         self.slideshow_interval = self.interval_spinbox.value()
         if self.slideshow_active:
             self.image_timer.start(self.slideshow_interval)
 
+    def toggle_fast_decode(self, state):
+        self.image_prefetcher.reduced_decode = (state == Qt.Checked)
+        self.image_prefetcher.cancel()  # Queued jobs were started with the old setting
+        self.show_images([(pane, pane.current_index) for pane in self.image_panes if pane.files])
+
+    def update_memory_limit(self):
+        memory_budget.max_bytes = self.memory_spinbox.value() * 1024 * 1024
+        memory_budget.max_rss = self.rss_spinbox.value() * 1024 * 1024 or None
+        memory_budget.enforce()
+
+    def visible_bytes(self):
+        # The labels' images, plus the pixmap copy where Qt had to convert one. Called from any thread.
+        return sum(image.sizeInBytes() * (1 if native_format(image) else 2)
+                   for image in list(self.label_images.values()))
+
+    def video_buffer_bytes(self):
+        decoder = self.video_decoder
+        return (decoder.buffered_bytes() if decoder is not None else 0) + self.video_preroller.buffered_bytes()
+
+    def update_cache_size(self):
+        self.image_prefetcher.set_cache_bytes(self.cache_spinbox.value() * 1024 * 1024)
+
+    def show_cache_stats(self):
+        stats = self.image_prefetcher.cache_stats()
+        self.statusBar().showMessage(
+            " | ".join(f"{name} cache: {s['hits']} hits, {s['misses']} misses, {s['bytes'] // (1024 * 1024)} MB"
+                       for name, s in stats.items()))
+
+    def update_prefetch_depth(self):
+        self.image_prefetcher.depth = self.prefetch_spinbox.value()
+        for pane in self.image_panes:
+            if pane.files:
+                self.prefetch_images(pane)
+
     def update_video_interval(self):
         self.video_slideshow_interval = self.interval_video_spinbox.value()
-        if self.video_slideshow_active:
-            self.video_timer.start(self.video_slideshow_interval)
+
+    def closeEvent(self, event):
+        self.save_session()
+        self.session_timer.stop()
+        self.metrics_timer.stop()
+        self.metrics_export_timer.stop()
+        self.memory_timer.stop()
+        if self.metrics_exporter is not None:
+            self.export_metrics()
+        for holder in self.memory_holders:
+            memory_budget.unregister(holder)
+        self.stop_scanners()
+        if self.warmer is not None:
+            self.warmer.stop()
+            self.warmer.wait()
+        self.grid_model.cancel()
+        self.video_preroller.cancel()
+        self.image_prefetcher.shutdown()
+        for pane in self.image_panes:
+            pane.set_zoom_view(None)
+        self.pyramid_executor.shutdown(wait=False, cancel_futures=True)
+        self.video_scrubber.close_video()  # Stops a keyframe index that is being built
+        self.keyframe_executor.shutdown(wait=False, cancel_futures=True)
+        if self.video_decoder is not None:
+            self.video_decoder.stop()
+        for index in self.thumbnail_indexes.values():
+            index.close()
+        if self.session is not None:
+            self.session.close()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    viewer = MediaViewer()
+    parser = argparse.ArgumentParser(
+        description="Browse the images and videos of directories, playlists (.m3u, .m3u8 or .txt, one path "
+                    "per line) and single files. Without any, a directory dialog opens.")
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--recursive', action='store_true', help="Scan subdirectories too")
+    parser.add_argument('--seed', type=int, help="Seed of the randomized orders (default: a new one each run)")
+    parser.add_argument('--panes', type=int, default=1, help="Image panes; directories are dealt out to them in turn")
+    parser.add_argument('--memory-limit', type=int, default=1024, help="MB of decoded media kept in memory")
+    parser.add_argument('--rss-limit', type=int, default=0, help="MB the whole process may use (default: no limit)")
+    parser.add_argument('--metrics', help="Append metrics to this file, as JSON lines or, for a .csv path, CSV")
+    parser.add_argument('--metrics-interval', type=int, default=5000, help="Milliseconds between metrics exports")
+    parser.add_argument('--session', default=DEFAULT_SESSION_PATH,
+                        help="Session file, restored when no paths are given and saved on exit (default: %(default)s)")
+    parser.add_argument('--session-interval', type=int, default=30000, help="Milliseconds between session saves")
+    parser.add_argument('--no-session', action='store_true', help="Neither restore nor save a session")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    viewer = MediaViewer(recursive=args.recursive, shuffle_seed=args.seed, metrics_path=args.metrics,
+                         metrics_interval=args.metrics_interval, image_panes=args.panes,
+                         memory_limit=args.memory_limit, rss_limit=args.rss_limit, paths=args.paths,
+                         session_path=None if args.no_session else args.session,
+                         session_interval=args.session_interval)
     viewer.show()
     sys.exit(app.exec_())
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import os
+import cv2
+import numpy as np
+from PyQt5.QtGui import QImage
+from PIL import Image as PILImage
+from image_cache import file_cache_key
+from thumbnail_index import DEFAULT_INDEX_DIR, encode_thumbnail
+from directory_scanner import ANIMATION_EXTENSIONS
+from video_decoder import frame_duration
+
+DEFAULT_KEYFRAME_DIR = os.path.join(DEFAULT_INDEX_DIR, 'keyframes')
+PREVIEW_SIZE = (480, 270)
+PREVIEW_SPACING = 1.0  # Seconds between previews at least, however short the GOPs are
+MAX_PREVIEWS = 1000  # Per video; long videos get sparser previews instead of a bigger file
+
+
+def keyframe_index_path(file_path, index_dir=DEFAULT_KEYFRAME_DIR):
+    # Keyed by path, mtime and size like the tile pyramids: a rewritten file gets a new index
+    key = "\0".join(str(part) for part in file_cache_key(os.path.abspath(file_path)))
+    return os.path.join(index_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+
+def scan_packets(file_path):
+    # Timestamp of every frame and which ones are keyframes, from the demuxer alone: OpenCV's raw
+    # mode hands back packets without decoding them, so this reads a whole video in milliseconds.
+    # None if the backend can't do that.
+    cap = cv2.VideoCapture(file_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    try:
+        if not cap.isOpened() or cap.get(cv2.CAP_PROP_FORMAT) != -1:
+            return None
+        times = []
+        keyframe_times = []
+        while cap.grab():
+            pts = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            times.append(pts)
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframe_times.append(pts)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+    finally:
+        cap.release()
+    if not times:
+        return None
+    # Packets come in decode order; with B-frames that isn't presentation order
+    times = np.sort(np.array(times))
+    keyframes = np.searchsorted(times, keyframe_times) if keyframe_times else np.arange(len(times))
+    duration = times[-1] + (1 / fps if fps > 0 else 1 / 30)
+    return times, np.unique(keyframes), duration
+
+
+def estimate_times(file_path):
+    # Frame timestamps from the container's frame count and rate, for backends without raw mode
+    cap = cv2.VideoCapture(file_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else 0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    finally:
+        cap.release()
+    if fps <= 0:
+        fps = 30
+    times = np.arange(max(frame_count, 1)) / fps
+    return times, np.arange(len(times)), len(times) / fps
+
+
+def choose_previews(times, keyframes, duration):
+    # Keyframes at least PREVIEW_SPACING (or duration / MAX_PREVIEWS) seconds apart
+    spacing = max(PREVIEW_SPACING, duration / MAX_PREVIEWS)
+    chosen = []
+    for frame in keyframes:
+        if not chosen or times[frame] - times[chosen[-1]] >= spacing:
+            chosen.append(frame)
+    return chosen
+
+
+def encode_video_previews(file_path, frames, stopped):
+    # One decoding pass; only the chosen frames are converted and encoded
+    previews = {}
+    wanted = set(frames)
+    cap = cv2.VideoCapture(file_path)
+    try:
+        frame_number = 0
+        while len(previews) < len(wanted) and not stopped() and cap.grab():
+            if frame_number in wanted:
+                ret, frame = cap.retrieve()
+                if ret:
+                    image = PILImage.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                    previews[frame_number] = encode_thumbnail(image, PREVIEW_SIZE)
+            frame_number += 1
+    finally:
+        cap.release()
+    return previews
+
+
+def scan_animation(file_path, stopped):
+    # GIF/WebP/APNG frames are all complete images once composited, so every frame counts as a keyframe
+    times = []
+    previews = {}
+    position = 0.0
+    with PILImage.open(file_path) as image:
+        preview_every = max(1, getattr(image, 'n_frames', 1) // MAX_PREVIEWS)
+        for frame_number in range(getattr(image, 'n_frames', 1)):
+            if stopped():
+                break
+            image.seek(frame_number)
+            times.append(position)
+            position += frame_duration(image.info) / 1000
+            if frame_number % preview_every == 0:
+                previews[frame_number] = encode_thumbnail(image.convert('RGB'), PREVIEW_SIZE)
+    times = np.array(times)
+    return times, np.arange(len(times)), position, previews
+
+
+def build_keyframe_index(file_path, stopped=lambda: False, scanned=None):
+    # Timestamps first (fast), then previews of the chosen keyframes (a decoding pass, a fraction of
+    # the video's running time). scanned(index) gets the index without previews as soon as the
+    # timestamps are known. None if stopped() turned true.
+    if file_path.lower().endswith(ANIMATION_EXTENSIONS):
+        times, keyframes, duration, previews = scan_animation(file_path, stopped)
+    else:
+        times, keyframes, duration = scan_packets(file_path) or estimate_times(file_path)
+        if scanned is not None:
+            scanned(KeyframeIndex(times, keyframes, duration))
+        previews = encode_video_previews(file_path, choose_previews(times, keyframes, duration), stopped)
+    if stopped():
+        return None
+    preview_frames = np.array(sorted(previews), dtype=np.int64)
+    data = [previews[frame] for frame in preview_frames]
+    offsets = np.cumsum([0] + [len(d) for d in data], dtype=np.int64)
+    return KeyframeIndex(times, keyframes, duration, preview_frames, offsets,
+                         np.frombuffer(b"".join(data), dtype=np.uint8))
+
+
+def open_keyframe_index(file_path, index_dir=DEFAULT_KEYFRAME_DIR, stopped=lambda: False, scanned=None):
+    # The video's index from the cache, built (and cached) first if there is none. The first time
+    # takes a decoding pass over the file, so call it off the GUI thread.
+    path = keyframe_index_path(file_path, index_dir)
+    try:
+        with np.load(path) as data:
+            return KeyframeIndex(data['times'], data['keyframes'], float(data['duration']),
+                                 data['preview_frames'], data['preview_offsets'], data['preview_data'])
+    except (OSError, KeyError, ValueError):
+        pass
+    index = build_keyframe_index(file_path, stopped, scanned)
+    if index is not None:
+        index.save(path)
+    return index
+
+
+class KeyframeIndex:
+    # Presentation time of every frame, the keyframes among them, and small JPEG previews of some
+    # keyframes, all in a few flat arrays
+    def __init__(self, times, keyframes, duration, preview_frames=None, preview_offsets=None, preview_data=None):
+        self.times = times
+        self.keyframes = keyframes
+        self.duration = duration
+        self.preview_frames = preview_frames if preview_frames is not None else np.zeros(0, dtype=np.int64)
+        self.preview_offsets = preview_offsets if preview_offsets is not None else np.zeros(1, dtype=np.int64)
+        self.preview_data = preview_data if preview_data is not None else np.zeros(0, dtype=np.uint8)
+
+    @property
+    def frame_count(self):
+        return len(self.times)
+
+    def frame_at(self, seconds):
+        # Frame showing at a position; animations keep counting up across loops, so positions wrap
+        if self.duration > 0 and seconds >= self.duration:
+            seconds %= self.duration
+        return max(0, int(np.searchsorted(self.times, seconds + 1e-6, 'right')) - 1)
+
+    def time_of(self, frame_number):
+        return float(self.times[min(max(frame_number, 0), len(self.times) - 1)])
+
+    def preview(self, frame_number):
+        # (frame number, QImage) of the preview closest to a frame, or None before previews exist
+        if not len(self.preview_frames):
+            return None
+        i = int(np.searchsorted(self.preview_frames, frame_number))
+        if i == len(self.preview_frames) or (
+                i > 0 and frame_number - self.preview_frames[i - 1] < self.preview_frames[i] - frame_number):
+            i -= 1
+        data = self.preview_data[self.preview_offsets[i]:self.preview_offsets[i + 1]]
+        return int(self.preview_frames[i]), QImage.fromData(data.tobytes(), 'JPG')
+
+    def save(self, path):
+        # Written next to its final name and renamed, so a half-written index is never read
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez(buffer, times=self.times, keyframes=self.keyframes, duration=self.duration,
+                 preview_frames=self.preview_frames, preview_offsets=self.preview_offsets,
+                 preview_data=self.preview_data)
+        temporary = f"{path}.tmp-{os.getpid()}"
+        with open(temporary, 'wb') as f:
+            f.write(buffer.getbuffer())
+        os.replace(temporary, path)
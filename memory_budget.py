@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Eviction priorities: cached entries go first, then prefetched ones; what is on screen is never evicted
+VISIBLE, PREFETCHED, CACHED = 0, 1, 2
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def resident_bytes():
+    # Current RSS, or None where /proc isn't there
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryHolder:
+    __slots__ = ('category', 'priority', 'usage', 'evict')
+
+    def __init__(self, category, priority, usage, evict):
+        self.category = category
+        self.priority = priority
+        self.usage = usage  # () -> bytes held now
+        self.evict = evict  # (bytes) -> bytes freed, dropping least recently used first; None if it can't
+
+
+class MemoryBudget:
+    # One ceiling over everything that holds decoded pixels: caches, prefetched images, video frame
+    # buffers, tiles, thumbnails and what is on screen. Each holder keeps its own limit too; this only
+    # decides which of them gives memory back when all of them together (or the process RSS) are over.
+    # evict() may be called from any thread, so holders that live on the GUI thread evict through a signal.
+    def __init__(self, max_bytes=1024 * 1024 * 1024, max_rss=None):
+        self.max_bytes = max_bytes
+        self.max_rss = max_rss  # None: no RSS ceiling
+        self.holders = []
+        self.lock = threading.Lock()  # Guards holders
+        self.enforcing = threading.Lock()  # One enforce() at a time; the others have nothing left to do
+        self.evicted = defaultdict(int)  # category -> bytes evicted so far
+
+    def register(self, category, priority, usage, evict=None):
+        holder = MemoryHolder(category, priority, usage, evict)
+        with self.lock:
+            self.holders.append(holder)
+        return holder
+
+    def register_cache(self, category, priority, cache):
+        # An LRUCache, which then calls enforce() after every put
+        cache.budget = self
+        return self.register(category, priority, lambda: cache.current_bytes, cache.evict_bytes)
+
+    @contextmanager
+    def reserve(self, category, nbytes):
+        # Counts a short-lived allocation, e.g. a full-resolution decode, for as long as the block runs.
+        # Room is made for it first, so the caches shrink before the allocation rather than after it.
+        holder = self.register(category, VISIBLE, lambda: nbytes)
+        try:
+            self.enforce()
+            yield
+        finally:
+            self.unregister(holder)
+
+    def unregister(self, holder):
+        with self.lock:
+            if holder in self.holders:
+                self.holders.remove(holder)
+
+    def usage(self):
+        # category -> bytes
+        with self.lock:
+            holders = list(self.holders)
+        usage = defaultdict(int)
+        for holder in holders:
+            usage[holder.category] += holder.usage()
+        return dict(usage)
+
+    def total(self):
+        return sum(self.usage().values())
+
+    def enforce(self):
+        # Evicts until the holders fit in max_bytes and the RSS in max_rss, lowest priority first and
+        # within a priority the biggest holder first. Returns the bytes evicted.
+        if not self.enforcing.acquire(blocking=False):
+            return 0
+        try:
+            with self.lock:
+                holders = list(self.holders)
+            sizes = {holder: holder.usage() for holder in holders}
+            excess = sum(sizes.values()) - self.max_bytes
+            if self.max_rss is not None:
+                rss = resident_bytes()
+                if rss is not None:
+                    excess = max(excess, rss - self.max_rss)
+            freed = 0
+            for priority in (CACHED, PREFETCHED):
+                candidates = [holder for holder in holders if holder.priority == priority and holder.evict is not None]
+                for holder in sorted(candidates, key=sizes.get, reverse=True):
+                    if freed >= excess:
+                        return freed
+                    evicted = holder.evict(excess - freed)
+                    self.evicted[holder.category] += evicted
+                    freed += evicted
+            return freed
+        finally:
+            self.enforcing.release()
+
+    def stats(self):
+        usage = self.usage()
+        evicted = dict(self.evicted)
+        return {
+            'limit_mb': round(self.max_bytes / (1024 * 1024), 1),
+            'rss_limit_mb': round(self.max_rss / (1024 * 1024), 1) if self.max_rss is not None else None,
+            'rss_mb': round((resident_bytes() or 0) / (1024 * 1024), 1),
+            'used_mb': {category: round(nbytes / (1024 * 1024), 1) for category, nbytes in sorted(usage.items())},
+            'evicted_mb': {category: round(nbytes / (1024 * 1024), 1) for category, nbytes in sorted(evicted.items())},
+        }
+
+
+memory_budget = MemoryBudget()
@@ -0,0 +1,112 @@
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+# Stage timings, per media kind. Paint is the GUI-thread upload into the label's pixmap;
+# video.switch is from asking for another video to its first frame on screen.
+STAGES = ['video.decode', 'video.scale', 'video.convert', 'video.switch', 'image.decode', 'image.scale', 'image.convert',
+          'paint']
+
+
+class StageTimer:
+    # Context manager for Metrics.timed(); a class rather than @contextmanager to keep the hot path cheap
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.add(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    # Recent per-stage timings (a sliding window of samples) plus running totals.
+    # Written from the decoder and prefetch threads, read by the overlay and the exporter.
+    def __init__(self, window=240):
+        self.lock = threading.Lock()
+        self.window = window
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+        self.totals = defaultdict(lambda: [0, 0.0])  # stage -> [count, seconds]
+
+    def timed(self, stage):
+        return StageTimer(self, stage)
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+            totals = self.totals[stage]
+            totals[0] += 1
+            totals[1] += seconds
+
+    def snapshot(self):
+        # stage -> all-time count and mean/p95/max over the window in ms. Every known stage is
+        # present (None until it has samples), so exported columns stay the same from the start.
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items() if values}
+            totals = {stage: list(counts) for stage, counts in self.totals.items()}
+        result = {stage: {'count': 0, 'mean_ms': None, 'p95_ms': None, 'max_ms': None} for stage in STAGES}
+        for stage, values in samples.items():
+            result[stage] = {
+                'count': totals[stage][0],
+                'mean_ms': round(sum(values) / len(values) * 1000, 3),
+                'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3),
+            }
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+
+
+metrics = Metrics()
+
+
+def flatten(record, prefix=''):
+    # {'a': {'b': 1}} -> {'a.b': 1}, for CSV columns
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+class MetricsExporter:
+    # Appends one record per call: JSON lines, or CSV when the path ends in .csv.
+    # CSV columns are fixed by the first record written; later keys that weren't there are dropped.
+    def __init__(self, path):
+        self.path = path
+        self.csv = path.lower().endswith('.csv')
+        self.fieldnames = None
+
+    def write(self, record):
+        try:
+            if not self.csv:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+                return
+            row = flatten(record)
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            if self.fieldnames is None:
+                if new_file:
+                    self.fieldnames = list(row)
+                else:
+                    with open(self.path, newline='') as f:
+                        self.fieldnames = next(csv.reader(f), None) or list(row)
+            with open(self.path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction='ignore')
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+        except OSError as e:
+            print(f"Error: Unable to write metrics to {self.path}: {e}")
@@ -0,0 +1,389 @@
+import os
+import re
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate, chain, repeat
+
+MASK_64 = (1 << 64) - 1
+PLAYLIST_EXTENSIONS = ('.m3u', '.m3u8', '.txt')
+NUMBER = re.compile(r'([0-9]+)')
+# Longer runs of digits are split into numbers of this many digits, so their lengths are single ASCII bytes
+MAX_DIGITS = 127
+
+
+def mix(value, key):
+    # splitmix64-style finaliser; cheap, and good enough to make a Feistel round look random
+    value = (value ^ key) * 0x9E3779B97F4A7C15 & MASK_64
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & MASK_64
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & MASK_64
+    return value ^ (value >> 31)
+
+
+class ShuffleOrder:
+    # A seeded permutation of range(length) that is computed per position instead of stored:
+    # index_at() and position_of() are O(1), nothing is copied, and the same seed gives the same order.
+    # It is a small Feistel network over the next power of four, cycle-walking values that fall outside.
+    ROUNDS = 4
+
+    def __init__(self, length, seed):
+        self.length = length
+        self.seed = seed
+        self.half_bits = max(1, ((max(length, 2) - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+        self.keys = [mix(seed & MASK_64, round_number) for round_number in range(self.ROUNDS)]
+
+    def __len__(self):
+        return self.length
+
+    def encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ (mix(right, key) & self.half_mask)
+        return (left << self.half_bits) | right
+
+    def decrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in reversed(self.keys):
+            left, right = right ^ (mix(left, key) & self.half_mask), left
+        return (left << self.half_bits) | right
+
+    def index_at(self, position):
+        # Playlist index shown at this position of the shuffled order
+        value = self.encrypt(position % self.length)
+        while value >= self.length:
+            value = self.encrypt(value)
+        return value
+
+    def position_of(self, index):
+        value = self.decrypt(index)
+        while value >= self.length:
+            value = self.decrypt(value)
+        return value
+
+    def resized(self, length):
+        return ShuffleOrder(length, self.seed)
+
+
+def read_playlist(path):
+    # Paths listed in an M3U or plain text playlist, one per line; '#' lines are comments or M3U tags.
+    # Relative entries are relative to the playlist, as players resolve them. URLs are skipped.
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '://' in line:
+                continue
+            entries.append(os.path.normpath(os.path.join(base, os.path.expanduser(line))))
+    return entries
+
+
+def natural_key(text):
+    # Bytes that compare in natural order ("img2" before "img10") and decode back to the text. Every run
+    # of digits becomes '0', its length without leading zeros, those digits and the number of leading
+    # zeros. What is left of the text has no digits, so the marker orders numbers against text the way
+    # ASCII orders digits, and the length and digits order numbers by value.
+    parts = NUMBER.split(text)
+    for i in range(1, len(parts), 2):
+        run = parts[i]
+        if len(run) > MAX_DIGITS:
+            parts[i] = "".join(natural_key(run[j:j + MAX_DIGITS]).decode('ascii') for j in range(0, len(run), MAX_DIGITS))
+            continue
+        digits = run.lstrip('0') or '0'
+        parts[i] = f"0{chr(len(digits))}{digits}{chr(len(run) - len(digits))}"
+    return "".join(parts).encode('utf-8', 'surrogateescape')
+
+
+def natural_text(key):
+    # The text a natural_key() was made from
+    parts = []
+    position = 0
+    while True:
+        marker = key.find(b'0', position)
+        if marker < 0:
+            parts.append(key[position:])
+            return b''.join(parts).decode('utf-8', 'surrogateescape')
+        parts.append(key[position:marker])
+        end = marker + 2 + key[marker + 1]
+        parts.append(b'0' * key[end] + key[marker + 2:end])
+        position = end + 1
+
+
+def split_path(path):
+    # (directory with its trailing separator, name), so that joining them is just prefix + name
+    cut = path.rfind(os.sep) + 1
+    return path[:cut], path[cut:]
+
+
+def extension_of(name):
+    dot = name.rfind('.')
+    return name[dot:].lower() if dot > 0 else ''
+
+
+class Playlist:
+    # A list of file paths kept in natural order, compact enough for millions of entries. Each directory is
+    # stored once; an entry is its directory's number, its extension's number and its name's natural_key(),
+    # which lives in one shared byte buffer. Entries of a directory form one block, and blocks are ordered
+    # by their directory's natural_key(). Reading an entry is O(1); finding a path bisects the blocks, then
+    # the names in its block, comparing the stored keys as they are.
+    def __init__(self, paths=()):
+        self.directories = []  # Directory number -> directory, with its trailing separator
+        self.directory_numbers = {}
+        self.extensions = []  # Extension number -> lower-case extension with its dot, or ''
+        self.extension_numbers = {}
+        self.changes = 0  # Counts edits, so a saved copy can tell whether it is out of date
+        self.reset(paths)
+
+    def reset(self, paths=()):
+        self.block_keys = []  # natural_key() of each block's directory, in playlist order
+        self.block_directories = []
+        self.block_sizes = []
+        self.block_starts = [0]  # Index of each block's first entry, and the length at the end
+        self.names = bytearray()  # Keys of names in the order they were added; removed ones stay until compacted
+        self.unused = 0  # Bytes of names no entry refers to any more
+        self.offsets = array('Q')  # Per entry: where its name's key starts in names
+        self.lengths = array('H')
+        self.entry_directories = array('I')
+        self.entry_extensions = bytearray()
+        self.changes += 1
+        self.add(paths)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.offsets)
+        if not 0 <= index < len(self.offsets):
+            raise IndexError("playlist index out of range")
+        offset = self.offsets[index]
+        name = natural_text(bytes(self.names[offset:offset + self.lengths[index]]))
+        return self.directories[self.entry_directories[index]] + name
+
+    def __iter__(self):
+        for index in range(len(self.offsets)):
+            yield self[index]
+
+    def __contains__(self, path):
+        return self.locate(path)[1]
+
+    def index(self, path):
+        index, found = self.locate(path)
+        if not found:
+            raise ValueError(f"{path} is not in the playlist")
+        return index
+
+    def bisect(self, path):
+        # Index of the path, or the index it would get
+        return self.locate(path)[0]
+
+    def locate(self, path):
+        # (index the path has or would get, whether it is there)
+        prefix, name = split_path(path)
+        prefix_key = natural_key(prefix)
+        block = bisect_left(self.block_keys, prefix_key)
+        if block == len(self.block_keys) or self.block_keys[block] != prefix_key:
+            return self.block_starts[block], False
+        key = natural_key(name)
+        index = self.bisect_block(block, key)
+        found = index < self.block_starts[block + 1] and self.key_at(index) == key
+        return index, found
+
+    def key_at(self, index):
+        offset = self.offsets[index]
+        return self.names[offset:offset + self.lengths[index]]
+
+    def bisect_block(self, block, key, low=None):
+        low = self.block_starts[block] if low is None else low
+        high = self.block_starts[block + 1]
+        names, offsets, lengths = self.names, self.offsets, self.lengths
+        while low < high:
+            middle = (low + high) // 2
+            offset = offsets[middle]
+            if names[offset:offset + lengths[middle]] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def directory_number(self, prefix):
+        number = self.directory_numbers.get(prefix)
+        if number is None:
+            number = self.directory_numbers[prefix] = len(self.directories)
+            self.directories.append(prefix)
+        return number
+
+    def extension_number(self, extension):
+        number = self.extension_numbers.get(extension)
+        if number is None:
+            # Only media extensions get this far; a byte per entry is plenty
+            number = self.extension_numbers[extension] = min(len(self.extensions), 255)
+            if number == len(self.extensions):
+                self.extensions.append(extension)
+        return number
+
+    def add(self, paths):
+        # Inserts paths in natural order; paths already there are not checked for. A directory that isn't
+        # in the playlist yet becomes a new block without comparing any names. Names for an existing block
+        # are bisected into it one by one, or, when there are many for its size, the block is sorted again.
+        names_by_prefix = defaultdict(list)
+        for path in paths:
+            prefix, name = split_path(path)
+            names_by_prefix[prefix].append(name)
+        if not names_by_prefix:
+            return
+        # (start, end, prefix key, directory number, sorted [(name key, extension number, offset)]); new
+        # names have no offset yet (-1), those already in the buffer keep theirs
+        splices = []
+        new_blocks = []
+        for prefix, names in names_by_prefix.items():
+            prefix_key = natural_key(prefix)
+            entries = sorted((natural_key(name), self.extension_number(extension_of(name)), -1) for name in names)
+            block = bisect_left(self.block_keys, prefix_key)
+            number = self.directory_number(prefix)
+            if block == len(self.block_keys) or self.block_keys[block] != prefix_key:
+                start = self.block_starts[block]
+                splices.append((start, start, prefix_key, number, entries))
+                new_blocks.append((prefix_key, number, len(entries)))
+                continue
+            start, end = self.block_starts[block], self.block_starts[block + 1]
+            self.block_sizes[block] += len(entries)
+            # Sorting the whole block again costs about as much per entry as one bisection step
+            if len(entries) * max(end - start, 1).bit_length() > end - start:
+                names = self.names
+                keys = [names[offset:offset + length]
+                        for offset, length in zip(self.offsets[start:end], self.lengths[start:end])]
+                entries = sorted(chain(zip(keys, self.entry_extensions[start:end], self.offsets[start:end]), entries))
+                splices.append((start, end, prefix_key, number, entries))
+                continue
+            position = start
+            run = []
+            for entry in entries:
+                index = self.bisect_block(block, entry[0], position)
+                if index != position and run:
+                    splices.append((position, position, prefix_key, number, run))
+                    run = []
+                position = index
+                run.append(entry)
+            splices.append((position, position, prefix_key, number, run))
+        for prefix_key, number, size in new_blocks:
+            block = bisect_left(self.block_keys, prefix_key)
+            self.block_keys.insert(block, prefix_key)
+            self.block_directories.insert(block, number)
+            self.block_sizes.insert(block, size)
+        self.splice(sorted(splices, key=lambda splice: splice[:3]))
+
+    def splice(self, splices):
+        # Rebuilds the entry arrays with each (start, end) range of the old ones replaced by new entries
+        offsets, lengths, entry_directories, entry_extensions = array('Q'), array('H'), array('I'), bytearray()
+        previous = 0
+        for start, end, _, number, entries in splices:
+            offsets += self.offsets[previous:start]
+            lengths += self.lengths[previous:start]
+            entry_directories += self.entry_directories[previous:start]
+            entry_extensions += self.entry_extensions[previous:start]
+            previous = end
+            if not entries:
+                continue
+            new_keys = [key for key, _, offset in entries if offset < 0]
+            new_offsets = accumulate(map(len, new_keys), initial=len(self.names))
+            self.names += b''.join(new_keys)
+            offsets.extend(offset if offset >= 0 else next(new_offsets) for _, _, offset in entries)
+            lengths.extend(len(key) for key, _, _ in entries)
+            entry_directories.extend(repeat(number, len(entries)))
+            entry_extensions.extend(extension for _, extension, _ in entries)
+        offsets += self.offsets[previous:]
+        lengths += self.lengths[previous:]
+        entry_directories += self.entry_directories[previous:]
+        entry_extensions += self.entry_extensions[previous:]
+        self.offsets, self.lengths = offsets, lengths
+        self.entry_directories, self.entry_extensions = entry_directories, entry_extensions
+        self.block_starts = [0] + list(accumulate(self.block_sizes))
+        self.changes += 1
+        if self.unused > len(self.names) // 2:
+            self.compact()
+
+    def remove(self, paths):
+        # Removes the paths that are in the playlist
+        indexes = sorted({index for index, found in map(self.locate, paths) if found})
+        if not indexes:
+            return
+        for index in indexes:
+            self.block_sizes[bisect_left(self.block_starts, index + 1) - 1] -= 1
+            self.unused += self.lengths[index]
+        for block in reversed(range(len(self.block_sizes))):
+            if not self.block_sizes[block]:
+                del self.block_keys[block], self.block_directories[block], self.block_sizes[block]
+        self.splice([(index, index + 1, None, 0, []) for index in indexes])
+
+    def compact(self):
+        # Drops the keys of removed names from the buffer; entries keep their order
+        self.names = bytearray(b''.join(self.key_at(index) for index in range(len(self.offsets))))
+        self.offsets = array('Q', accumulate(self.lengths[:-1], initial=0)) if len(self.lengths) else array('Q')
+        self.unused = 0
+
+    def state(self):
+        # The playlist as byte strings, in native byte order, for restore() to take back without sorting or
+        # decoding any names: the tables, the block layout and the entry arrays as they are
+        return [
+            "".join(directory + "\0" for directory in self.directories).encode('utf-8', 'surrogateescape'),
+            "".join(extension + "\0" for extension in self.extensions).encode('utf-8', 'surrogateescape'),
+            array('I', self.block_directories).tobytes(),
+            array('Q', self.block_sizes).tobytes(),
+            bytes(self.names),
+            self.offsets.tobytes(),
+            self.lengths.tobytes(),
+            self.entry_directories.tobytes(),
+            bytes(self.entry_extensions),
+        ]
+
+    def restore(self, state):
+        # Replaces the contents with what state() returned; raises ValueError if the parts don't fit together
+        directories, extensions, block_directories, block_sizes, names, offsets, lengths, entry_directories, \
+            entry_extensions = state
+        directories = bytes(directories).decode('utf-8', 'surrogateescape').split("\0")[:-1]
+        extensions = bytes(extensions).decode('utf-8', 'surrogateescape').split("\0")[:-1]
+        block_directories = array('I', bytes(block_directories)).tolist()
+        block_sizes = array('Q', bytes(block_sizes)).tolist()
+        offsets, lengths = array('Q', bytes(offsets)), array('H', bytes(lengths))
+        entry_directories, entry_extensions = array('I', bytes(entry_directories)), bytearray(entry_extensions)
+        count = len(offsets)
+        if (len(block_directories) != len(block_sizes) or sum(block_sizes) != count or len(lengths) != count
+                or len(entry_directories) != count or len(entry_extensions) != count
+                or any(number >= len(directories) for number in block_directories)
+                or entry_extensions.translate(None, bytes(range(len(extensions))))):
+            raise ValueError("inconsistent playlist state")
+        self.directories = directories
+        self.directory_numbers = {directory: number for number, directory in enumerate(directories)}
+        self.extensions = extensions
+        self.extension_numbers = {extension: number for number, extension in enumerate(extensions)}
+        self.block_keys = [natural_key(directories[number]) for number in block_directories]
+        self.block_directories = block_directories
+        self.block_sizes = block_sizes
+        self.block_starts = [0] + list(accumulate(block_sizes))
+        self.names = bytearray(names)
+        self.unused = len(self.names) - sum(lengths)
+        self.offsets, self.lengths = offsets, lengths
+        self.entry_directories, self.entry_extensions = entry_directories, entry_extensions
+        self.changes += 1
+
+    def paths_under(self, directory):
+        # Every path in the directory or below it
+        prefix = os.path.join(directory, '')
+        paths = []
+        for block, number in enumerate(self.block_directories):
+            if self.directories[number].startswith(prefix):
+                paths.extend(self[index] for index in range(self.block_starts[block], self.block_starts[block + 1]))
+        return paths
+
+    def extension_counts(self):
+        # Entries per extension, counted over one byte per entry
+        counts = {self.extensions[number]: self.entry_extensions.count(number) for number in range(len(self.extensions))}
+        return {extension: count for extension, count in counts.items() if count}
+
+    def indexes_with_extension(self, extensions):
+        # Indexes of the entries with any of the extensions, found by a byte scan rather than a pass over paths
+        numbers = {self.extension_numbers[e] for e in map(str.lower, extensions) if e in self.extension_numbers}
+        mask = self.entry_extensions.translate(bytes(number in numbers for number in range(256)))
+        return [match.start() for match in re.finditer(b'\x01', mask)]
@@ -0,0 +1,181 @@
+import sys
+import threading
+from collections import defaultdict
+from PyQt5 import sip
+from PyQt5.QtGui import QImage
+from metrics import metrics
+
+# The PIL modes images are shown in, and their QImage formats. PIL can map images of these modes
+# onto a numpy buffer (RGB can't be, but RGBX has the same pixels and the same memory inside PIL).
+# RGB images are kept as they are until they are display-sized, and only then converted to RGBX.
+PIL_FORMATS = {
+    'L': QImage.Format_Grayscale8,
+    'I;16': QImage.Format_Grayscale16,
+    'RGBX': QImage.Format_RGBX8888,
+    'RGBA': QImage.Format_RGBA8888,
+}
+
+# Qt's 32-bit formats are native 0xAARRGGBB words, i.e. OpenCV's B, G, R, A byte order on
+# little-endian machines. They are also what the raster engine paints from, so a pixmap is made
+# from them without converting (or even copying) the pixels.
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+class RenderStats:
+    # Per-stage allocation and copy counters for the frame/image render paths
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(lambda: {'allocations': 0, 'copies': 0, 'bytes': 0})
+
+    def record(self, stage, allocations=0, copies=0, nbytes=0):
+        with self.lock:
+            counts = self.counts[stage]
+            counts['allocations'] += allocations
+            counts['copies'] += copies
+            counts['bytes'] += nbytes
+
+    def snapshot(self):
+        with self.lock:
+            return {stage: dict(counts) for stage, counts in self.counts.items()}
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+render_stats = RenderStats()
+
+
+def fit_size(src_width, src_height, box_width, box_height):
+    # Largest size with the source aspect ratio that fits inside the box
+    # A pane squeezed to nothing still gets a 1x1 image rather than an error
+    box_width, box_height = max(box_width, 1), max(box_height, 1)
+    src_ratio = src_width / src_height
+    box_ratio = box_width / box_height
+
+    if src_ratio > box_ratio:
+        new_width = box_width
+        new_height = int(new_width / src_ratio)
+    else:
+        new_height = box_height
+        new_width = int(new_height * src_ratio)
+
+    return max(new_width, 1), max(new_height, 1)
+
+
+def wrap_array(array, image_format):
+    # QImage over the array's memory, no copy. Any row stride works (e.g. a crop of a bigger array),
+    # but the pixels within a row must be packed; otherwise (a channel slice, a flipped view) they are
+    # packed once here. The array is kept on the QImage so it outlives it; a queued signal would copy
+    # the QImage without the array, so pass the wrapper object itself.
+    height, width = array.shape[:2]
+    pixel_bytes = array.itemsize * (array.shape[2] if array.ndim == 3 else 1)
+    if (array.strides[1] != pixel_bytes or array.strides[0] < width * pixel_bytes
+            or (array.ndim == 3 and array.strides[2] != array.itemsize)):
+        array = array.copy()
+        render_stats.record('pack', allocations=1, copies=1, nbytes=array.nbytes)
+    qt_image = QImage(sip.voidptr(array.ctypes.data), width, height, array.strides[0], image_format)
+    qt_image.buffer = array
+    return qt_image
+
+
+def bgr_format(array):
+    # QImage format for an OpenCV array as it is, or None if its channels have to be reordered first
+    channels = array.shape[2] if array.ndim == 3 else 1
+    if channels == 1:
+        return QImage.Format_Grayscale8 if array.itemsize == 1 else QImage.Format_Grayscale16
+    if channels == 4 and LITTLE_ENDIAN:
+        return QImage.Format_ARGB32
+    return None
+
+
+def display_mode(image):
+    # The mode an image is kept in from decode to display: RGB or a PIL_FORMATS mode. Palette, alpha and
+    # colour-keyed images become RGBA, so transparency survives; CMYK, YCbCr and the like become RGBX
+    # rather than being misread as RGB.
+    mode = image.mode
+    if mode in PIL_FORMATS or mode == 'RGB':
+        return mode
+    if mode in ('LA', 'La', 'PA', 'RGBa') or 'transparency' in image.info:
+        return 'RGBA'
+    if mode == 'I' or mode.startswith('I;16'):
+        return 'I;16'
+    if mode in ('1', 'F'):
+        return 'L'
+    return 'RGBX'
+
+
+def display_image(image):
+    # Converted once, at decode time, so resizing works on real pixels (PIL can only resize
+    # palette images with nearest-neighbour) and exporting them needs no further conversion
+    mode = display_mode(image)
+    if mode == image.mode:
+        return image
+    render_stats.record('mode', allocations=1, copies=1)
+    return image.convert(mode)
+
+
+def export_pil_image(image):
+    # Copies the pixels of a display_mode() image straight into a new numpy buffer, by pasting them
+    # into a PIL image mapped onto that buffer. np.asarray() goes through tobytes(), which copies
+    # everything twice and is several times slower.
+    import numpy as np
+    from PIL import Image as PILImage
+    shape = (image.height, image.width, 4) if image.mode in ('RGBX', 'RGBA') else (image.height, image.width)
+    array = np.empty(shape, np.uint16 if image.mode == 'I;16' else np.uint8)
+    target = PILImage.frombuffer(image.mode, image.size, array, 'raw', image.mode, 0, 1)
+    target.readonly = 0  # Read-only protects the buffer's owner, and that's us; paste() would copy it otherwise
+    target.paste(image)
+    return array
+
+
+def render_bgr_frame(frame, width, height, kind='video'):
+    # Resize straight from the decoded frame, then one pass that adds the padding byte Qt's
+    # native 32-bit format wants. Qt gets that buffer as-is, and setPixmap doesn't copy it again.
+    # Grayscale and BGRA frames are wrapped as they are.
+    import cv2
+    frame_height, frame_width = frame.shape[:2]
+    new_width, new_height = fit_size(frame_width, frame_height, width, height)
+
+    # INTER_AREA is only fast for whole-number factors, so decimate by one (to a small
+    # intermediate) and finish with INTER_LINEAR, which doesn't alias below a factor of 2
+    factor = min(frame_width // new_width, frame_height // new_height)
+    with metrics.timed(kind + '.scale'):
+        if factor >= 2:
+            frame = cv2.resize(frame, (frame_width // factor, frame_height // factor), interpolation=cv2.INTER_AREA)
+            render_stats.record('scale', allocations=1, copies=1, nbytes=frame.nbytes)
+        scaled = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    render_stats.record('scale', allocations=1, copies=1, nbytes=scaled.nbytes)
+    image_format = bgr_format(scaled)
+    if image_format is None:
+        with metrics.timed(kind + '.convert'):
+            if LITTLE_ENDIAN:
+                scaled = cv2.cvtColor(scaled, cv2.COLOR_BGR2BGRA)
+                image_format = QImage.Format_RGB32
+                render_stats.record('convert', allocations=1, copies=1, nbytes=scaled.nbytes)
+            else:
+                # Byte-ordered formats instead, swapped in place
+                rgba = scaled.shape[2] == 4
+                cv2.cvtColor(scaled, cv2.COLOR_BGRA2RGBA if rgba else cv2.COLOR_BGR2RGB, dst=scaled)
+                image_format = QImage.Format_RGBA8888 if rgba else QImage.Format_RGB888
+                render_stats.record('convert')
+    return wrap_array(scaled, image_format)
+
+
+def render_pil_image(image, kind='image'):
+    # PIL keeps its pixels in its own storage, so exporting them is the one unavoidable copy.
+    # Images should already be in a display_mode(); anything else is converted here first.
+    image = display_image(image)
+    with metrics.timed(kind + '.convert'):
+        if image.mode == 'RGB':
+            # Only now, at display size: a full-size decode is never converted
+            image = image.convert('RGBX')
+            render_stats.record('mode', allocations=1, copies=1)
+        array = export_pil_image(image)
+    render_stats.record('export', allocations=1, copies=1, nbytes=array.nbytes)
+    return wrap_array(array, PIL_FORMATS[image.mode])
+
+
+def native_format(qt_image):
+    # Formats a pixmap takes over without converting the pixels
+    return qt_image.format() in (QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied)
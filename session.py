@@ -0,0 +1,188 @@
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+from directory_scanner import directory_mtime
+from thumbnail_index import DEFAULT_INDEX_DIR
+
+DEFAULT_SESSION_PATH = os.path.join(DEFAULT_INDEX_DIR, 'session.bin')
+MAGIC = b'MVSESSION\x01'
+COMPRESSION_LEVEL = 1  # Paths and natural keys compress several times over even at the fastest level
+
+
+def pack_chunks(chunks):
+    # Byte strings with their count and lengths in front, so they can be sliced apart without parsing
+    return struct.pack(f'<{len(chunks) + 1}Q', len(chunks), *map(len, chunks)) + b''.join(chunks)
+
+
+def unpack_chunks(data):
+    data = memoryview(data)
+    count, = struct.unpack_from('<Q', data)
+    lengths = struct.unpack_from(f'<{count}Q', data, 8)
+    chunks = []
+    position = 8 * (count + 1)
+    for length in lengths:
+        chunks.append(data[position:position + length])
+        position += length
+    if position != len(data):
+        raise ValueError("truncated session")
+    return chunks
+
+
+def pack_listings(listings):
+    # listings: (directory, pane number, mtime_ns, {path: inode}) as the watcher holds them
+    return pack_chunks([
+        "".join(directory + "\0" for directory, _, _, _ in listings).encode('utf-8', 'surrogateescape'),
+        array('I', [pane for _, pane, _, _ in listings]).tobytes(),
+        array('q', [-1 if mtime_ns is None else mtime_ns for _, _, mtime_ns, _ in listings]).tobytes(),
+        array('Q', [len(files) for _, _, _, files in listings]).tobytes(),
+        "".join(path + "\0" for _, _, _, files in listings for path in files).encode('utf-8', 'surrogateescape'),
+        array('Q', [inode for _, _, _, files in listings for inode in files.values()]).tobytes(),
+    ])
+
+
+def unpack_listings(data):
+    directories, panes, mtimes, counts, paths, inodes = unpack_chunks(data)
+    directories = bytes(directories).decode('utf-8', 'surrogateescape').split("\0")[:-1]
+    paths = bytes(paths).decode('utf-8', 'surrogateescape').split("\0")[:-1]
+    inodes = array('Q', bytes(inodes))
+    listings = []
+    start = 0
+    for directory, pane, mtime_ns, count in zip(directories, array('I', bytes(panes)), array('q', bytes(mtimes)),
+                                                array('Q', bytes(counts))):
+        listings.append((directory, pane, mtime_ns, dict(zip(paths[start:start + count], inodes[start:start + count]))))
+        start += count
+    return listings
+
+
+PANE_KEYS = {'directories': list, 'index': int, 'position': int, 'direction': int, 'seed': (int, type(None)),
+             'complete': bool}
+VIDEO_KEYS = {'index': int, 'position': int, 'seed': (int, type(None)), 'frame': int}
+SETTINGS_KEYS = {'panes': int, 'lockstep': bool, 'randomize_images': bool, 'randomize_videos': bool,
+                 'slideshow': bool, 'slideshow_interval': int, 'video_slideshow': bool,
+                 'video_slideshow_interval': int}
+
+
+def check_values(values, keys):
+    if not isinstance(values, dict):
+        raise TypeError(f"expected an object, got {type(values).__name__}")
+    for key, kind in keys.items():
+        value = values[key]
+        # bool is an int too, but never where a number is meant
+        if not isinstance(value, kind) or (isinstance(value, bool) and kind is int):
+            raise TypeError(f"{key} is {type(value).__name__}")
+        if kind is int and key != 'direction' and value < 0:
+            raise ValueError(f"{key} is negative")
+
+
+def check_state(state, playlists):
+    # Raises KeyError, TypeError or ValueError unless everything the viewer reads back from a session is
+    # there, with the type it was saved with, and there is one playlist per pane plus the videos', so a
+    # damaged file is rejected before anything is applied
+    check_values(state, {'recursive': bool, 'active_pane': int, 'panes': list, 'video': dict, 'settings': dict})
+    for pane in state['panes']:
+        check_values(pane, PANE_KEYS)
+        if not all(isinstance(directory, str) for directory in pane['directories']):
+            raise TypeError("directories must be paths")
+    check_values(state['video'], VIDEO_KEYS)
+    check_values(state['settings'], SETTINGS_KEYS)
+    if not 1 <= len(state['panes']) == state['settings']['panes']:
+        raise ValueError("pane count doesn't match the panes")
+    if len(playlists) != len(state['panes']) + 1:
+        raise ValueError("playlists don't match the panes")
+
+
+class SessionStore(QObject):
+    # The viewer's state in one compressed binary file: a small JSON part for positions and settings, the
+    # playlists as their packed arrays and the watcher's listings with each directory's mtime. The listings,
+    # most of the file, are compressed on their own, so only the session thread ever unpacks them. Writing
+    # happens on a thread of its own, into a temporary file renamed over the old one, so a crash mid-write
+    # keeps the previous session. Reading back needs no scan; only the directory mtimes are checked.
+    # (listings of directories unchanged since they were saved, saved listings of those that changed or are gone)
+    validated = pyqtSignal(list, list)
+
+    def __init__(self, path=DEFAULT_SESSION_PATH, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session")
+        self.pending_listings = None  # Listings read back and not applied yet; saved again as they were
+        self.saved = None  # What the last save covered, so an unchanged session isn't written again
+
+    def save(self, state, playlists, listings):
+        # state: a JSON-able dict; playlists: Playlist objects; listings: (directory, pane number, mtime_ns,
+        # {path: inode}). Only copies are taken here; packing, compressing and writing are left to the thread.
+        state = json.dumps(dict(state, byteorder=sys.byteorder), sort_keys=True)
+        signature = (state, [playlist.changes for playlist in playlists],
+                     [listing[:3] for listing in listings], self.pending_listings is not None)
+        if signature == self.saved:
+            return None
+        self.saved = signature
+        if self.pending_listings is not None:
+            listings = self.pending_listings
+        return self.executor.submit(self.write, state, [playlist.state() for playlist in playlists], listings)
+
+    def write(self, state, playlists, listings):
+        try:
+            if not isinstance(listings, bytes):
+                listings = zlib.compress(pack_listings(listings), COMPRESSION_LEVEL)
+            body = pack_chunks([state.encode('utf-8'), listings] + [pack_chunks(chunks) for chunks in playlists])
+            data = MAGIC + zlib.compress(body, COMPRESSION_LEVEL)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'wb') as f:
+                f.write(data)
+            os.replace(temporary_path, self.path)
+            return len(data)
+        except Exception as e:
+            print(f"Error: Unable to save the session to {self.path}: {e}")
+            return None
+
+    def load(self):
+        # (state, [playlist states]) from the file, or None if there is none or it can't be used. The saved
+        # listings are kept for validate().
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Error: Unable to read the session {self.path}: {e}")
+            return None
+        try:
+            if not data.startswith(MAGIC):
+                raise ValueError("not a session file")
+            state, listings, *playlists = unpack_chunks(zlib.decompress(memoryview(data)[len(MAGIC):]))
+            state = json.loads(bytes(state))
+            if state.get('byteorder') != sys.byteorder:
+                raise ValueError("saved on a machine with another byte order")
+            playlists = [unpack_chunks(chunks) for chunks in playlists]
+        except (ValueError, zlib.error, struct.error) as e:
+            print(f"Error: Unable to read the session {self.path}: {e}")
+            return None
+        self.pending_listings = bytes(listings)
+        return state, playlists
+
+    def validate(self):
+        # Checks every saved directory's mtime on the session thread and reports through validated
+        return self.executor.submit(self.check, self.pending_listings)
+
+    def check(self, data):
+        try:
+            listings = unpack_listings(zlib.decompress(data))
+            unchanged = []
+            changed = []
+            for listing in listings:
+                directory, _, mtime_ns, _ = listing
+                (unchanged if directory_mtime(directory) == mtime_ns else changed).append(listing)
+            self.validated.emit(unchanged, changed)
+        except (ValueError, zlib.error, struct.error) as e:
+            print(f"Error: Unable to check the saved directories: {e}")
+            self.validated.emit([], [])
+
+    def close(self):
+        # Waits for a save that is still being written
+        self.executor.shutdown(wait=True)
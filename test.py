@@ -8,6 +8,7 @@ from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtCore import QTimer, Qt
 from PIL import Image as PILImage
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 
 class MediaViewer(QMainWindow):
@@ -103,6 +104,19 @@ class MediaViewer(QMainWindow):
         self.image_timer.timeout.connect(self.update_image)
         self.video_timer = QTimer()
         self.video_timer.timeout.connect(self.update_video)
+        # Opens the next video's capture and decodes its first frame while the current one plays, so the
+        # GUI thread never waits for either
+        self.open_executor = ThreadPoolExecutor(max_workers=1)
+        self.next_cap = (None, None, None)  # (index, path, Future of (VideoCapture, first frame or None))
+
+        # While the window is dragged the labels just stretch what they have (setScaledContents);
+        # once the size settles the current image and video frame are re-rendered from memory
+        self.resize_timer = QTimer()
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.finish_resize)
+        self.current_image = None
+        self.last_frame = None
 
         self.loop_video_checkbox = QCheckBox("Loop Video")
         self.video_layout.addWidget(self.loop_video_checkbox)
@@ -142,8 +156,13 @@ class MediaViewer(QMainWindow):
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        self.update_image()
-        self.update_video()
+        self.resize_timer.start()
+
+    def finish_resize(self):
+        if self.current_image is not None:
+            self.render_image(self.current_image)
+        if self.last_frame is not None:
+            self.render_video_frame(self.last_frame, smooth=True)
 
     def show_image(self, index):
         if not self.image_files:
@@ -160,7 +179,12 @@ class MediaViewer(QMainWindow):
             index = 0
 
         file_path = self.image_files[index]
-        image = PILImage.open(file_path)
+        self.current_image = PILImage.open(file_path)
+        self.current_image.load()
+        self.render_image(self.current_image)
+        self.current_image_index = index
+
+    def render_image(self, image):
         img_width, img_height = image.size
 
         # Resize image to fit within the image label
@@ -181,7 +205,6 @@ class MediaViewer(QMainWindow):
         pixmap = QPixmap.fromImage(qt_image)
 
         self.image_label.setPixmap(pixmap)
-        self.current_image_index = index
 
     def show_video(self, index):
         if not self.video_files:
@@ -199,7 +222,16 @@ class MediaViewer(QMainWindow):
         if hasattr(self, 'cap'):
             self.cap.release()
 
-        self.cap = cv2.VideoCapture(file_path)
+        self.last_frame = None
+        # The next video is opened while this one plays; use it if that's the one asked for
+        next_index, next_path, next_cap = self.next_cap
+        self.next_cap = (None, None, None)
+        if next_index == index and next_path == file_path:
+            self.cap, first_frame = next_cap.result()
+        else:
+            if next_cap is not None:
+                next_cap.add_done_callback(lambda future: future.result()[0].release())
+            self.cap, first_frame = cv2.VideoCapture(file_path), None
         if not self.cap.isOpened():
             print(f"Error: Unable to open video file {file_path}")
             return
@@ -212,8 +244,23 @@ class MediaViewer(QMainWindow):
             print(f"Video FPS: {self.fps}")
 
         self.video_timer.start(int(1000 / self.fps))
+        if first_frame is not None:
+            self.last_frame = cv2.cvtColor(first_frame, cv2.COLOR_BGR2RGB)
+            self.render_video_frame(self.last_frame)
 
         self.current_video_index = index
+        if len(self.video_files) > 1:
+            # Keyed on the position as well as the path: a reshuffle shows index 0 of the new order
+            # through here, so this is always the video that comes next in the order now playing
+            next_index = (index + 1) % len(self.video_files)
+            next_path = self.video_files[next_index]
+            self.next_cap = (next_index, next_path, self.open_executor.submit(self.open_capture, next_path))
+
+    def open_capture(self, file_path):
+        # Runs on open_executor
+        cap = cv2.VideoCapture(file_path)
+        ret, frame = cap.read() if cap.isOpened() else (False, None)
+        return cap, frame if ret else None
 
     def update_image(self):
         if self.slideshow_active:
@@ -223,28 +270,8 @@ class MediaViewer(QMainWindow):
         if hasattr(self, 'cap') and self.cap.isOpened():
             ret, frame = self.cap.read()
             if ret:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = frame.shape
-                qt_image = QImage(frame.data, w, h, ch * w, QImage.Format_RGB888)
-                pixmap = QPixmap.fromImage(qt_image)
-
-                # Resize video to fit within the video label
-                widget_width = self.video_label.width()
-                widget_height = self.video_label.height()
-                frame_width = pixmap.width()
-                frame_height = pixmap.height()
-                frame_ratio = frame_width / frame_height
-                widget_ratio = widget_width / widget_height
-
-                if frame_ratio > widget_ratio:
-                    new_width = widget_width
-                    new_height = int(new_width / frame_ratio)
-                else:
-                    new_height = widget_height
-                    new_width = int(new_height * frame_ratio)
-
-                pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio)
-                self.video_label.setPixmap(pixmap)
+                self.last_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                self.render_video_frame(self.last_frame)
             else:
                 print("End of video reached.")
                 if self.loop_video_checkbox.isChecked():
@@ -255,10 +282,34 @@ class MediaViewer(QMainWindow):
                     self.video_timer.stop()
 
                     if self.video_slideshow_active:
-                        QTimer.singleShot(1000, self.next_video)
+                        self.next_video()
                     else:
                         print("Video ends without slideshow.")
 
+    def render_video_frame(self, frame, smooth=False):
+        h, w, ch = frame.shape
+        qt_image = QImage(frame.data, w, h, ch * w, QImage.Format_RGB888)
+        pixmap = QPixmap.fromImage(qt_image)
+
+        # Resize video to fit within the video label
+        widget_width = self.video_label.width()
+        widget_height = self.video_label.height()
+        frame_width = pixmap.width()
+        frame_height = pixmap.height()
+        frame_ratio = frame_width / frame_height
+        widget_ratio = widget_width / widget_height
+
+        if frame_ratio > widget_ratio:
+            new_width = widget_width
+            new_height = int(new_width / frame_ratio)
+        else:
+            new_height = widget_height
+            new_width = int(new_height * frame_ratio)
+
+        transformation = Qt.SmoothTransformation if smooth else Qt.FastTransformation
+        pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio, transformation)
+        self.video_label.setPixmap(pixmap)
+
     def prev_image(self):
         self.current_image_index = (self.current_image_index - 1) % len(self.image_files)
         self.show_image(self.current_image_index)
@@ -336,6 +387,19 @@ class MediaViewer(QMainWindow):
                 print("Current video restarted.")
 
 
+    def closeEvent(self, event):
+        # The pre-opened capture is released once it has opened; shutdown waits for that
+        self.video_timer.stop()
+        next_cap = self.next_cap[2]
+        self.next_cap = (None, None, None)
+        if next_cap is not None:
+            next_cap.add_done_callback(lambda future: future.result()[0].release())
+        self.open_executor.shutdown()
+        if hasattr(self, 'cap'):
+            self.cap.release()
+        super().closeEvent(event)
+
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     viewer = MediaViewer()
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from PyQt5.QtWidgets import QListView
+from PyQt5.QtGui import QPixmap, QImage, QColor
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QThread, pyqtSignal
+from thumbnail_index import make_entry
+
+GRID_THUMBNAIL_SIZE = 160
+
+
+def pixmap_size(pixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class ThumbnailGridModel(QAbstractListModel):
+    thumbnail_ready = pyqtSignal(int, str, QImage)
+    trim_requested = pyqtSignal('qint64')  # Bytes to free; pixmaps may only be dropped on the GUI thread
+
+    def __init__(self, file_paths, executor, index_for=None, max_pixmaps=2000, max_pending=1024, parent=None):
+        super().__init__(parent)
+        self.file_paths = file_paths
+        self.executor = executor
+        self.index_for = index_for  # file path -> ThumbnailIndex or None
+        self.max_pixmaps = max_pixmaps
+        self.max_pending = max_pending
+        self.pixmaps = OrderedDict()  # file path -> QPixmap, least recently shown first
+        self.pixmap_bytes = 0
+        self.pending = OrderedDict()  # file path -> Future, oldest request first
+        self.placeholder = QPixmap(GRID_THUMBNAIL_SIZE, GRID_THUMBNAIL_SIZE)
+        self.placeholder.fill(QColor(48, 48, 48))
+        self.thumbnail_ready.connect(self.add_thumbnail)
+        self.trim_requested.connect(self.trim)
+
+    def set_file_paths(self, file_paths):
+        self.beginResetModel()
+        self.file_paths = file_paths
+        self.endResetModel()
+
+    def refresh(self):
+        # The playlist was merged into in place; relayout without a reset so the scroll position survives
+        self.layoutAboutToBeChanged.emit()
+        self.layoutChanged.emit()
+
+    def invalidate(self, file_paths):
+        # Thumbnails of files that changed on disk are loaded again the next time they're on screen
+        for file_path in file_paths:
+            pixmap = self.pixmaps.pop(file_path, None)
+            if pixmap is not None:
+                self.pixmap_bytes -= pixmap_size(pixmap)
+            future = self.pending.pop(file_path, None)
+            if future is not None:
+                future.cancel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.file_paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        # The view only asks for rows that are on screen, so only those get thumbnails
+        if not index.isValid() or index.row() >= len(self.file_paths):
+            return None
+        file_path = self.file_paths[index.row()]
+        if role == Qt.DecorationRole:
+            pixmap = self.pixmaps.get(file_path)
+            if pixmap is not None:
+                self.pixmaps.move_to_end(file_path)
+                return pixmap
+            self.request_thumbnail(index.row(), file_path)
+            return self.placeholder
+        if role == Qt.ToolTipRole:
+            return file_path
+        return None
+
+    def request_thumbnail(self, row, file_path):
+        if file_path in self.pending:
+            return
+        # When scrolling fast, rows requested a while ago are off screen again, so drop the oldest jobs
+        while len(self.pending) >= self.max_pending:
+            _, future = self.pending.popitem(last=False)
+            future.cancel()
+        self.pending[file_path] = self.executor.submit(self.load_thumbnail, row, file_path)
+
+    def load_thumbnail(self, row, file_path):
+        # Runs on the worker pool; the index makes this a single SQLite read for known files
+        index = self.index_for(file_path) if self.index_for else None
+        try:
+            entry = index.ensure(file_path) if index is not None else make_entry(file_path)
+        except Exception as e:
+            print(f"Unable to create thumbnail for {file_path}: {e}")
+            entry = None
+        image = QImage.fromData(entry[6]) if entry is not None and entry[6] is not None else QImage()
+        self.thumbnail_ready.emit(row, file_path, image)
+
+    def add_thumbnail(self, row, file_path, image):
+        self.pending.pop(file_path, None)
+        if image.isNull():
+            return
+        pixmap = QPixmap.fromImage(image.scaled(
+            GRID_THUMBNAIL_SIZE, GRID_THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        old = self.pixmaps.pop(file_path, None)
+        if old is not None:
+            self.pixmap_bytes -= pixmap_size(old)
+        self.pixmaps[file_path] = pixmap
+        self.pixmap_bytes += pixmap_size(pixmap)
+        while len(self.pixmaps) > self.max_pixmaps:
+            self.pixmap_bytes -= pixmap_size(self.pixmaps.popitem(last=False)[1])
+
+        # Rows may have shifted while the job ran (e.g. a scan batch came in); then just repaint what's visible
+        if row < len(self.file_paths) and self.file_paths[row] == file_path:
+            first = last = self.index(row)
+        else:
+            first, last = self.index(0), self.index(len(self.file_paths) - 1)
+        self.dataChanged.emit(first, last, [Qt.DecorationRole])
+
+    def evict_bytes(self, nbytes):
+        # For the memory budget, from any thread. Pixmaps may only be dropped on the GUI thread; from any other
+        # the trim is queued and hasn't freed anything yet, so the budget goes on to the other holders
+        if QThread.currentThread() is self.thread():
+            return self.trim(nbytes)
+        self.trim_requested.emit(nbytes)
+        return 0
+
+    def trim(self, nbytes):
+        # Least recently shown first; rows on screen just ask for theirs again. Returns the bytes freed
+        freed = 0
+        while freed < nbytes and self.pixmaps:
+            size = pixmap_size(self.pixmaps.popitem(last=False)[1])
+            self.pixmap_bytes -= size
+            freed += size
+        return freed
+
+    def cancel(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+
+class ThumbnailGrid(QListView):
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setViewMode(QListView.IconMode)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setUniformItemSizes(True)  # Lets the view lay out 100k+ rows without asking for each one
+        self.setLayoutMode(QListView.Batched)
+        self.setIconSize(QSize(GRID_THUMBNAIL_SIZE, GRID_THUMBNAIL_SIZE))
+        self.setGridSize(QSize(GRID_THUMBNAIL_SIZE + 8, GRID_THUMBNAIL_SIZE + 8))
+        self.setSpacing(4)
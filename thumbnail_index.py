@@ -0,0 +1,156 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from directory_scanner import VIDEO_EXTENSIONS, ANIMATION_EXTENSIONS
+from render import fit_size
+
+THUMBNAIL_SIZE = (256, 256)
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'image_viewer')
+
+
+def index_path_for_root(root, index_dir=DEFAULT_INDEX_DIR):
+    # One database per scanned root, kept out of the (possibly read-only) media directory
+    root = os.path.abspath(root)
+    digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(index_dir, f"{os.path.basename(root) or 'root'}-{digest}.sqlite")
+
+
+def encode_thumbnail(image, thumbnail_size=THUMBNAIL_SIZE):
+    from PIL import Image as PILImage
+    image.thumbnail(thumbnail_size, PILImage.Resampling.BILINEAR)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def make_entry(file_path, thumbnail_size=THUMBNAIL_SIZE):
+    # Returns (path, size, mtime_ns, width, height, format, thumbnail) for one file.
+    # Kept at module level so it can also run in worker processes.
+    from PIL import Image as PILImage
+    stat = os.stat(file_path)
+
+    if file_path.lower().endswith(VIDEO_EXTENSIONS) and not file_path.lower().endswith(ANIMATION_EXTENSIONS):
+        import cv2  # Only here, so indexing images never loads OpenCV
+        cap = cv2.VideoCapture(file_path)
+        try:
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            ret, frame = cap.read()
+        finally:
+            cap.release()
+        thumbnail = None
+        if ret:
+            thumbnail = encode_thumbnail(PILImage.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), thumbnail_size)
+        image_format = os.path.splitext(file_path)[1][1:].upper()
+    else:
+        with PILImage.open(file_path) as image:
+            width, height = image.size
+            image_format = image.format
+            image.draft('RGB', thumbnail_size)  # JPEG: decode at 1/8 scale when possible
+            thumbnail = encode_thumbnail(image, thumbnail_size)
+
+    return file_path, stat.st_size, stat.st_mtime_ns, width, height, image_format, thumbnail
+
+
+def entry_from_image(file_path, image, thumbnail_size=THUMBNAIL_SIZE):
+    # The same entry as make_entry(), from an image already decoded for display by load_source_image().
+    # The image itself is left untouched.
+    from PIL import Image as PILImage
+    width, height = image.info.get('full_size', image.size)
+    new_width, new_height = fit_size(image.width, image.height, *thumbnail_size)
+    stat = os.stat(file_path)
+    thumbnail = image.resize((min(new_width, image.width), min(new_height, image.height)),
+                             PILImage.Resampling.BILINEAR, reducing_gap=2.0)
+    return (file_path, stat.st_size, stat.st_mtime_ns, width, height, image.info.get('format'),
+            encode_thumbnail(thumbnail, thumbnail_size))
+
+
+class ThumbnailIndex:
+    def __init__(self, root, index_dir=DEFAULT_INDEX_DIR):
+        self.root = os.path.abspath(root)
+        os.makedirs(index_dir, exist_ok=True)
+        self.path = index_path_for_root(self.root, index_dir)
+        self.lock = threading.Lock()  # One connection, shared by the GUI thread and workers
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "width INTEGER, height INTEGER, format TEXT, thumbnail BLOB)")
+        self.connection.commit()
+
+    def contains(self, file_path):
+        return os.path.abspath(file_path).startswith(os.path.join(self.root, ''))
+
+    def lookup(self, file_path, stat=None):
+        # Returns the stored entry, or None if it is missing or the file changed since
+        if stat is None:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return None
+        with self.lock:
+            if self.connection is None:
+                return None
+            row = self.connection.execute(
+                "SELECT path, size, mtime_ns, width, height, format, thumbnail FROM media WHERE path = ?",
+                (file_path,)).fetchone()
+        if row is None or row[1] != stat.st_size or row[2] != stat.st_mtime_ns:
+            return None
+        return row
+
+    def known(self):
+        # path -> (size, mtime_ns) of every stored entry, to find what is missing or stale in one query
+        with self.lock:
+            if self.connection is None:
+                return {}
+            return {row[0]: (row[1], row[2])
+                    for row in self.connection.execute("SELECT path, size, mtime_ns FROM media")}
+
+    def ensure(self, file_path):
+        entry = self.lookup(file_path)
+        if entry is None:
+            try:
+                entry = make_entry(file_path)
+            except Exception as e:
+                print(f"Unable to index {file_path}: {e}")
+                return None
+            self.put([entry])
+        return entry
+
+    def add_image(self, file_path, image):
+        # Indexes a file from its display decode, so showing it costs no second decode
+        if self.lookup(file_path) is not None:
+            return
+        try:
+            entry = entry_from_image(file_path, image)
+        except Exception as e:
+            print(f"Unable to index {file_path}: {e}")
+            return
+        self.put([entry])
+
+    def put(self, entries):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.executemany("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?)", entries)
+            self.connection.commit()
+
+    def remove(self, file_paths):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.connection.executemany("DELETE FROM media WHERE path = ?", [(p,) for p in file_paths])
+            self.connection.commit()
+
+    def close(self):
+        # Workers may still finish a job after this, so later calls become no-ops
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
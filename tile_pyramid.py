@@ -0,0 +1,273 @@
+import hashlib
+import os
+import shutil
+import threading
+from PyQt5.QtGui import QImage
+from image_cache import file_cache_key
+from memory_budget import memory_budget
+from render import display_image, display_mode, fit_size, wrap_array
+from thumbnail_index import DEFAULT_INDEX_DIR
+
+TILE_SIZE = 256
+STRIP_ROWS = 512  # Levels are written this many rows at a time, never as a second full-size copy
+DEFAULT_TILE_DIR = os.path.join(DEFAULT_INDEX_DIR, 'tiles')
+MAX_TILE_DIR_BYTES = 4 * 1024 ** 3
+# Scans and stitched panoramas are what the pyramid is for, and PIL's decompression-bomb guard refuses
+# anything past ~180 MP. Raised (it still warns past 1 GP and refuses past 2 GP), not switched off.
+MAX_IMAGE_PIXELS = 1 << 30
+# PIL modes the levels are stored in, by number of channels
+LEVEL_MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+# Bytes per pixel of the raw layouts whose row stride files may leave out
+RAW_PIXEL_BYTES = {'L': 1, 'RGB': 3, 'RGBA': 4, 'CMYK': 4}
+
+build_lock = threading.Lock()  # One build at a time, so two full-resolution decodes never overlap
+
+
+def pyramid_path(file_path, tile_dir=DEFAULT_TILE_DIR):
+    # Keyed by path, mtime and size like the image caches: a rewritten file gets a new pyramid
+    key = "\0".join(str(part) for part in file_cache_key(os.path.abspath(file_path)))
+    return os.path.join(tile_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def level_path(directory, level):
+    return os.path.join(directory, f"level_{level}.npy")
+
+
+def open_large_image(file_path):
+    # PIL is only imported once the first image is opened, so its guard is raised here rather than at import
+    from PIL import Image as PILImage
+    PILImage.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    return PILImage.open(file_path)
+
+
+def decoded_bytes(image):
+    # What PIL allocates for a full decode: 4 bytes a pixel for every multi-band 8-bit mode
+    return image.width * image.height * (4 if len(image.getbands()) > 1 else 2 if image.mode == 'I;16' else 1)
+
+
+def raw_strips(image, rows=STRIP_ROWS):
+    # The rows of an uncompressed file (raw TIFF, PPM...) as strips of about `rows` rows, each of which
+    # can be read on its own: [(top, bottom, [(first row, last row, file offset)])], plus the rawmode and
+    # row stride. None where the pixels are compressed (PNG, most TIFFs) or laid out in any other way;
+    # those can only be decoded in one go.
+    runs = []
+    rawmode = stride = None
+    for name, (x0, y0, x1, y1), offset, args in image.tile:
+        args = args if isinstance(args, tuple) else (args,)
+        tile_rawmode, tile_stride, orientation = (args + (0, 1))[:3]
+        if name != 'raw' or (x0, x1) != (0, image.width) or orientation != 1 or rawmode not in (None, tile_rawmode):
+            return None
+        rawmode = tile_rawmode
+        stride = tile_stride or (image.width * RAW_PIXEL_BYTES.get(rawmode, 0) if rawmode == image.mode else 0)
+        if not stride:
+            return None
+        runs.append((y0, y1, offset))
+    runs.sort()
+    if not runs or runs[0][0] != 0 or runs[-1][1] != image.height or any(
+            a[1] != b[0] for a, b in zip(runs, runs[1:])):
+        return None
+    # Strips start at multiples of rows, whatever the file's own strips are
+    strips = [(top, min(top + rows, image.height), []) for top in range(0, image.height, rows)]
+    for y0, y1, offset in runs:
+        top = y0
+        while top < y1:
+            bottom = min(y1, (top // rows + 1) * rows)
+            strips[top // rows][2].append((top, bottom, offset + (top - y0) * stride))
+            top = bottom
+    return strips, rawmode, stride
+
+
+def decode_strips(file_path, rows=STRIP_ROWS):
+    # Yields (top, strip image) down the whole image. Uncompressed files are read one strip at a time;
+    # anything else is decoded in full once, counted in the memory budget for as long as it lives.
+    from PIL import Image as PILImage
+    with open_large_image(file_path) as image:
+        layout = raw_strips(image, rows)
+        if layout is None:
+            with memory_budget.reserve('full_decode', decoded_bytes(image)):
+                image.load()
+                for top in range(0, image.height, rows):
+                    yield top, image.crop((0, top, image.width, min(top + rows, image.height)))
+            return
+        mode, width = image.mode, image.width
+    strips, rawmode, stride = layout
+    with open(file_path, 'rb') as f:
+        for top, bottom, runs in strips:
+            strip = PILImage.new(mode, (width, bottom - top))
+            for first, last, offset in runs:
+                f.seek(offset)
+                data = f.read((last - first) * stride)
+                strip.paste(PILImage.frombytes(mode, (width, last - first), data, 'raw', rawmode, stride),
+                            (0, first - top))
+            yield top, strip
+
+
+def load_reduced_image(file_path, width, height):
+    # For images too big to decode whole just to fit a window, in a format without reduced decoding
+    # (PNG, TIFF...): the matching level of the image's tile pyramid if zooming built one already,
+    # otherwise the image reduced by a whole factor strip by strip as it is decoded
+    from PIL import Image as PILImage
+    directory = pyramid_path(file_path)
+    if os.path.exists(level_path(directory, 0)):
+        return TilePyramid(directory).image_for_size(width, height)
+    with open_large_image(file_path) as image:
+        full_width, full_height = image.size
+        mode = display_mode(image)
+    new_width, new_height = fit_size(full_width, full_height, width, height)
+    factor = max(1, min(full_width // new_width, full_height // new_height))
+    reduced = PILImage.new(mode, (-(-full_width // factor), -(-full_height // factor)))
+    # Strips a whole number of factors high, so reducing them one by one gives the same pixels as reducing
+    # the whole image; each is reduced before it's converted, so only the small result is
+    for top, strip in decode_strips(file_path, max(STRIP_ROWS // factor, 1) * factor):
+        if strip.mode in ('P', '1'):
+            strip = display_image(strip)  # Palette indexes can't be averaged
+        if strip.mode == 'I;16':  # No reduce() for it; a box filter is the same thing
+            strip = strip.resize((-(-strip.width // factor), -(-strip.height // factor)), PILImage.Resampling.BOX)
+        else:
+            strip = strip.reduce(factor)
+        reduced.paste(display_image(strip), (0, top // factor))
+    return reduced
+
+
+def write_level_zero(file_path, directory):
+    # The image, decoded and copied into the level file a strip at a time. Strips are converted to
+    # their display mode one by one too, so a palette or CMYK scan never exists twice in memory.
+    import numpy as np
+    with open_large_image(file_path) as image:
+        width, height = image.size
+        channels = {'RGBA': 4, 'L': 1, 'I;16': 1}.get(display_mode(image), 3)
+    level = np.lib.format.open_memmap(level_path(directory, 0), mode='w+', dtype=np.uint8,
+                                      shape=(height, width, channels)[:2 if channels == 1 else 3])
+    for top, strip in decode_strips(file_path):
+        if strip.mode != 'RGB':
+            strip = display_image(strip)
+        strip = np.asarray(strip)
+        if strip.dtype == np.uint16:
+            strip = strip >> 8  # 16-bit grayscale is shown as 8-bit anyway
+        level[top:top + len(strip)] = strip[..., :3] if channels == 3 else strip
+    level.flush()
+    return level
+
+
+def write_next_level(level, directory, number):
+    # Half the size of the previous level; INTER_AREA over whole strips is a 2x2 box filter
+    import cv2
+    import numpy as np
+    height, width = level.shape[:2]
+    new_width, new_height = (width + 1) // 2, (height + 1) // 2
+    next_level = np.lib.format.open_memmap(level_path(directory, number), mode='w+', dtype=np.uint8,
+                                           shape=(new_height, new_width) + level.shape[2:])
+    for top in range(0, new_height, STRIP_ROWS):
+        bottom = min(top + STRIP_ROWS, new_height)
+        next_level[top:bottom] = cv2.resize(np.ascontiguousarray(level[top * 2:bottom * 2]),
+                                            (new_width, bottom - top), interpolation=cv2.INTER_AREA)
+    next_level.flush()
+    return next_level
+
+
+def build_pyramid(file_path, directory):
+    # Decodes the file once and writes every level into a temporary directory, renamed into place
+    # when complete, so an interrupted build is never mistaken for a pyramid
+    temporary = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    try:
+        level = write_level_zero(file_path, temporary)
+        number = 0
+        while max(level.shape[:2]) > TILE_SIZE:
+            number += 1
+            level = write_next_level(level, temporary, number)
+        del level
+        os.replace(temporary, directory)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+
+
+def directory_size(directory):
+    try:
+        with os.scandir(directory) as entries:
+            return sum(entry.stat().st_size for entry in entries)
+    except OSError:
+        return 0
+
+
+def prune_pyramids(tile_dir, max_bytes, keep):
+    # Least recently opened pyramids go first; opening one touches its directory
+    try:
+        with os.scandir(tile_dir) as entries:
+            directories = [(entry.stat().st_mtime, entry.path) for entry in entries if entry.is_dir()]
+    except OSError:
+        return
+    sizes = {path: directory_size(path) for _, path in directories}
+    total = sum(sizes.values())
+    for _, path in sorted(directories):
+        if total <= max_bytes:
+            break
+        if path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+
+
+def open_pyramid(file_path, tile_dir=DEFAULT_TILE_DIR, max_bytes=MAX_TILE_DIR_BYTES):
+    # The file's pyramid from the tile cache, built first if there is none. Slow the first time
+    # (a decode plus writing every level), so call it off the GUI thread. Only zooming builds one.
+    directory = pyramid_path(file_path, tile_dir)
+    if not os.path.exists(level_path(directory, 0)):
+        with build_lock:
+            if not os.path.exists(level_path(directory, 0)):
+                os.makedirs(tile_dir, exist_ok=True)
+                build_pyramid(file_path, directory)
+                prune_pyramids(tile_dir, max_bytes, keep=directory)
+    os.utime(directory)
+    return TilePyramid(directory)
+
+
+class TilePyramid:
+    # Level 0 is the full image, each next level half the size of the one before, down to a single tile.
+    # Every level is a memory-mapped .npy file, so only the pages of tiles that are looked at are read,
+    # and the OS can drop them again under memory pressure.
+    def __init__(self, directory):
+        import numpy as np
+        self.levels = []
+        while os.path.exists(level_path(directory, len(self.levels))):
+            self.levels.append(np.load(level_path(directory, len(self.levels)), mmap_mode='r'))
+        self.height, self.width = self.levels[0].shape[:2]
+        self.channels = self.levels[0].shape[2] if self.levels[0].ndim == 3 else 1
+
+    def level_scale(self, level):
+        return self.levels[level].shape[1] / self.width
+
+    def level_for_scale(self, scale):
+        # Smallest level that still has at least one pixel per screen pixel at this scale
+        for level in range(len(self.levels) - 1, 0, -1):
+            if self.level_scale(level) >= scale:
+                return level
+        return 0
+
+    def tile_counts(self, level):
+        height, width = self.levels[level].shape[:2]
+        return -(-width // TILE_SIZE), -(-height // TILE_SIZE)
+
+    def tile(self, level, column, row):
+        # One tile as a QImage QPainter draws without converting: 32-bit BGRA, premultiplied if it has
+        # alpha. Reading it pages it in from the file, so call this on a worker thread.
+        import cv2
+        pixels = self.levels[level][row * TILE_SIZE:(row + 1) * TILE_SIZE, column * TILE_SIZE:(column + 1) * TILE_SIZE]
+        if self.channels == 1:
+            return wrap_array(cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGRA), QImage.Format_RGB32)
+        if self.channels == 3:
+            return wrap_array(cv2.cvtColor(pixels, cv2.COLOR_RGB2BGRA), QImage.Format_RGB32)
+        premultiplied = cv2.cvtColor(pixels, cv2.COLOR_RGBA2mRGBA)
+        cv2.cvtColor(premultiplied, cv2.COLOR_RGBA2BGRA, dst=premultiplied)
+        return wrap_array(premultiplied, QImage.Format_ARGB32_Premultiplied)
+
+    def image_for_size(self, width, height):
+        # The smallest level that covers a width x height box, as a PIL image over the mapped file
+        from PIL import Image as PILImage
+        new_width, new_height = fit_size(self.width, self.height, width, height)
+        for level in reversed(self.levels):
+            level_height, level_width = level.shape[:2]
+            if (level_width >= new_width and level_height >= new_height) or level is self.levels[0]:
+                mode = LEVEL_MODES[self.channels]
+                return PILImage.frombuffer(mode, (level_width, level_height), level, 'raw', mode, 0, 1)
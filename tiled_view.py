@@ -0,0 +1,200 @@
+from PyQt5.QtWidgets import QWidget, QSizePolicy
+from PyQt5.QtGui import QPainter
+from PyQt5.QtCore import Qt, QPointF, QRect, QRectF, pyqtSignal
+from image_cache import LRUCache
+from memory_budget import memory_budget, CACHED
+from tile_pyramid import TILE_SIZE, open_pyramid
+
+MAX_ZOOM = 8.0  # Screen pixels per image pixel
+ZOOM_STEP = 1.25  # Per wheel notch
+
+
+class TiledImageView(QWidget):
+    # Zoom and pan over an image's tile pyramid. Only the tiles on screen, from the level that matches
+    # the zoom, are read (on the worker pool) and kept, so memory doesn't grow with the image.
+    # The wheel zooms around the cursor, dragging pans, a double-click switches between fit and 1:1.
+    # Both signals carry wrapper objects, not QImages: a queued QImage would lose the array it is drawn from.
+    pyramid_ready = pyqtSignal(str, object, object)  # file path, TilePyramid (None if it failed), preview
+    tile_ready = pyqtSignal(object, object)  # (file path, level, column, row), QImage
+
+    def __init__(self, executor, pyramid_executor, cache_bytes=64 * 1024 * 1024, parent=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.pyramid_executor = pyramid_executor  # Builds can take seconds; they mustn't hold up tile reads
+        self.tiles = LRUCache(cache_bytes)
+        self.memory_holder = memory_budget.register_cache('tiles', CACHED, self.tiles)
+        self.pending = {}  # tile key -> Future
+        self.file_path = None
+        self.pyramid = None
+        self.preview = None  # The smallest level (a single tile), drawn under the sharp tiles until they arrive
+        self.message = ""
+        self.scale = 1.0  # Screen pixels per image pixel
+        self.center = QPointF()  # Image point in the middle of the view
+        self.fitted = True
+        self.drag_position = None
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.setCursor(Qt.OpenHandCursor)
+        self.pyramid_ready.connect(self.set_pyramid)
+        self.tile_ready.connect(self.add_tile)
+
+    def open(self, file_path):
+        if file_path == self.file_path:
+            return
+        self.close_image()
+        self.file_path = file_path
+        self.message = "Building tiles..."
+        self.pyramid_executor.submit(self.load_pyramid, file_path)
+
+    def load_pyramid(self, file_path):
+        # Runs on the pyramid executor; the signal is queued to the GUI thread
+        try:
+            pyramid = open_pyramid(file_path)
+            preview = pyramid.tile(len(pyramid.levels) - 1, 0, 0)
+        except Exception as e:
+            print(f"Error: Unable to build tiles for {file_path}: {e}")
+            pyramid = preview = None
+        self.pyramid_ready.emit(file_path, pyramid, preview)
+
+    def set_pyramid(self, file_path, pyramid, preview):
+        if file_path != self.file_path:
+            return  # Another image was opened meanwhile
+        self.pyramid = pyramid
+        self.preview = preview
+        self.message = "" if pyramid is not None else "Unable to zoom into this image"
+        if pyramid is not None:
+            self.fit()
+        self.update()
+
+    def close_image(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.tiles.clear()
+        self.file_path = self.pyramid = self.preview = None
+        self.message = ""
+        self.update()
+
+    def close_view(self):
+        # For good: the tiles are dropped and no longer count against the memory budget
+        self.close_image()
+        memory_budget.unregister(self.memory_holder)
+
+    def fit_scale(self):
+        return min(self.width() / self.pyramid.width, self.height() / self.pyramid.height)
+
+    def fit(self):
+        self.scale = self.fit_scale()
+        self.center = QPointF(self.pyramid.width / 2, self.pyramid.height / 2)
+        self.fitted = True
+        self.update()
+
+    def zoom(self, factor, anchor):
+        # The image point under anchor (a view position) stays where it is
+        scale = min(max(self.scale * factor, min(self.fit_scale(), 1.0)), MAX_ZOOM)
+        offset = anchor - QPointF(self.width() / 2, self.height() / 2)
+        point = self.center + offset / self.scale
+        self.scale = scale
+        self.center = point - offset / scale
+        self.fitted = False
+        self.clamp_center()
+        self.update()
+
+    def clamp_center(self):
+        # Panning stops once an edge of the image reaches the middle of the view
+        self.center = QPointF(min(max(self.center.x(), 0), self.pyramid.width),
+                              min(max(self.center.y(), 0), self.pyramid.height))
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        if self.pyramid is None:
+            painter.drawText(self.rect(), Qt.AlignCenter, self.message)
+            return
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        origin_x = self.width() / 2 - self.center.x() * self.scale
+        origin_y = self.height() / 2 - self.center.y() * self.scale
+        painter.drawImage(QRectF(origin_x, origin_y, self.pyramid.width * self.scale,
+                                 self.pyramid.height * self.scale), self.preview)
+
+        level = self.pyramid.level_for_scale(self.scale)
+        visible = set()
+        if level < len(self.pyramid.levels) - 1:
+            tile_scale = self.scale / self.pyramid.level_scale(level)  # Screen pixels per level pixel
+            columns, rows = self.pyramid.tile_counts(level)
+            first_column = max(0, int(-origin_x / tile_scale // TILE_SIZE))
+            last_column = min(columns - 1, int((self.width() - origin_x) / tile_scale // TILE_SIZE))
+            first_row = max(0, int(-origin_y / tile_scale // TILE_SIZE))
+            last_row = min(rows - 1, int((self.height() - origin_y) / tile_scale // TILE_SIZE))
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    key = (self.file_path, level, column, row)
+                    visible.add(key)
+                    image = self.tiles.get(key)
+                    if image is None:
+                        self.request_tile(key)
+                        continue
+                    # Edges are rounded the same way for neighbouring tiles, so there are no seams
+                    left = round(origin_x + column * TILE_SIZE * tile_scale)
+                    top = round(origin_y + row * TILE_SIZE * tile_scale)
+                    right = round(origin_x + (column * TILE_SIZE + image.width()) * tile_scale)
+                    bottom = round(origin_y + (row * TILE_SIZE + image.height()) * tile_scale)
+                    painter.drawImage(QRect(left, top, right - left, bottom - top), image)
+
+        # Tiles that were scrolled or zoomed away before they were read aren't read at all
+        for key in [key for key in self.pending if key not in visible]:
+            self.pending.pop(key).cancel()
+
+    def request_tile(self, key):
+        if key not in self.pending:
+            self.pending[key] = self.executor.submit(self.load_tile, self.pyramid, key)
+
+    def load_tile(self, pyramid, key):
+        # Runs on the worker pool
+        try:
+            self.tile_ready.emit(key, pyramid.tile(*key[1:]))
+        except Exception as e:
+            print(f"Error: Unable to read tile {key[1:]} of {key[0]}: {e}")
+
+    def add_tile(self, key, image):
+        self.pending.pop(key, None)
+        if key[0] == self.file_path:
+            self.tiles.put(key, image)
+            self.update()
+
+    def resizeEvent(self, event):
+        if self.pyramid is not None:
+            if self.fitted:
+                self.fit()
+            else:
+                self.clamp_center()
+        super().resizeEvent(event)
+
+    def wheelEvent(self, event):
+        if self.pyramid is not None:
+            self.zoom(ZOOM_STEP ** (event.angleDelta().y() / 120), QPointF(event.pos()))
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_position = event.pos()
+            self.setCursor(Qt.ClosedHandCursor)
+        super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if self.drag_position is not None and self.pyramid is not None:
+            delta = event.pos() - self.drag_position
+            self.drag_position = event.pos()
+            self.center -= QPointF(delta) / self.scale
+            self.fitted = False
+            self.clamp_center()
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_position = None
+        self.setCursor(Qt.OpenHandCursor)
+        super().mouseReleaseEvent(event)
+
+    def mouseDoubleClickEvent(self, event):
+        if self.pyramid is not None:
+            if self.fitted:
+                self.zoom(1.0 / self.scale, QPointF(event.pos()))
+            else:
+                self.fit()
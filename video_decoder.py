@@ -0,0 +1,405 @@
+import threading
+import time
+from collections import deque
+from directory_scanner import ANIMATION_EXTENSIONS
+from metrics import metrics
+from render import display_image, fit_size, render_bgr_frame, render_pil_image, render_stats
+
+
+class PresentationClock:
+    # Media time in seconds, derived from the monotonic clock so it never drifts with timer jitter
+    def __init__(self):
+        self.origin = None  # monotonic time at media position 0
+        self.paused_position = None
+
+    def start(self, position=0.0):
+        self.origin = time.monotonic() - position
+        self.paused_position = None
+
+    def is_started(self):
+        return self.origin is not None
+
+    def is_running(self):
+        return self.origin is not None and self.paused_position is None
+
+    def position(self):
+        if self.paused_position is not None:
+            return self.paused_position
+        if self.origin is None:
+            return 0.0
+        return time.monotonic() - self.origin
+
+    def pause(self):
+        if self.is_running():
+            self.paused_position = self.position()
+
+    def resume(self):
+        if self.paused_position is not None:
+            self.start(self.paused_position)
+
+
+class FrameDecoder(threading.Thread):
+    # Decodes, converts and scales frames on its own thread into a small ring buffer.
+    # The GUI thread only takes ready frames with next_frame().
+    # Subclasses provide decode_frame(), seek_source() and close_source(), and set fps and frame_count.
+    SKIPPED = object()
+
+    def __init__(self, file_path, width, height, buffer_size=8, drop_when_full=False, clock=None):
+        super().__init__(name="frame-decoder", daemon=True)
+        self.file_path = file_path
+        self.fps = 30
+        self.frame_count = 0
+        self.clock = clock if clock is not None else PresentationClock()
+
+        self.target_size = (width, height)
+        self.buffer_size = buffer_size
+        # Back-pressure: either the decoder waits for the GUI (default) or it overwrites the oldest frame
+        self.drop_when_full = drop_when_full
+        self.frames = deque()  # (pts in seconds, frame number, QImage), oldest first
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.finished_decoding = False
+        self.seek_to = None
+
+        self.decoded = 0
+        self.presented = 0
+        self.presented_pts = 0.0  # Timestamp of the frame shown last
+        self.presented_frame = 0  # Its number in the file, to seek back to
+        self.underruns = 0
+        self.overwritten = 0
+        self.dropped = 0  # Decoded but too late to present
+        self.skipped = 0  # Too late already when grabbed, so never converted or scaled
+        self.peak_occupancy = 0
+        self.presented_since = None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and self.seek_to is None and (
+                        self.finished_decoding or (len(self.frames) >= self.buffer_size and not self.drop_when_full)):
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                if self.seek_to is not None:
+                    self.seek_source(self.seek_to)
+                    self.seek_to = None
+                    self.frames.clear()
+                    self.finished_decoding = False
+                width, height = self.target_size
+
+            # The expensive part runs without the lock, so the GUI can keep taking frames
+            result = self.decode_frame(width, height)
+            if result is self.SKIPPED:
+                self.skipped += 1
+                continue
+
+            with self.condition:
+                if self.seek_to is not None:
+                    continue  # Frame belongs to the old position
+                if result is None:
+                    self.finished_decoding = True
+                else:
+                    if len(self.frames) >= self.buffer_size:
+                        self.frames.popleft()
+                        self.overwritten += 1
+                    self.frames.append(result)
+                    self.decoded += 1
+                    self.peak_occupancy = max(self.peak_occupancy, len(self.frames))
+                self.condition.notify_all()
+
+        self.close_source()
+
+    def is_late(self, pts):
+        return self.clock.is_running() and pts < self.clock.position() - 1 / self.tick_rate()
+
+    def tick_rate(self):
+        # How often per second the GUI should look for a due frame; the frame rate, for constant-rate video
+        return self.fps
+
+    def decode_frame(self, width, height):
+        # Returns (pts in seconds, frame number, QImage), SKIPPED for a late frame that wasn't converted,
+        # or None at the end
+        raise NotImplementedError
+
+    def seek_source(self, frame_number):
+        raise NotImplementedError
+
+    def close_source(self):
+        pass
+
+    def next_frame(self):
+        # Called from the GUI thread. Returns the frame that is due at the clock's current position,
+        # dropping frames that are already late, or None if nothing is due (or ready) yet.
+        with self.condition:
+            if not self.frames:
+                if not self.finished_decoding:
+                    self.underruns += 1
+                return None
+
+            if not self.clock.is_started():
+                # First frame (or after a seek): the clock starts at its timestamp
+                self.clock.start(self.frames[0][0])
+                if self.presented_since is None:
+                    self.presented_since = time.monotonic()
+            elif not self.clock.is_running():
+                return None  # Paused
+
+            position = self.clock.position()
+            if self.frames[0][0] > position:
+                return None
+            pts, frame_number, image = self.frames.popleft()
+            while self.frames and self.frames[0][0] <= position:
+                pts, frame_number, image = self.frames.popleft()
+                self.dropped += 1
+            self.presented += 1
+            self.presented_pts = pts
+            self.presented_frame = frame_number
+            self.condition.notify_all()
+            return image
+
+    def achieved_fps(self):
+        # Frames per second between the first presented frame and now
+        if self.presented_since is None or self.presented < 2:
+            return 0.0
+        return (self.presented - 1) / max(time.monotonic() - self.presented_since, 1e-6)
+
+    def at_end(self):
+        with self.condition:
+            return self.finished_decoding and not self.frames
+
+    def set_target_size(self, width, height):
+        # Applies to frames decoded from now on; buffered frames keep their size
+        self.target_size = (width, height)
+
+    def seek(self, frame_number):
+        with self.condition:
+            self.seek_to = frame_number
+            self.frames.clear()
+            self.clock.origin = None  # Restarted by the first frame at the new position
+            self.condition.notify_all()
+
+    def occupancy(self):
+        return len(self.frames)
+
+    def buffered_bytes(self):
+        with self.condition:
+            return sum(image.sizeInBytes() for _, _, image in self.frames)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.is_alive():
+            self.join()
+        else:
+            self.close_source()
+
+
+class VideoDecoder(FrameDecoder):
+    def __init__(self, file_path, width, height, **kwargs):
+        super().__init__(file_path, width, height, **kwargs)
+        # OpenCV is imported with the first video, so an image-only session never loads it
+        import cv2
+        self.cap = cv2.VideoCapture(file_path)
+        if self.cap.isOpened():
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+            self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.fps <= 0:
+            self.fps = 30  # Default to 30 FPS if unable to get FPS
+        self.decode_buffer = None  # Reused by retrieve() so decoding doesn't allocate a frame each time
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def decode_frame(self, width, height):
+        start = time.perf_counter()
+        if not self.cap.grab():
+            return None
+        pts, frame_number = self.frame_pts()
+        if self.is_late(pts):
+            # Already late: skip colour conversion and scaling, try to catch up with the clock
+            metrics.add('video.decode', time.perf_counter() - start)
+            return self.SKIPPED
+        ret, frame = self.cap.retrieve(self.decode_buffer)
+        metrics.add('video.decode', time.perf_counter() - start)
+        if not ret:
+            return None
+        if frame is not self.decode_buffer:
+            render_stats.record('decode', allocations=1, nbytes=frame.nbytes)
+            self.decode_buffer = frame
+        render_stats.record('decode', copies=1)
+        return pts, frame_number, render_bgr_frame(frame, width, height)
+
+    def frame_pts(self):
+        # Timestamp and number of the frame just grabbed; some backends don't report the timestamp,
+        # so it falls back to the frame number
+        import cv2
+        msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        frame_number = max(int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1, 0)
+        if msec > 0 or frame_number <= 0:
+            return msec / 1000, frame_number
+        return frame_number / self.fps, frame_number
+
+    def seek_source(self, frame_number):
+        import cv2
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+
+    def close_source(self):
+        self.cap.release()
+
+
+def frame_duration(info):
+    # Like browsers, treat missing or near-zero GIF delays as 100 ms
+    duration = info.get('duration') or 0
+    return duration if duration > 10 else 100
+
+
+class AnimationDecoder(FrameDecoder):
+    # GIF, animated WebP and APNG through PIL, decoded lazily one frame at a time,
+    # so only the ring buffer is ever in memory. Each frame keeps its own duration.
+    def __init__(self, file_path, width, height, loop=True, **kwargs):
+        super().__init__(file_path, width, height, **kwargs)
+        self.loop = loop
+        from PIL import Image as PILImage
+        try:
+            self.image = PILImage.open(file_path)
+        except OSError as e:
+            print(f"Error: Unable to open animation {file_path}: {e}")
+            self.image = None
+            return
+        self.frame_count = getattr(self.image, 'n_frames', 1)
+        # Reported as the animation's frame rate: the first frame's, then the average over the frames
+        # decoded so far. The clock follows each frame's own duration; the GUI polls at 25 fps at least.
+        self.fps = 1000 / frame_duration(self.image.info)
+        self.tick_fps = max(self.fps, 25)
+        self.frame_index = 0
+        self.frames_timed = 0  # Frames whose durations add up to next_pts
+        self.next_pts = 0.0
+
+    def is_opened(self):
+        return self.image is not None
+
+    def tick_rate(self):
+        return self.tick_fps
+
+    def decode_frame(self, width, height):
+        from PIL import Image as PILImage
+        if self.frame_index >= self.frame_count:
+            if not self.loop or self.frame_count < 2:
+                return None
+            # Timestamps keep counting up across loops, so the clock never has to jump back
+            self.frame_index = 0
+
+        start = time.perf_counter()
+        try:
+            self.image.seek(self.frame_index)
+        except EOFError:
+            self.frame_count = self.frame_index
+            return None
+        pts = self.next_pts
+        frame_number = self.frame_index
+        self.next_pts += frame_duration(self.image.info) / 1000
+        self.frame_index += 1
+        self.frames_timed += 1
+        self.fps = self.frames_timed / self.next_pts
+        if self.is_late(pts):
+            metrics.add('video.decode', time.perf_counter() - start)
+            return self.SKIPPED
+
+        # Palette frames are expanded once, at the source size; transparency survives as RGBA
+        frame = display_image(self.image)
+        metrics.add('video.decode', time.perf_counter() - start)  # PIL decodes lazily, partly in convert()
+        new_width, new_height = fit_size(frame.width, frame.height, width, height)
+        with metrics.timed('video.scale'):
+            frame = frame.resize((new_width, new_height), PILImage.Resampling.BILINEAR, reducing_gap=2.0)
+        return pts, frame_number, render_pil_image(frame, kind='video')
+
+    def seek_source(self, frame_number):
+        self.frame_index = min(frame_number, max(self.frame_count - 1, 0))
+        self.frames_timed = self.frame_index
+        self.next_pts = 0.0
+        for index in range(self.frame_index):
+            self.image.seek(index)
+            self.next_pts += frame_duration(self.image.info) / 1000
+
+    def close_source(self):
+        if self.image is not None:
+            self.image.close()
+
+
+def open_decoder(file_path, width, height, loop=True, **kwargs):
+    # GIF/WebP/APNG are streamed through PIL with per-frame durations, everything else through OpenCV.
+    # Animations loop unless loop is False, e.g. in a slideshow, which moves on when a file ends.
+    if file_path.lower().endswith(ANIMATION_EXTENSIONS):
+        return AnimationDecoder(file_path, width, height, loop=loop, **kwargs)
+    return VideoDecoder(file_path, width, height, **kwargs)
+
+
+def stop_prerolled(future):
+    try:
+        decoder = future.result()
+    except Exception:
+        return
+    if decoder is not None:
+        decoder.stop()
+
+
+class VideoPreroller:
+    # Opens the video that plays next and decodes its first frames into the decoder's buffer while the
+    # current one still plays, so switching to it shows a frame at once. One pre-roll at a time; a
+    # pre-roll for another file, or a switch to a video that wasn't pre-rolled, drops it.
+    def __init__(self, executor):
+        self.executor = executor
+        self.file_path = None
+        self.future = None  # -> started decoder, or None if the file couldn't be opened
+        self.hits = 0
+        self.misses = 0
+
+    def preroll(self, file_path, width, height, buffer_size=8, loop=True):
+        if file_path == self.file_path:
+            return
+        self.cancel()
+        self.file_path = file_path
+        self.future = self.executor.submit(self.open, file_path, width, height, buffer_size, loop)
+
+    def open(self, file_path, width, height, buffer_size, loop):
+        # Runs on the worker pool. The decoder fills its buffer and then waits: never in drop mode
+        # here, or it would decode the whole file into a buffer nobody reads.
+        decoder = open_decoder(file_path, width, height, loop=loop, buffer_size=buffer_size)
+        if not decoder.is_opened():
+            decoder.stop()
+            return None
+        decoder.start()
+        return decoder
+
+    def buffered_bytes(self):
+        future = self.future
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return 0
+        decoder = future.result()
+        return decoder.buffered_bytes() if decoder is not None else 0
+
+    def take(self, file_path):
+        # The pre-rolled decoder for file_path, or None. One that is still opening is waited for,
+        # which is no slower than opening the file again.
+        if self.future is None or file_path != self.file_path:
+            self.cancel()
+            self.misses += 1
+            return None
+        future = self.future
+        self.file_path = self.future = None
+        try:
+            decoder = future.result()
+        except Exception as e:
+            print(f"Error: Unable to pre-roll {file_path}: {e}")
+            decoder = None
+        if decoder is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return decoder
+
+    def cancel(self):
+        if self.future is not None and not self.future.cancel():
+            self.future.add_done_callback(stop_prerolled)
+        self.file_path = self.future = None
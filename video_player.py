@@ -99,6 +99,15 @@ class MediaViewer(QMainWindow):
         self.video_timer = QTimer()
         self.video_timer.timeout.connect(self.update_video)
 
+        # While the window is dragged the labels just stretch what they have (setScaledContents);
+        # once the size settles the current image and video frame are re-rendered from memory
+        self.resize_timer = QTimer()
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(150)
+        self.resize_timer.timeout.connect(self.finish_resize)
+        self.current_image = None
+        self.last_frame = None
+
         self.load_directories()
 
     def load_directories(self):
@@ -127,10 +136,13 @@ class MediaViewer(QMainWindow):
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        if self.image_label.pixmap():
-            self.show_image(self.current_image_index)
-        if self.video_label.pixmap():
-            self.show_video(self.current_video_index)
+        self.resize_timer.start()
+
+    def finish_resize(self):
+        if self.current_image is not None:
+            self.render_image(self.current_image)
+        if self.last_frame is not None:
+            self.render_video_frame(self.last_frame, smooth=True)
 
     def show_image(self, index):
         if not self.image_files:
@@ -147,7 +159,12 @@ class MediaViewer(QMainWindow):
             index = 0
 
         file_path = self.image_files[index]
-        image = PILImage.open(file_path)
+        self.current_image = PILImage.open(file_path)
+        self.current_image.load()
+        self.render_image(self.current_image)
+        self.current_image_index = index
+
+    def render_image(self, image):
         img_width, img_height = image.size
 
         # Resize image to fit within the image label
@@ -168,7 +185,6 @@ class MediaViewer(QMainWindow):
         pixmap = QPixmap.fromImage(qt_image)
 
         self.image_label.setPixmap(pixmap)
-        self.current_image_index = index
 
     def show_video(self, index):
         if not self.video_files:
@@ -186,6 +202,7 @@ class MediaViewer(QMainWindow):
         if hasattr(self, 'cap'):
             self.cap.release()
 
+        self.last_frame = None
         self.cap = cv2.VideoCapture(file_path)
         if not self.cap.isOpened():
             print(f"Error: Unable to open video file {file_path}")
@@ -209,34 +226,38 @@ class MediaViewer(QMainWindow):
         if hasattr(self, 'cap') and self.cap.isOpened():
             ret, frame = self.cap.read()
             if ret:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = frame.shape
-                qt_image = QImage(frame.data, w, h, ch * w, QImage.Format_RGB888)
-                pixmap = QPixmap.fromImage(qt_image)
-
-                # Resize video to fit within the video label
-                widget_width = self.video_label.width()
-                widget_height = self.video_label.height()
-                frame_width = pixmap.width()
-                frame_height = pixmap.height()
-                frame_ratio = frame_width / frame_height
-                widget_ratio = widget_width / widget_height
-
-                if frame_ratio > widget_ratio:
-                    new_width = widget_width
-                    new_height = int(new_width / frame_ratio)
-                else:
-                    new_height = widget_height
-                    new_width = int(new_height * frame_ratio)
-
-                pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio)
-                self.video_label.setPixmap(pixmap)
+                self.last_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                self.render_video_frame(self.last_frame)
 
                 if self.cap.get(cv2.CAP_PROP_POS_FRAMES) == self.cap.get(cv2.CAP_PROP_FRAME_COUNT) and not self.loop_video_checkbox.isChecked():
                     self.cap.release()
                     self.video_timer.stop()
                     print("Video ended.")
 
+    def render_video_frame(self, frame, smooth=False):
+        h, w, ch = frame.shape
+        qt_image = QImage(frame.data, w, h, ch * w, QImage.Format_RGB888)
+        pixmap = QPixmap.fromImage(qt_image)
+
+        # Resize video to fit within the video label
+        widget_width = self.video_label.width()
+        widget_height = self.video_label.height()
+        frame_width = pixmap.width()
+        frame_height = pixmap.height()
+        frame_ratio = frame_width / frame_height
+        widget_ratio = widget_width / widget_height
+
+        if frame_ratio > widget_ratio:
+            new_width = widget_width
+            new_height = int(new_width / frame_ratio)
+        else:
+            new_height = widget_height
+            new_width = int(new_height * frame_ratio)
+
+        transformation = Qt.SmoothTransformation if smooth else Qt.FastTransformation
+        pixmap = pixmap.scaled(new_width, new_height, Qt.KeepAspectRatio, transformation)
+        self.video_label.setPixmap(pixmap)
+
     def restart_video(self):
         if hasattr(self, 'cap'):
             self.cap.release()
@@ -0,0 +1,120 @@
+from PyQt5.QtWidgets import QWidget, QSlider, QLabel, QHBoxLayout
+from PyQt5.QtCore import Qt, pyqtSignal
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class VideoScrubber(QWidget):
+    # Seek bar for the playing video. The video's keyframe index is loaded (or built and cached) on
+    # its own executor; while the handle is dragged the closest of its stored previews (keyframes about
+    # a second apart) is shown at once, and only the release (or a click on the groove) seeks the
+    # decoder to the exact frame.
+    index_ready = pyqtSignal(str, object)  # file path, KeyframeIndex (None if it failed)
+    scrub_started = pyqtSignal()
+    preview_ready = pyqtSignal(object)  # QImage of the stored preview closest to the handle
+    seek_requested = pyqtSignal(int)  # Exact frame number
+
+    def __init__(self, executor, parent=None):
+        super().__init__(parent)
+        self.executor = executor  # Building an index decodes the whole video once; keep it off the worker pool
+        self.file_path = None
+        self.index = None
+        self.fps = 30
+        self.preview_frame = None  # Frame of the preview on screen, so dragging within one GOP doesn't redecode it
+
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setEnabled(False)
+        self.slider.sliderPressed.connect(self.scrub_started)
+        self.slider.valueChanged.connect(self.move_to)
+        self.slider.sliderReleased.connect(self.release)
+        self.time_label = QLabel()
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.slider)
+        layout.addWidget(self.time_label)
+        self.index_ready.connect(self.set_index)
+
+    def open(self, file_path, frame_count, fps):
+        # frame_count and fps are the container's own figures, used until the index is there
+        if file_path == self.file_path:
+            return
+        self.file_path = file_path
+        self.index = None
+        self.fps = fps
+        self.preview_frame = None
+        self.set_range(frame_count)
+        self.executor.submit(self.load_index, file_path)
+
+    def load_index(self, file_path):
+        # Runs on the index executor; the signal is queued to the GUI thread. A video that was
+        # switched away from stops its build, and the next time it is played starts it again.
+        from keyframe_index import open_keyframe_index  # numpy and OpenCV, not needed before a video plays
+        stopped = lambda: file_path != self.file_path
+        if stopped():
+            return
+        try:
+            index = open_keyframe_index(file_path, stopped=stopped,
+                                        scanned=lambda index: self.index_ready.emit(file_path, index))
+        except Exception as e:
+            print(f"Error: Unable to index keyframes of {file_path}: {e}")
+            index = None
+        if index is not None:
+            self.index_ready.emit(file_path, index)
+
+    def set_index(self, file_path, index):
+        if file_path != self.file_path:
+            return  # Another video was opened meanwhile
+        self.index = index
+        self.set_range(index.frame_count)
+
+    def close_video(self):
+        self.file_path = self.index = None
+        self.set_range(0)
+
+    def set_range(self, frame_count):
+        self.slider.blockSignals(True)
+        self.slider.setRange(0, max(frame_count - 1, 0))
+        self.slider.setPageStep(max(frame_count // 20, 1))
+        self.slider.blockSignals(False)
+        self.slider.setEnabled(frame_count > 1)
+        self.update_time_label()
+
+    def time_of(self, frame_number):
+        return self.index.time_of(frame_number) if self.index is not None else frame_number / self.fps
+
+    def duration(self):
+        return self.index.duration if self.index is not None else (self.slider.maximum() + 1) / self.fps
+
+    def set_position(self, seconds):
+        # Follows playback; left alone while the handle is held
+        if self.slider.isSliderDown():
+            return
+        frame_number = self.index.frame_at(seconds) if self.index is not None else int(seconds * self.fps)
+        self.slider.blockSignals(True)
+        self.slider.setValue(frame_number)
+        self.slider.blockSignals(False)
+        self.update_time_label()
+
+    def update_time_label(self):
+        self.time_label.setText(f"{format_time(self.time_of(self.slider.value()))} / {format_time(self.duration())}")
+
+    def move_to(self, frame_number):
+        self.update_time_label()
+        if not self.slider.isSliderDown():
+            self.seek_requested.emit(frame_number)  # Keyboard, wheel or a click on the groove
+            return
+        preview = self.index.preview(frame_number) if self.index is not None else None
+        if preview is not None and preview[0] != self.preview_frame:
+            self.preview_frame = preview[0]
+            self.preview_ready.emit(preview[1])
+
+    def release(self):
+        self.preview_frame = None
+        self.seek_requested.emit(self.slider.value())
+
+    def is_scrubbing(self):
+        return self.slider.isSliderDown()
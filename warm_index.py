@@ -0,0 +1,161 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from PyQt5.QtCore import QThread, pyqtSignal
+from directory_watcher import list_directory
+from thumbnail_index import DEFAULT_INDEX_DIR, THUMBNAIL_SIZE, ThumbnailIndex, make_entry
+
+
+def init_worker():
+    # One process per core already; OpenCV's own thread pool would only oversubscribe them
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def index_chunk(file_paths, thumbnail_size=THUMBNAIL_SIZE):
+    # Runs in a worker process: entries for the files that could be read, (path, error) for the rest
+    entries = []
+    failed = []
+    for file_path in file_paths:
+        try:
+            entries.append(make_entry(file_path, thumbnail_size))
+        except Exception as e:
+            failed.append((file_path, str(e)))
+    return entries, failed
+
+
+def list_media(root, recursive=False):
+    # Media files below root, in the form the scanner reports them
+    file_paths = []
+    pending = [root]
+    while pending:
+        files, subdirectories = list_directory(pending.pop())
+        file_paths.extend(files or ())
+        if recursive:
+            pending.extend(subdirectories)
+    return sorted(file_paths)
+
+
+def stale_files(index, file_paths):
+    # Files the index has no current entry for. Entries are committed a chunk at a time,
+    # so this is also what makes an interrupted warm carry on where it stopped.
+    known = index.known()
+    stale = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        if known.get(file_path) != (stat.st_size, stat.st_mtime_ns):
+            stale.append(file_path)
+    return stale
+
+
+def warm_indexes(indexes, recursive=False, workers=None, chunk_size=32, progress=None, stopped=lambda: False):
+    # Fills the thumbnail indexes of several roots on a process pool: chunks of chunk_size files per
+    # task (one round trip each), at most two tasks per worker in flight, and all writes from this
+    # process. progress(done, total, failed, files/s) is called after every chunk.
+    # Returns (indexed, failed, already indexed, seconds).
+    start = time.monotonic()
+    chunks = []
+    skipped = 0
+    for index in indexes:
+        file_paths = list_media(index.root, recursive)
+        stale = stale_files(index, file_paths)
+        skipped += len(file_paths) - len(stale)
+        chunks.extend((index, stale[i:i + chunk_size]) for i in range(0, len(stale), chunk_size))
+    total = sum(len(chunk) for _, chunk in chunks)
+    done = failed = 0
+    if progress is not None:
+        progress(0, total, 0, 0.0)
+    if not chunks:
+        return 0, 0, skipped, time.monotonic() - start
+
+    # multiprocessing is only imported here: the viewer loads this module at startup but rarely warms
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    # spawn, not fork: forking a process that runs Qt and worker threads can deadlock the child
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=init_worker,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    running = {}  # Future -> index
+    try:
+        chunks.reverse()
+        while (chunks or running) and not stopped():
+            while chunks and len(running) < workers * 2:
+                index, chunk = chunks.pop()
+                running[executor.submit(index_chunk, chunk)] = index
+            finished, _ = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                entries, chunk_failed = future.result()
+                index.put(entries)
+                for file_path, error in chunk_failed:
+                    print(f"Unable to index {file_path}: {error}")
+                done += len(entries) + len(chunk_failed)
+                failed += len(chunk_failed)
+                if progress is not None:
+                    progress(done, total, failed, done / max(time.monotonic() - start, 1e-6))
+    finally:
+        # Chunks that are still running are finished but not written; the next warm redoes them
+        executor.shutdown(wait=True, cancel_futures=True)
+    return done - failed, failed, skipped, time.monotonic() - start
+
+
+class IndexWarmer(QThread):
+    # warm_indexes() on a background thread, for the GUI
+    # (files done, files to do, failed, files per second)
+    progress = pyqtSignal(int, int, int, float)
+    # (indexed, failed, already indexed, seconds)
+    warm_finished = pyqtSignal(int, int, int, float)
+
+    def __init__(self, indexes, recursive=False, workers=None, parent=None):
+        super().__init__(parent)
+        self.indexes = list(indexes)
+        self.recursive = recursive
+        self.workers = workers
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self):
+        try:
+            result = warm_indexes(self.indexes, self.recursive, self.workers,
+                                  progress=self.progress.emit, stopped=lambda: self.stopped)
+        except Exception as e:
+            print(f"Error: Unable to warm the thumbnail index: {e}")
+            result = (0, 0, 0, 0.0)
+        self.warm_finished.emit(*result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill the thumbnail and metadata index of media directories ahead of viewing them. "
+                    "Interrupted runs carry on where they stopped.")
+    parser.add_argument('directories', nargs='+')
+    parser.add_argument('--recursive', action='store_true')
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--chunk-size', type=int, default=32, help="Files per task sent to a worker")
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR)
+    args = parser.parse_args()
+
+    last_report = [0.0]
+
+    def report(done, total, failed, rate):
+        now = time.monotonic()
+        if now - last_report[0] >= 1 or done == total:
+            last_report[0] = now
+            print(f"Indexed {done}/{total} files ({rate:.0f} files/s), {failed} failed", flush=True)
+
+    indexes = [ThumbnailIndex(os.path.abspath(directory), args.index_dir) for directory in args.directories]
+    try:
+        indexed, failed, skipped, seconds = warm_indexes(indexes, args.recursive, args.workers, args.chunk_size,
+                                                         progress=report)
+        print(f"Done in {seconds:.1f}s: {indexed} indexed, {failed} failed, {skipped} already indexed")
+    except KeyboardInterrupt:
+        print("Interrupted; run again to carry on")
+    finally:
+        for index in indexes:
+            index.close()